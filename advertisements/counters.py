@@ -0,0 +1,235 @@
+"""
+عدادات الظهور والنقر للإعلانات.
+
+الأحداث تُجمع في ذاكرة العملية ({ad_id: [ظهورات، نقرات، آخر ظهور، آخر نقرة]})
+ويفرغها خيط خلفي كل FLUSH_INTERVAL ثانية في UPDATE واحد لكل دفعة:
+    impressions = impressions + CASE id WHEN ... END
+وآخر ظهور/نقرة بالقيمة الأكبر (Greatest). الزيادة داخل قاعدة البيانات
+فلا تضيع أحداث بين العمال، ولا يُقفل صف الإعلان مع كل طلب.
+
+نفس التفريغ يزيد عدادات الساعة في AdEventCount (events.py) لتقارير الفترات.
+
+اللوحات تعرض القيمة المحفوظة مضافاً إليها الفروق المعلقة في هذه العملية.
+"""
+import atexit
+import logging
+import os
+import threading
+
+from django.db import close_old_connections, transaction
+from django.db.models import Case, DateTimeField, F, IntegerField, Value, When
+from django.db.models.functions import Coalesce, Greatest
+
+logger = logging.getLogger(__name__)
+
+# ثوان بين كل تفريغ
+FLUSH_INTERVAL = 5
+
+# أقصى عدد إعلانات في UPDATE واحد
+FLUSH_BATCH_SIZE = 500
+
+IMPRESSIONS, CLICKS, LAST_IMPRESSION, LAST_CLICK = range(4)
+
+
+def later(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return max(a, b)
+
+
+def merge_delta(target, delta):
+    target[IMPRESSIONS] += delta[IMPRESSIONS]
+    target[CLICKS] += delta[CLICKS]
+    target[LAST_IMPRESSION] = later(target[LAST_IMPRESSION], delta[LAST_IMPRESSION])
+    target[LAST_CLICK] = later(target[LAST_CLICK], delta[LAST_CLICK])
+
+
+def count_case(deltas, index):
+    whens = [When(pk=pk, then=Value(delta[index])) for pk, delta in deltas.items() if delta[index]]
+    if not whens:
+        return None
+    return Case(*whens, default=Value(0), output_field=IntegerField())
+
+
+def latest_case(deltas, index, field):
+    whens = [When(pk=pk, then=Value(delta[index])) for pk, delta in deltas.items() if delta[index] is not None]
+    if not whens:
+        return None
+    timestamp = Case(*whens, default=F(field), output_field=DateTimeField())
+    # Greatest مع NULL: يعيد NULL في SQLite ويتجاهله في PostgreSQL
+    return Greatest(Coalesce(field, timestamp), Coalesce(timestamp, field))
+
+
+def hour_start(when):
+    return when.replace(minute=0, second=0, microsecond=0)
+
+
+def merge_buckets(target, buckets):
+    for key, counts in buckets.items():
+        current = target.get(key)
+        if current is None:
+            target[key] = counts
+        else:
+            current[0] += counts[0]
+            current[1] += counts[1]
+
+
+def apply_counter_deltas(deltas):
+    """كتابة الفروق بـ UPDATE واحد لكل FLUSH_BATCH_SIZE إعلان"""
+    from .models import Advertisement
+
+    items = list(deltas.items())
+    for start in range(0, len(items), FLUSH_BATCH_SIZE):
+        batch = dict(items[start:start + FLUSH_BATCH_SIZE])
+        changes = {}
+        impressions = count_case(batch, IMPRESSIONS)
+        if impressions is not None:
+            changes['impressions'] = F('impressions') + impressions
+        clicks = count_case(batch, CLICKS)
+        if clicks is not None:
+            changes['clicks'] = F('clicks') + clicks
+        last_impression = latest_case(batch, LAST_IMPRESSION, 'last_impression')
+        if last_impression is not None:
+            changes['last_impression'] = last_impression
+        last_click = latest_case(batch, LAST_CLICK, 'last_click')
+        if last_click is not None:
+            changes['last_click'] = last_click
+        if changes:
+            Advertisement.objects.filter(pk__in=list(batch)).update(**changes)
+
+
+def apply_bucket_deltas(buckets):
+    """زيادة عدادات الساعات في AdEventCount بدفعات FLUSH_BATCH_SIZE"""
+    from .events import increment_buckets
+
+    items = list(buckets.items())
+    for start in range(0, len(items), FLUSH_BATCH_SIZE):
+        increment_buckets(dict(items[start:start + FLUSH_BATCH_SIZE]))
+
+
+class AdCounterBuffer:
+    """فروق العدادات المعلقة لكل إعلان مع خيط تفريغ خلفي"""
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._deltas = {}
+        # {(ad_id, placement_id, بداية الساعة): [ظهورات، نقرات]}
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def _add(self, ads, index, last_index, when):
+        hour = hour_start(when)
+        with self._lock:
+            for ad in ads:
+                delta = self._deltas.get(ad.pk)
+                if delta is None:
+                    delta = self._deltas[ad.pk] = [0, 0, None, None]
+                delta[index] += 1
+                delta[last_index] = later(delta[last_index], when)
+
+                key = (ad.pk, ad.placement_id, hour)
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = self._buckets[key] = [0, 0]
+                bucket[index] += 1
+        self._ensure_thread()
+
+    def impression(self, ads, when):
+        """ظهور واحد لكل إعلان في ads - لا يلمس قاعدة البيانات"""
+        self._add(ads, IMPRESSIONS, LAST_IMPRESSION, when)
+
+    def click(self, ad, when):
+        self._add([ad], CLICKS, LAST_CLICK, when)
+
+    def pending(self, ad_id):
+        """(ظهورات، نقرات، آخر ظهور، آخر نقرة) غير المحفوظة بعد"""
+        with self._lock:
+            delta = self._deltas.get(ad_id)
+            return tuple(delta) if delta else (0, 0, None, None)
+
+    def pending_totals(self):
+        """(مجموع الظهورات، مجموع النقرات) غير المحفوظة"""
+        with self._lock:
+            return (
+                sum(delta[IMPRESSIONS] for delta in self._deltas.values()),
+                sum(delta[CLICKS] for delta in self._deltas.values()),
+            )
+
+    def apply_pending(self, ads):
+        """إضافة الفروق المعلقة إلى كائنات إعلانات للعرض (لا تُحفظ)"""
+        for ad in ads:
+            impressions, clicks, last_impression, last_click = self.pending(ad.pk)
+            ad.impressions += impressions
+            ad.clicks += clicks
+            ad.last_impression = later(ad.last_impression, last_impression)
+            ad.last_click = later(ad.last_click, last_click)
+        return ads
+
+    def flush(self):
+        """كتابة الفروق المعلقة؛ عند الفشل تعود للدمج مع الفروق الجديدة"""
+        with self._flush_lock:
+            with self._lock:
+                deltas, self._deltas = self._deltas, {}
+                buckets, self._buckets = self._buckets, {}
+            if not deltas:
+                return 0
+            try:
+                with transaction.atomic():
+                    apply_counter_deltas(deltas)
+                    apply_bucket_deltas(buckets)
+            except Exception:
+                logger.exception('Failed to flush counters for %d ads', len(deltas))
+                with self._lock:
+                    for ad_id, delta in deltas.items():
+                        current = self._deltas.get(ad_id)
+                        if current is None:
+                            self._deltas[ad_id] = delta
+                        else:
+                            merge_delta(current, delta)
+                    merge_buckets(self._buckets, buckets)
+                return 0
+            return len(deltas)
+
+    def _ensure_thread(self):
+        # إعادة تشغيل الخيط بعد fork (عمال gunicorn)
+        pid = os.getpid()
+        if self._thread is not None and self._pid == pid and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == pid and self._thread.is_alive():
+                return
+            self._pid = pid
+            self._thread = threading.Thread(target=self._run, name='ad-counters-flusher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if not self._deltas:
+                continue
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+
+_counters = None
+_counters_lock = threading.Lock()
+
+
+def get_ad_counters():
+    """عدادات الإعلانات المشتركة لهذه العملية"""
+    global _counters
+    if _counters is None:
+        with _counters_lock:
+            if _counters is None:
+                _counters = AdCounterBuffer()
+                atexit.register(_counters.flush)
+    return _counters
@@ -0,0 +1,138 @@
+"""
+سجل أحداث الإعلانات مجمعاً حسب الوقت (AdEventCount).
+
+عدادات الإعلان (impressions و clicks) إجمالية طوال عمره؛ هذا الجدول يحفظ
+عدد الظهورات والنقرات لكل (إعلان، مكان، ساعة) فتُحسب تقارير أي فترة
+باستعلام مجمع واحد. يغذيه تفريغ AdCounterBuffer، والساعات الأقدم من
+COMPACT_AFTER_DAYS تُضغط إلى صف يومي (أمر compact_ad_events).
+"""
+import logging
+from datetime import datetime, time as dt_time, timedelta
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Min, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import AdEventCount
+
+logger = logging.getLogger(__name__)
+
+# الساعات الأقدم من هذا العدد من الأيام تُضغط إلى أيام
+COMPACT_AFTER_DAYS = 30
+
+
+def day_start(day):
+    """بداية اليوم بالتوقيت المحلي"""
+    return timezone.make_aware(datetime.combine(day, dt_time.min))
+
+
+def increment_buckets(buckets, period='hour'):
+    """زيادة عدادات الفترات {(ad_id, placement_id, period_start): [ظهورات، نقرات]}
+
+    ثلاثة استعلامات مهما كان عدد الفترات: إنشاء الصفوف الناقصة (مع تجاهل
+    الموجودة)، قراءة مفاتيحها، ثم UPDATE واحد بـ F() + CASE. الزيادة داخل
+    قاعدة البيانات، فتفريغ عاملين لنفس الساعة لا يضيع شيئاً.
+    """
+    if not buckets:
+        return 0
+    AdEventCount.objects.bulk_create(
+        [
+            AdEventCount(ad_id=ad_id, placement_id=placement_id, period=period, period_start=start)
+            for ad_id, placement_id, start in buckets
+        ],
+        ignore_conflicts=True,
+    )
+
+    ad_ids = {key[0] for key in buckets}
+    starts = {key[2] for key in buckets}
+    rows = AdEventCount.objects.filter(
+        period=period, ad_id__in=ad_ids, period_start__in=starts,
+    ).values_list('pk', 'ad_id', 'placement_id', 'period_start')
+    pks = {(ad_id, placement_id, start): pk for pk, ad_id, placement_id, start in rows}
+
+    impressions = [When(pk=pks[key], then=Value(counts[0])) for key, counts in buckets.items() if counts[0]]
+    clicks = [When(pk=pks[key], then=Value(counts[1])) for key, counts in buckets.items() if counts[1]]
+    changes = {}
+    if impressions:
+        changes['impressions'] = F('impressions') + Case(*impressions, default=Value(0), output_field=IntegerField())
+    if clicks:
+        changes['clicks'] = F('clicks') + Case(*clicks, default=Value(0), output_field=IntegerField())
+    if changes:
+        AdEventCount.objects.filter(pk__in=[pks[key] for key in buckets]).update(**changes)
+    return len(buckets)
+
+
+# ===== القراءة =====
+
+def event_range(start_date, end_date):
+    """حدود [start, end) لمعاملات التقارير (تاريخ أو datetime؛ التاريخ النهائي شامل)"""
+    if not isinstance(start_date, datetime):
+        start_date = day_start(start_date)
+    if not isinstance(end_date, datetime):
+        end_date = day_start(end_date + timedelta(days=1))
+    if timezone.is_naive(start_date):
+        start_date = timezone.make_aware(start_date)
+    if timezone.is_naive(end_date):
+        end_date = timezone.make_aware(end_date)
+    return start_date, end_date
+
+
+def event_totals(start, end, *group_by):
+    """مجموع الظهورات والنقرات في [start, end) مجمعاً حسب الحقول المطلوبة (استعلام واحد)
+
+    القيم في total_impressions و total_clicks. الصفوف اليومية المضغوطة تُحسب
+    كاملة إذا بدأ يومها داخل الفترة.
+    """
+    return AdEventCount.objects.filter(period_start__gte=start, period_start__lt=end).values(*group_by).annotate(
+        total_impressions=Sum('impressions'),
+        total_clicks=Sum('clicks'),
+    ).order_by()
+
+
+def daily_totals(start, end):
+    """{تاريخ محلي: (ظهورات، نقرات)} للفترة (استعلام واحد)"""
+    rows = AdEventCount.objects.filter(period_start__gte=start, period_start__lt=end).annotate(
+        day=TruncDate('period_start', tzinfo=timezone.get_current_timezone()),
+    ).values('day').annotate(
+        total_impressions=Sum('impressions'),
+        total_clicks=Sum('clicks'),
+    ).order_by('day')
+    return {row['day']: (row['total_impressions'], row['total_clicks']) for row in rows}
+
+
+# ===== الضغط =====
+
+def compact_ad_events(days=COMPACT_AFTER_DAYS, now=None):
+    """دمج صفوف الساعات الأقدم من days يوماً في صف لكل (إعلان، مكان، يوم)؛ يعيد عدد الأيام
+
+    كل يوم في معاملة خاصة: إنشاء/زيادة الصفوف اليومية ثم حذف ساعاته.
+    """
+    cutoff = timezone.localdate(now or timezone.now()) - timedelta(days=days)
+    hours = AdEventCount.objects.filter(period='hour')
+    first = hours.aggregate(first=Min('period_start'))['first']
+    if first is None:
+        return 0
+
+    compacted = 0
+    day = timezone.localdate(first)
+    while day < cutoff:
+        start, end = day_start(day), day_start(day + timedelta(days=1))
+        day_hours = hours.filter(period_start__gte=start, period_start__lt=end)
+        with transaction.atomic():
+            buckets = {
+                (row['ad_id'], row['placement_id'], start): [row['total_impressions'], row['total_clicks']]
+                for row in day_hours.values('ad_id', 'placement_id').annotate(
+                    total_impressions=Sum('impressions'),
+                    total_clicks=Sum('clicks'),
+                ).order_by()
+            }
+            if buckets:
+                increment_buckets(buckets, period='day')
+                day_hours.delete()
+                compacted += 1
+        day += timedelta(days=1)
+
+    if compacted:
+        logger.info('Compacted hourly ad events for %d days before %s', compacted, cutoff)
+    return compacted
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from advertisements.events import COMPACT_AFTER_DAYS, compact_ad_events
+
+
+class Command(BaseCommand):
+    help = 'ضغط عدادات الإعلانات بالساعة الأقدم من --days يوماً إلى صف لكل يوم (يُشغل يومياً عبر cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=COMPACT_AFTER_DAYS,
+                            help=f'عمر الساعات التي تُضغط بالأيام (الافتراضي {COMPACT_AFTER_DAYS})')
+
+    def handle(self, *args, **options):
+        compacted = compact_ad_events(days=options['days'])
+        self.stdout.write(self.style.SUCCESS(f'تم ضغط {compacted} يوم'))
@@ -0,0 +1,78 @@
+# Generated by Django 5.2.9 on 2026-10-17 04:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("advertisements", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AdEventCount",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "period",
+                    models.CharField(
+                        choices=[("hour", "Hour"), ("day", "Day")],
+                        default="hour",
+                        max_length=4,
+                    ),
+                ),
+                ("period_start", models.DateTimeField(verbose_name="Period Start")),
+                (
+                    "impressions",
+                    models.PositiveIntegerField(default=0, verbose_name="Impressions"),
+                ),
+                (
+                    "clicks",
+                    models.PositiveIntegerField(default=0, verbose_name="Clicks"),
+                ),
+                (
+                    "ad",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="event_counts",
+                        to="advertisements.advertisement",
+                        verbose_name="Advertisement",
+                    ),
+                ),
+                (
+                    "placement",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="event_counts",
+                        to="advertisements.adplacement",
+                        verbose_name="Ad Placement",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Ad Event Count",
+                "verbose_name_plural": "Ad Event Counts",
+                "indexes": [
+                    models.Index(
+                        fields=["period_start"], name="advertiseme_period__106199_idx"
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("ad", "placement", "period", "period_start"),
+                        name="ad_event_count_bucket_uniq",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -1,9 +1,10 @@
 from django.db import models
 from django.utils.translation import gettext_lazy as _
-from django.core.cache import cache
 from django.utils import timezone
 import uuid
 
+from .counters import get_ad_counters
+
 class AdPlacement(models.Model):
     PLACEMENT_CHOICES = [
         ('header', _('Header')),
@@ -44,11 +45,6 @@ class AdPlacement(models.Model):
             end_date__gte=timezone.now()
         ).count()
     
-    def save(self, *args, **kwargs):
-        # مسح الكاش عند حفظ التغييرات
-        super().save(*args, **kwargs)
-        cache.delete(f'ad_{self.code}_*')
-
 class Advertisement(models.Model):
     AD_TYPE_CHOICES = [
         ('banner', _('Banner Image')),
@@ -120,16 +116,12 @@ class Advertisement(models.Model):
         return self.active and self.start_date <= now <= self.end_date
     
     def record_impression(self):
-        """تسجيل ظهور للإعلان"""
-        self.impressions += 1
-        self.last_impression = timezone.now()
-        self.save(update_fields=['impressions', 'last_impression'])
+        """تسجيل ظهور للإعلان (يُكتب مع التفريغ الدوري للعدادات)"""
+        get_ad_counters().impression([self], timezone.now())
     
     def record_click(self):
-        """تسجيل نقرة على الإعلان"""
-        self.clicks += 1
-        self.last_click = timezone.now()
-        self.save(update_fields=['clicks', 'last_click'])
+        """تسجيل نقرة على الإعلان (يُكتب مع التفريغ الدوري للعدادات)"""
+        get_ad_counters().click(self, timezone.now())
     
     def get_ctr(self):
         """حساب نسبة النقر للظهور"""
@@ -144,22 +136,29 @@ class Advertisement(models.Model):
             return max(0, remaining)
         return 0
     
-    def get_display_html(self):
-        """الحصول على كود HTML لعرض الإعلان"""
+    def get_display_html(self, impression_pixel=True):
+        """الحصول على كود HTML لعرض الإعلان
+
+        impression_pixel=False عندما يحتسب الخادم الظهور بنفسه (render_ad_placement)
+        """
         base_url = '/ads/'
         
         if self.ad_type == 'banner' and self.image:
             target = ' target="_blank"' if self.target_blank else ''
             rel = ' rel="nofollow"' if self.nofollow else ''
+            onclick = pixel = ''
+            if impression_pixel:
+                onclick = f'''
+                   onclick="this.parentNode.querySelector('.ad-impression').src='{base_url}impression/{self.id}/';"'''
+                pixel = f'''
+                <img src="{base_url}impression/{self.id}/" class="ad-impression" style="display:none;">'''
             
             return f'''
             <div class="advertisement" data-ad-id="{self.id}" data-ad-uuid="{self.uuid}">
-                <a href="{base_url}click/{self.id}/"{target}{rel}
-                   onclick="this.parentNode.querySelector('.ad-impression').src='{base_url}impression/{self.id}/';">
+                <a href="{base_url}click/{self.id}/"{target}{rel}{onclick}>
                     <img src="{self.image.url}" alt="{self.title}" 
                          style="width:100%; height:auto; max-width:{self.placement.width}px;">
-                </a>
-                <img src="{base_url}impression/{self.id}/" class="ad-impression" style="display:none;">
+                </a>{pixel}
             </div>
             '''
         
@@ -173,20 +172,44 @@ class Advertisement(models.Model):
         if self.start_date >= self.end_date:
             raise ValidationError(_('End date must be after start date'))
         
-        if self.start_date < timezone.now():
+        # الإعلان الجاري يبقى قابلاً للتعديل بعد بدئه
+        if not self.pk and self.start_date < timezone.now():
             raise ValidationError(_('Start date cannot be in the past'))
     
     def save(self, *args, **kwargs):
         # تنظيف البيانات قبل الحفظ
         self.clean()
         
-        # مسح الكاش عند الحفظ
-        if self.pk:
-            old_ad = Advertisement.objects.get(pk=self.pk)
-            if old_ad.placement != self.placement:
-                cache.delete(f'ad_{old_ad.placement.code}_*')
-        
         super().save(*args, **kwargs)
-        
-        # مسح كاش المكان الجديد
-        cache.delete(f'ad_{self.placement.code}_*')
\ No newline at end of file
+
+
+class AdEventCount(models.Model):
+    """عدد الظهورات والنقرات لكل (إعلان، مكان، ساعة)؛ الساعات القديمة تُضغط إلى أيام"""
+    PERIOD_CHOICES = [
+        ('hour', _('Hour')),
+        ('day', _('Day')),
+    ]
+    
+    ad = models.ForeignKey(Advertisement, on_delete=models.CASCADE, related_name='event_counts',
+                           verbose_name=_('Advertisement'))
+    placement = models.ForeignKey(AdPlacement, on_delete=models.CASCADE, related_name='event_counts',
+                                  verbose_name=_('Ad Placement'))
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES, default='hour')
+    # بداية الساعة، أو بداية اليوم بالتوقيت المحلي بعد الضغط
+    period_start = models.DateTimeField(verbose_name=_('Period Start'))
+    impressions = models.PositiveIntegerField(default=0, verbose_name=_('Impressions'))
+    clicks = models.PositiveIntegerField(default=0, verbose_name=_('Clicks'))
+    
+    class Meta:
+        verbose_name = _('Ad Event Count')
+        verbose_name_plural = _('Ad Event Counts')
+        constraints = [
+            models.UniqueConstraint(fields=['ad', 'placement', 'period', 'period_start'],
+                                    name='ad_event_count_bucket_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['period_start']),
+        ]
+    
+    def __str__(self):
+        return f'{self.ad_id} {self.period} {self.period_start}'
@@ -0,0 +1,53 @@
+"""
+تدوير الإعلانات العشوائي الموزون بالأولوية.
+
+لكل مكان جدول مجاميع تراكمية لأوزان الإعلانات المؤهلة (الوزن = الأولوية،
+بحد أدنى 1)، يُبنى مرة واحدة مع حالة الفهرس عند تغير الأهلية. كل طلب
+يختار k إعلانات مختلفة بدون إرجاع في O(k log n): رقم عشوائي صحيح في مجموع
+الأوزان المتبقية، ثم تخطي فترات الإعلانات المختارة (k على الأكثر) و bisect
+في الجدول. الجدول نفسه لا يُعدل فيُشارك بين الخيوط.
+"""
+import bisect
+import random
+from itertools import accumulate
+
+
+def ad_weight(ad):
+    # الأولوية صفر أو سالبة لا تمنع الظهور، فقط أقل فرصة
+    return max(ad.priority, 1)
+
+
+class RotationTable:
+    """إعلانات مكان واحد مع أوزانها التراكمية"""
+
+    def __init__(self, ads):
+        self.ads = list(ads)
+        self.weights = [ad_weight(ad) for ad in self.ads]
+        self.cumulative = list(accumulate(self.weights))
+        self.total = self.cumulative[-1] if self.cumulative else 0
+
+    def __len__(self):
+        return len(self.ads)
+
+    def pick(self, count, rng=random):
+        """count إعلان مختلف، احتمال كل منها متناسب مع وزنه بين المتبقية
+
+        النتيجة مرتبة حسب الأولوية كترتيب الفهرس.
+        """
+        count = min(count, len(self.ads))
+        removed = []  # (بداية، عرض) فترات المختارة في المجاميع التراكمية، مرتبة
+        remaining = self.total
+        picked = []
+        for _ in range(count):
+            point = rng.randrange(remaining)
+            for start, width in removed:
+                if point < start:
+                    break
+                point += width
+            index = bisect.bisect_right(self.cumulative, point)
+            width = self.weights[index]
+            bisect.insort(removed, (self.cumulative[index] - width, width))
+            remaining -= width
+            picked.append(index)
+        picked.sort()
+        return [self.ads[index] for index in picked]
@@ -0,0 +1,179 @@
+"""
+فهرس الإعلانات المؤهلة لكل مكان (في ذاكرة كل عملية).
+
+يُبنى باستعلام واحد يحمل كل الإعلانات المفعلة التي لم تنته بعد (بما فيها
+المجدولة لاحقاً)، ثم يُحسب لكل مكان قائمة الإعلانات المؤهلة الآن مرتبة
+حسب الأولوية. تواريخ البدء والانتهاء المحملة هي حدود الفترات التي تتغير
+عندها الأهلية: عند تجاوز أقرب حد يُعاد حساب القوائم من الذاكرة بدون
+استعلام.
+
+إعادة التحميل من قاعدة البيانات تكون:
+- عند تغير رقم الجيل في الكاش (signals.py بعد أي تعديل على الإعلانات أو الأماكن)
+- أو بعد INDEX_MAX_AGE ثانية، لأن الكاش الافتراضي (locmem) خاص بكل عملية
+  فلا يصل تغيير الجيل إلى بقية العمال
+
+تستخدمه render_ad_placement و show_ad و ad_json_feed و manage_placements.
+الإعلانات المشتركة للقراءة فقط. HTML كل إعلان لـ render_ad_placement يُحفظ
+مع الحالة، أما الاختيار فلكل طلب.
+
+مع كل حالة تُبنى جداول التدوير الموزون (rotation.py)، فالاختيار العشوائي
+لكل طلب لا يحتاج استعلاماً ولا كاشاً.
+"""
+import bisect
+import logging
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from .rotation import RotationTable
+
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = 'ads:index_generation'
+
+# أقصى عمر للفهرس قبل إعادة تحميله (ثانية)
+INDEX_MAX_AGE = 60
+
+
+def bump_generation():
+    """إبطال فهارس كل العمليات (تعيد التحميل عند أول طلب)"""
+    cache.set(GENERATION_KEY, uuid.uuid4().hex, None)
+
+
+def current_generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, uuid.uuid4().hex, None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def priority_key(ad):
+    # نفس ترتيب Advertisement.Meta.ordering
+    return (-ad.priority, -ad.start_date.timestamp())
+
+
+class IndexState:
+    """حالة ثابتة للفهرس؛ تُستبدل كاملة عند التحديث"""
+
+    def __init__(self, candidates, now, generation, loaded_at, fragments=None):
+        self.candidates = candidates
+        self.generation = generation
+        self.loaded_at = loaded_at
+        # {ad.pk: HTML} تُملأ عند أول عرض؛ تبقى صالحة ما دامت نفس البيانات المحملة
+        self.fragments = fragments if fragments is not None else {}
+
+        eligible = {}
+        for code, ads in candidates.items():
+            current = [ad for ad in ads if ad.start_date <= now <= ad.end_date]
+            if current:
+                eligible[code] = current
+        self.eligible = eligible
+        self.rotations = {code: RotationTable(ads) for code, ads in eligible.items()}
+        self.rotation_all = RotationTable(sorted(
+            (ad for ads in eligible.values() for ad in ads), key=priority_key,
+        ))
+
+        # أقرب حد بعد now: بداية إعلان مجدول أو لحظة انتهاء إعلان مؤهل
+        boundaries = sorted(
+            boundary
+            for ads in candidates.values()
+            for ad in ads
+            for boundary in (ad.start_date, ad.end_date + timedelta(microseconds=1))
+        )
+        position = bisect.bisect_right(boundaries, now)
+        self.next_boundary = boundaries[position] if position < len(boundaries) else None
+
+    def at(self, now):
+        """نفس المرشحين لوقت لاحق (بدون استعلام)"""
+        return IndexState(self.candidates, now, self.generation, self.loaded_at, self.fragments)
+
+    def fragment(self, ad):
+        """HTML الإعلان بدون صورة تتبع الظهور (الخادم يحتسبه)"""
+        html = self.fragments.get(ad.pk)
+        if html is None:
+            html = self.fragments[ad.pk] = ad.get_display_html(impression_pixel=False)
+        return html
+
+
+class AdIndex:
+    """الإعلانات المؤهلة لكل مكان مرتبة حسب الأولوية"""
+
+    def __init__(self, max_age=INDEX_MAX_AGE):
+        self.max_age = max_age
+        self._state = None
+        self._lock = threading.Lock()
+
+    def load(self, now, generation):
+        from .models import Advertisement
+
+        candidates = {}
+        ads = Advertisement.objects.filter(active=True, end_date__gte=now).select_related('placement')
+        for ad in ads:
+            candidates.setdefault(ad.placement.code, []).append(ad)
+        for ads in candidates.values():
+            ads.sort(key=priority_key)
+        logger.debug('Ad index loaded: %d placements', len(candidates))
+        return IndexState(candidates, now, generation, time.monotonic())
+
+    def state(self, now=None):
+        now = now or timezone.now()
+        generation = current_generation()
+        state = self._state
+        if state is None or state.generation != generation or time.monotonic() - state.loaded_at > self.max_age:
+            with self._lock:
+                state = self._state
+                if state is None or state.generation != generation or time.monotonic() - state.loaded_at > self.max_age:
+                    state = self._state = self.load(now, generation)
+        if state.next_boundary is not None and now >= state.next_boundary:
+            # تغيرت الأهلية ضمن نفس البيانات المحملة
+            state = self._state = state.at(now)
+        return state
+
+    def eligible(self, placement_code, now=None):
+        """الإعلانات المؤهلة الآن لمكان محدد (قائمة مشتركة - لا تعدلها)"""
+        return self.state(now).eligible.get(placement_code, ())
+
+    def all_eligible(self, now=None):
+        """كل الإعلانات المؤهلة في كل الأماكن مرتبة حسب الأولوية"""
+        return list(self.state(now).rotation_all.ads)
+
+    def rotate(self, placement_code, count, now=None):
+        """count إعلان مؤهل مختلف لمكان (أو لكل الأماكن إذا كان None) بتدوير موزون بالأولوية"""
+        state = self.state(now)
+        if placement_code is None:
+            table = state.rotation_all
+        else:
+            table = state.rotations.get(placement_code)
+        return table.pick(count) if table else []
+
+    def render(self, placement_code, count, now=None):
+        """(الإعلانات المختارة، HTML) لمكان: الاختيار لكل طلب و HTML كل إعلان محفوظ مع الحالة"""
+        state = self.state(now)
+        table = state.rotations.get(placement_code)
+        ads = table.pick(count) if table else []
+        return ads, ''.join(state.fragment(ad) for ad in ads)
+
+    def count(self, placement_code, now=None):
+        return len(self.eligible(placement_code, now))
+
+    def invalidate(self):
+        self._state = None
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_ad_index():
+    """فهرس الإعلانات المشترك لهذه العملية"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = AdIndex()
+    return _index
@@ -2,18 +2,24 @@ from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.core.cache import cache
 from .models import Advertisement, AdPlacement
+from .serving import bump_generation
 import logging
 
 logger = logging.getLogger(__name__)
 
+# حفظ العدادات فقط (record_impression / record_click) لا يغير أهلية الإعلانات
+COUNTER_FIELDS = {'impressions', 'last_impression', 'clicks', 'last_click'}
+
 @receiver(post_save, sender=Advertisement)
-def clear_ad_cache_on_save(sender, instance, **kwargs):
+def clear_ad_cache_on_save(sender, instance, update_fields=None, **kwargs):
     """
     مسح الكاش عند حفظ إعلان جديد أو تعديله
     """
-    if instance.placement:
-        # مسح كاش هذا المكان المحدد
-        cache.delete(f'ad_{instance.placement.code}_*')
+    if update_fields and set(update_fields) <= COUNTER_FIELDS:
+        return
+    
+    # فهرس الإعلانات المؤهلة (كل الأماكن، بما فيها القديم عند النقل)
+    bump_generation()
     
     # مسح إحصائيات الكاش
     cache.delete('active_ads_count')
@@ -24,8 +30,7 @@ def clear_ad_cache_on_delete(sender, instance, **kwargs):
     """
     مسح الكاش عند حذف إعلان
     """
-    if instance.placement:
-        cache.delete(f'ad_{instance.placement.code}_*')
+    bump_generation()
     
     cache.delete('active_ads_count')
     logger.info(f'Ad cache cleared after delete: {instance.title}')
@@ -36,5 +41,5 @@ def clear_placement_cache(sender, instance, **kwargs):
     """
     مسح كاش الأماكن عند التغيير
     """
-    cache.delete(f'ad_{instance.code}_*')
+    bump_generation()
     logger.info(f'Placement cache cleared: {instance.code}')
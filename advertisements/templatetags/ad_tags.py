@@ -1,8 +1,6 @@
 from django import template
 from django.utils import timezone
-from django.core.cache import cache
-from advertisements.models import Advertisement
-import random
+from advertisements.serving import get_ad_index
 
 register = template.Library()
 
@@ -12,21 +10,8 @@ def show_ad(context, placement_code, count=1):
     عرض إعلانات في مكان محدد
     الاستخدام في القالب: {% show_ad 'header' %}
     """
-    cache_key = f'ad_{placement_code}_{count}'
-    ads = cache.get(cache_key)
-    
-    if not ads:
-        ads = list(Advertisement.objects.filter(
-            placement__code=placement_code,
-            active=True,
-            start_date__lte=timezone.now(),
-            end_date__gte=timezone.now()
-        ).select_related('placement'))
-        
-        # ترتيب عشوائي للإعلانات
-        if ads:
-            ads = random.sample(ads, min(count, len(ads)))
-            cache.set(cache_key, ads, 60)  # كاش لمدة دقيقة
+    # تدوير موزون بالأولوية من فهرس الإعلانات المؤهلة (بدون استعلام)
+    ads = get_ad_index().rotate(placement_code, count)
     
     request = context.get('request')
     return {
@@ -1,3 +1,362 @@
-from django.test import TestCase
+import random
+import threading
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone as django_timezone
+
+from .counters import AdCounterBuffer
+from .events import compact_ad_events
+from .models import AdEventCount, Advertisement, AdPlacement
+from .rotation import RotationTable
+from .serving import GENERATION_KEY, IndexState, bump_generation, priority_key
+from .utils import clear_ad_cache, get_ad_analytics
+from .views import ad_dashboard, render_ad_placement
+
+NOW = datetime(2026, 5, 1, 12, 0, tzinfo=timezone.utc)
+
+BROWSER_UA = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0 Safari/537.36'
+
+
+def ad(title, start, end, priority=1):
+    return SimpleNamespace(
+        title=title, priority=priority,
+        start_date=NOW + timedelta(minutes=start), end_date=NOW + timedelta(minutes=end),
+    )
+
+
+class IndexStateTests(SimpleTestCase):
+    def state(self, ads, now=NOW):
+        return IndexState({'header': sorted(ads, key=priority_key)}, now, 'g1', 0)
+
+    def titles(self, state):
+        return [ad.title for ad in state.eligible.get('header', ())]
+
+    def test_eligible_ads_sorted_by_priority(self):
+        state = self.state([ad('low', -10, 10, 1), ad('high', -10, 10, 5), ad('later', 5, 10, 9)])
+
+        self.assertEqual(self.titles(state), ['high', 'low'])
+        self.assertEqual(state.next_boundary, NOW + timedelta(minutes=5))
+
+    def test_boundaries_change_eligibility_without_reloading(self):
+        state = self.state([ad('a', -10, 10), ad('b', 5, 20, 3)])
+
+        later = state.at(NOW + timedelta(minutes=5))
+        self.assertEqual(self.titles(later), ['b', 'a'])
+        # الانتهاء شامل: الإعلان مؤهل حتى end_date نفسه
+        self.assertEqual(later.next_boundary, NOW + timedelta(minutes=10, microseconds=1))
+        self.assertEqual(self.titles(state.at(NOW + timedelta(minutes=10))), ['b', 'a'])
+        self.assertEqual(self.titles(state.at(NOW + timedelta(minutes=11))), ['b'])
+
+        ended = state.at(NOW + timedelta(minutes=30))
+        self.assertEqual(self.titles(ended), [])
+        self.assertIsNone(ended.next_boundary)
+
+
+class RotationTableTests(SimpleTestCase):
+    def test_picks_distinct_ads_in_priority_order(self):
+        ads = sorted((ad(f'ad{i}', -10, 10, priority=i % 4) for i in range(20)), key=priority_key)
+        table = RotationTable(ads)
+        rng = random.Random(1)
+
+        for count in (1, 5, 20, 50):
+            picked = table.pick(count, rng)
+            self.assertEqual(len(picked), min(count, 20))
+            self.assertEqual(len({a.title for a in picked}), len(picked))
+            self.assertEqual(picked, sorted(picked, key=priority_key))
+
+    def test_selection_follows_priority_weights(self):
+        table = RotationTable([ad('heavy', -10, 10, priority=8), ad('light', -10, 10, priority=1),
+                               ad('zero', -10, 10, priority=0)])
+        rng = random.Random(7)
+
+        seen = Counter(table.pick(1, rng)[0].title for _ in range(10000))
+
+        # الأوزان 8:1:1 (الأولوية صفر تُعامل كـ 1)
+        self.assertAlmostEqual(seen['heavy'] / 10000, 0.8, delta=0.02)
+        self.assertAlmostEqual(seen['light'] / 10000, 0.1, delta=0.02)
+        self.assertAlmostEqual(seen['zero'] / 10000, 0.1, delta=0.02)
+
+    def test_index_state_builds_tables_per_placement(self):
+        state = IndexState({'header': [ad('a', -10, 10, 2), ad('later', 5, 10)]}, NOW, 'g1', 0)
+
+        self.assertEqual([a.title for a in state.rotations['header'].pick(5)], ['a'])
+        self.assertEqual(state.rotation_all.total, 2)
+        self.assertNotIn('later', [a.title for a in state.at(NOW).rotation_all.ads])
+
+
+CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'ads-tests'}}
+
+
+@override_settings(CACHES=CACHES)
+class AdCacheInvalidationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        now = django_timezone.now()
+        self.header = AdPlacement.objects.create(name='Header', code='header', placement_type='header')
+        self.sidebar = AdPlacement.objects.create(name='Sidebar', code='sidebar', placement_type='sidebar')
+        # bulk_create لأن clean() يرفض تاريخ بدء في الماضي عند الإنشاء
+        self.ad, self.side_ad = Advertisement.objects.bulk_create([
+            Advertisement(title='Old title', placement=self.header, link='https://example.com/',
+                          start_date=now - timedelta(days=1), end_date=now + timedelta(days=1)),
+            Advertisement(title='Side ad', placement=self.sidebar, link='https://example.com/',
+                          start_date=now - timedelta(days=1), end_date=now + timedelta(days=1)),
+        ])
+        bump_generation()
+        # الظهورات في مخزن محلي بدل مخزن العملية (لا تفريغ بعد حذف قاعدة الاختبار)
+        self.counters = AdCounterBuffer()
+        self.counters._ensure_thread = lambda: None
+        patcher = mock.patch('advertisements.views.get_ad_counters', return_value=self.counters)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def render(self, code, user_agent=BROWSER_UA):
+        request = RequestFactory().get(f'/ads/render/{code}/', HTTP_USER_AGENT=user_agent)
+        return render_ad_placement(request, code).content.decode()
+
+    def test_edit_is_visible_immediately(self):
+        self.assertIn('Old title', self.render('header'))
+
+        self.ad.title = 'New title'
+        self.ad.save()
+
+        self.assertIn('New title', self.render('header'))
+
+    def test_bulk_deactivation_is_visible_immediately(self):
+        self.assertIn('Old title', self.render('header'))
+
+        Advertisement.objects.filter(pk=self.ad.pk).update(active=False)
+        clear_ad_cache('header')
+
+        self.assertEqual(self.render('header'), '<!-- no ads -->')
+
+    def test_moving_an_ad_refreshes_both_placements(self):
+        self.assertIn('Old title', self.render('header'))
+        self.assertNotIn('Old title', self.render('sidebar'))
+
+        self.ad.placement = self.sidebar
+        self.ad.save()
+
+        self.assertEqual(self.render('header'), '<!-- no ads -->')
+        self.assertIn('Old title', self.render('sidebar'))
+
+    def test_counter_saves_do_not_invalidate(self):
+        generation = cache.get(GENERATION_KEY)
+
+        self.ad.impressions = 10
+        self.ad.save(update_fields=['impressions', 'last_impression'])
+
+        self.assertEqual(cache.get(GENERATION_KEY), generation)
+
+        self.ad.title = 'New title'
+        self.ad.save(update_fields=['title'])
+
+        self.assertNotEqual(cache.get(GENERATION_KEY), generation)
+
+    def test_every_request_counts_an_impression(self):
+        for _ in range(3):
+            self.assertIn('Old title', self.render('header'))
+        self.render('header', user_agent='Googlebot/2.1 (+http://www.google.com/bot.html)')
+
+        self.assertEqual(self.counters.pending_totals(), (3, 0))
+        self.assertEqual(self.counters.pending(self.ad.pk)[0], 3)
+        self.assertNotIn('/ads/impression/', self.render('header'))
+
+    def test_response_is_not_cacheable(self):
+        request = RequestFactory().get('/ads/render/header/', HTTP_USER_AGENT=BROWSER_UA)
+        response = render_ad_placement(request, 'header')
+
+        self.assertIn('no-cache', response['Cache-Control'])
+
+    def test_selection_rotates_and_only_fragments_are_cached(self):
+        now = django_timezone.now()
+        Advertisement.objects.bulk_create([
+            Advertisement(title=f'Rotating {index}', placement=self.header, link='https://example.com/',
+                          start_date=now - timedelta(days=1), end_date=now + timedelta(days=1))
+            for index in range(6)
+        ])
+        bump_generation()
+
+        seen = Counter()
+        with mock.patch.object(Advertisement, 'get_display_html', autospec=True,
+                               side_effect=lambda ad, impression_pixel=True: f'<div>{ad.title}</div>') as render_html:
+            for _ in range(40):
+                shown = [title for title in self.render('header').split('</div>') if title]
+                self.assertEqual(len(shown), 5)
+                seen.update(shown)
+
+        self.assertEqual(len(seen), 7)
+        # HTML كل إعلان يُبنى مرة واحدة مع حالة الفهرس
+        self.assertEqual(render_html.call_count, 7)
+        self.assertEqual(self.counters.pending_totals(), (200, 0))
+
+
+class AdDashboardTests(TestCase):
+    def setUp(self):
+        now = django_timezone.now()
+        placement = AdPlacement.objects.create(name='Header', code='header', placement_type='header')
+        self.ad = Advertisement.objects.bulk_create([
+            Advertisement(title='Ad', placement=placement, link='https://example.com/', impressions=10, clicks=1,
+                          start_date=now - timedelta(days=1), end_date=now + timedelta(days=3)),
+        ])[0]
+        self.user = User.objects.create_user('editor')
+        self.user.user_type = 'admin'
+        self.counters = AdCounterBuffer()
+        self.counters._ensure_thread = lambda: None
+        patcher = mock.patch('advertisements.views.get_ad_counters', return_value=self.counters)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def dashboard(self):
+        request = RequestFactory().get('/ads/dashboard/')
+        request.user = self.user
+        with mock.patch('advertisements.views.render', return_value=HttpResponse()) as render:
+            ad_dashboard(request)
+        return render.call_args.args[2]
+
+    def test_totals_follow_flushes(self):
+        self.counters.impression([self.ad], django_timezone.now())
+        self.counters.impression([self.ad], django_timezone.now())
+        context = self.dashboard()
+        self.assertEqual((context['total_impressions'], context['total_clicks']), (12, 1))
+        self.assertEqual(context['expiring_ads_count'], 1)
+
+        # بعد التفريغ: القيمة المحفوظة الجديدة وليس إجمالي مخزن قبل التفريغ
+        self.counters.flush()
+        self.counters.click(self.ad, django_timezone.now())
+        context = self.dashboard()
+        self.assertEqual((context['total_impressions'], context['total_clicks']), (12, 2))
+        self.assertEqual(context['ctr'], round(2 / 12 * 100, 2))
+
+class AdCounterBufferTests(TestCase):
+    def setUp(self):
+        now = django_timezone.now()
+        placement = AdPlacement.objects.create(name='Header', code='header', placement_type='header')
+        self.seen = now - timedelta(hours=1)
+        self.ads = Advertisement.objects.bulk_create([
+            Advertisement(title=f'Ad {i}', placement=placement, link='https://example.com/',
+                          start_date=now - timedelta(days=1), end_date=now + timedelta(days=1),
+                          impressions=100, clicks=5, last_impression=self.seen)
+            for i in range(3)
+        ])
+        self.buffer = AdCounterBuffer()
+        self.buffer._ensure_thread = lambda: None
+
+    def test_concurrent_events_are_not_lost(self):
+        first, second, _ = self.ads
+        now = django_timezone.now()
+
+        def serve():
+            for _ in range(250):
+                self.buffer.impression([first, second], now)
+            self.buffer.click(first, now)
+
+        threads = [threading.Thread(target=serve) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # UPDATE الإعلانات + ثلاثة استعلامات لعدادات الساعة + SAVEPOINT وإطلاقه
+        with self.assertNumQueries(6):
+            self.assertEqual(self.buffer.flush(), 2)
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.impressions, first.clicks), (2100, 13))
+        self.assertEqual((second.impressions, second.clicks), (2100, 5))
+        self.assertEqual(first.last_click, now)
+
+    def test_last_seen_keeps_the_latest_value(self):
+        ad = self.ads[0]
+        self.buffer.impression([ad], self.seen - timedelta(minutes=5))
+
+        self.buffer.flush()
+
+        ad.refresh_from_db()
+        self.assertEqual(ad.impressions, 101)
+        self.assertEqual(ad.last_impression, self.seen)
+        self.assertIsNone(ad.last_click)
+
+    def test_pending_deltas_are_visible_before_flush(self):
+        ad = self.ads[2]
+        self.buffer.impression([ad], django_timezone.now())
+        self.buffer.click(ad, django_timezone.now())
+
+        [shown] = self.buffer.apply_pending([Advertisement.objects.get(pk=ad.pk)])
+
+        self.assertEqual((shown.impressions, shown.clicks), (101, 6))
+        self.assertEqual(self.buffer.pending_totals(), (1, 1))
+        self.assertEqual(Advertisement.objects.get(pk=ad.pk).impressions, 100)
+
+
+class AdEventCountTests(TestCase):
+    def setUp(self):
+        now = django_timezone.now()
+        self.header = AdPlacement.objects.create(name='Header', code='header', placement_type='header')
+        self.sidebar = AdPlacement.objects.create(name='Sidebar', code='sidebar', placement_type='sidebar')
+        self.ad, self.other = Advertisement.objects.bulk_create([
+            Advertisement(title=f'Ad {i}', placement=self.header, link='https://example.com/',
+                          start_date=now - timedelta(days=60), end_date=now + timedelta(days=1))
+            for i in range(2)
+        ])
+        self.buffer = AdCounterBuffer()
+        self.buffer._ensure_thread = lambda: None
+        self.hour = now.replace(minute=0, second=0, microsecond=0)
+
+    def test_flushes_from_two_workers_add_up(self):
+        for _ in range(2):
+            buffer = AdCounterBuffer()
+            buffer._ensure_thread = lambda: None
+            buffer.impression([self.ad, self.other], self.hour + timedelta(minutes=10))
+            buffer.click(self.ad, self.hour + timedelta(minutes=20))
+            buffer.flush()
+
+        bucket = AdEventCount.objects.get(ad=self.ad, period='hour', period_start=self.hour)
+        self.assertEqual((bucket.impressions, bucket.clicks), (2, 2))
+        self.assertEqual(AdEventCount.objects.count(), 2)
+
+    def test_range_report_uses_event_time_and_placement(self):
+        last_week = self.hour - timedelta(days=7)
+        self.buffer.impression([self.ad], last_week)
+        self.buffer.impression([self.ad, self.other], self.hour)
+        self.buffer.click(self.ad, self.hour)
+        self.buffer.flush()
+        # النقل لا يغير مكان الأحداث السابقة
+        self.ad.placement = self.sidebar
+        self.ad.save()
+        self.buffer.impression([self.ad], self.hour)
+        self.buffer.flush()
+
+        with self.assertNumQueries(1):
+            analytics = get_ad_analytics(self.hour - timedelta(days=1), self.hour + timedelta(hours=1))
+
+        self.assertEqual((analytics['total_impressions'], analytics['total_clicks']), (3, 1))
+        self.assertEqual(analytics['total_ads'], 2)
+        self.assertEqual(analytics['by_placement']['Header'], {'count': 2, 'impressions': 2, 'clicks': 1})
+        self.assertEqual(analytics['by_placement']['Sidebar'], {'count': 1, 'impressions': 1, 'clicks': 0})
+
+    def test_compaction_folds_old_hours_into_days(self):
+        old_day = django_timezone.localdate() - timedelta(days=40)
+        old_start = django_timezone.make_aware(datetime.combine(old_day, datetime.min.time()))
+        for hours in (1, 5, 23):
+            self.buffer.impression([self.ad], old_start + timedelta(hours=hours))
+        self.buffer.click(self.ad, old_start + timedelta(hours=5))
+        self.buffer.impression([self.ad], self.hour)
+        self.buffer.flush()
+        before = get_ad_analytics(old_day, django_timezone.localdate())
+
+        self.assertEqual(compact_ad_events(days=30), 1)
+
+        day = AdEventCount.objects.get(period='day')
+        self.assertEqual((day.period_start, day.impressions, day.clicks), (old_start, 3, 1))
+        self.assertEqual(AdEventCount.objects.filter(period='hour').count(), 1)
+        after = get_ad_analytics(old_day, django_timezone.localdate())
+        self.assertEqual((after['total_impressions'], after['total_clicks']), (before['total_impressions'], before['total_clicks']))
+        self.assertEqual(compact_ad_events(days=30), 0)
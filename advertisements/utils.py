@@ -1,65 +1,89 @@
 import logging
 from django.core.cache import cache
 from django.utils import timezone
-from django.db.models import Sum
 from .models import Advertisement
+from .events import event_range, event_totals
+from .serving import bump_generation
+from analytics.devices import request_device_info
 from datetime import datetime, timedelta
 
 logger = logging.getLogger(__name__)
 
 def get_ad_analytics(start_date=None, end_date=None):
     """
-    الحصول على تحليلات الإعلانات لفترة محددة
+    الحصول على تحليلات الإعلانات لفترة محددة (من عدادات AdEventCount باستعلام مجمع واحد)
+
+    التواريخ (date) شاملة لليوم الأخير؛ القيم datetime حدود [start, end).
     """
     if not start_date:
         start_date = timezone.now() - timedelta(days=30)
     if not end_date:
         end_date = timezone.now()
+    start, end = event_range(start_date, end_date)
     
-    ads = Advertisement.objects.filter(
-        start_date__gte=start_date,
-        end_date__lte=end_date
+    rows = event_totals(
+        start, end,
+        'ad_id', 'ad__ad_type', 'ad__active', 'ad__start_date', 'ad__end_date', 'placement__name',
     )
     
     analytics = {
-        'total_impressions': ads.aggregate(Sum('impressions'))['impressions__sum'] or 0,
-        'total_clicks': ads.aggregate(Sum('clicks'))['clicks__sum'] or 0,
-        'total_ads': ads.count(),
-        'active_ads': sum(1 for ad in ads if ad.is_active()),
-        'by_type': {},
+        'total_impressions': 0,
+        'total_clicks': 0,
+        'total_ads': 0,
+        'active_ads': 0,
+        'by_type': {
+            ad_type: {'count': 0, 'impressions': 0, 'clicks': 0}
+            for ad_type, _ in Advertisement.AD_TYPE_CHOICES
+        },
         'by_placement': {},
     }
     
-    # تحليل حسب النوع
-    for ad_type, _ in Advertisement.AD_TYPE_CHOICES:
-        type_ads = ads.filter(ad_type=ad_type)
-        analytics['by_type'][ad_type] = {
-            'count': type_ads.count(),
-            'impressions': type_ads.aggregate(Sum('impressions'))['impressions__sum'] or 0,
-            'clicks': type_ads.aggregate(Sum('clicks'))['clicks__sum'] or 0,
-        }
-    
-    # تحليل حسب المكان
-    placements = set(ads.values_list('placement__name', flat=True))
-    for placement in placements:
-        placement_ads = ads.filter(placement__name=placement)
-        analytics['by_placement'][placement] = {
-            'count': placement_ads.count(),
-            'impressions': placement_ads.aggregate(Sum('impressions'))['impressions__sum'] or 0,
-            'clicks': placement_ads.aggregate(Sum('clicks'))['clicks__sum'] or 0,
-        }
+    now = timezone.now()
+    seen_ads = set()
+    type_ads = {}
+    placement_ads = {}
+    for row in rows:
+        impressions, clicks = row['total_impressions'] or 0, row['total_clicks'] or 0
+        analytics['total_impressions'] += impressions
+        analytics['total_clicks'] += clicks
+        
+        if row['ad_id'] not in seen_ads:
+            seen_ads.add(row['ad_id'])
+            if row['ad__active'] and row['ad__start_date'] <= now <= row['ad__end_date']:
+                analytics['active_ads'] += 1
+        
+        # تحليل حسب النوع
+        by_type = analytics['by_type'].setdefault(row['ad__ad_type'], {'count': 0, 'impressions': 0, 'clicks': 0})
+        by_type['impressions'] += impressions
+        by_type['clicks'] += clicks
+        type_ads.setdefault(row['ad__ad_type'], set()).add(row['ad_id'])
+        
+        # تحليل حسب المكان (مكان الظهور وقتها وليس المكان الحالي للإعلان)
+        by_placement = analytics['by_placement'].setdefault(row['placement__name'], {'count': 0, 'impressions': 0, 'clicks': 0})
+        by_placement['impressions'] += impressions
+        by_placement['clicks'] += clicks
+        placement_ads.setdefault(row['placement__name'], set()).add(row['ad_id'])
+    
+    analytics['total_ads'] = len(seen_ads)
+    for ad_type, ad_ids in type_ads.items():
+        analytics['by_type'][ad_type]['count'] = len(ad_ids)
+    for placement, ad_ids in placement_ads.items():
+        analytics['by_placement'][placement]['count'] = len(ad_ids)
     
     return analytics
 
+def is_bot_request(request):
+    """
+    التحقق إذا كان الطلب من روبوت (باستخدام كاش تحليل User-Agent المشترك)
+    """
+    return request_device_info(request)['is_bot']
+
 def clear_ad_cache(placement_code=None):
     """
     مسح الكاش الخاص بالإعلانات
     """
-    if placement_code:
-        cache.delete(f'ad_{placement_code}_*')
-    else:
-        # مسح كل كاش الإعلانات
-        cache.delete_many([key for key in cache.keys('ad_*')])
+    # التعديلات الجماعية (update) لا تطلق الإشارات؛ الفهرس واحد لكل الأماكن
+    bump_generation()
     
     # مسح إحصائيات الكاش
     cache.delete('active_ads_count')
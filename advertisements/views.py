@@ -5,13 +5,16 @@ from django.utils.translation import gettext_lazy as _
 from django.http import JsonResponse, HttpResponse
 from django.db.models import Sum, Count, Q
 from django.utils import timezone
-from django.core.cache import cache
+from django.utils.cache import add_never_cache_headers
 from datetime import datetime, timedelta
 import json
 import csv
 from .models import Advertisement, AdPlacement
 from .forms import AdvertisementForm, AdPlacementForm
-from .utils import get_ad_analytics, clear_ad_cache, validate_ad_image, generate_ad_code
+from .counters import get_ad_counters
+from .events import daily_totals, event_range, event_totals
+from .serving import get_ad_index
+from .utils import get_ad_analytics, clear_ad_cache, validate_ad_image, generate_ad_code, is_bot_request
 from .models import Advertisement, AdPlacement
 
 # ==============================================
@@ -19,29 +22,22 @@ from .models import Advertisement, AdPlacement
 # ==============================================
 
 
-def render_ad_placement(request, code):
-    cache_key = f"ad_render_{code}"
-    html = cache.get(cache_key)
-
-    if not html:
-        ads = Advertisement.objects.filter(
-            placement__code=code,
-            active=True,
-            start_date__lte=timezone.now(),
-            end_date__gte=timezone.now()
-        ).select_related("placement").order_by("-priority")[:5]
+# أقصى عدد إعلانات في render_ad_placement
+PLACEMENT_AD_COUNT = 5
 
-        html = ""
-        for ad in ads:
-            ad.record_impression()
-            html += ad.get_display_html()
 
-        if not html:
-            html = "<!-- no ads -->"
+def render_ad_placement(request, code):
+    """إعلانات المكان بتدوير موزون لكل طلب؛ الظهور يُحتسب مع كل طلب"""
+    # من فهرس الإعلانات المؤهلة (بدون استعلام)؛ HTML الإعلانات فقط محفوظ
+    ads, html = get_ad_index().render(code, PLACEMENT_AD_COUNT)
 
-        cache.set(cache_key, html, 60)
+    if ads and not is_bot_request(request):
+        get_ad_counters().impression(ads, timezone.now())
 
-    return HttpResponse(html)
+    response = HttpResponse(html or "<!-- no ads -->")
+    # اختيار مختلف لكل طلب: لا يُحفظ في المتصفح أو الوسطاء فيضيع ظهوره
+    add_never_cache_headers(response)
+    return response
 
 
 def record_impression(request, ad_id):
@@ -51,7 +47,9 @@ def record_impression(request, ad_id):
         
         # التحقق من أن الإعلان نشط وفعال
         if ad.is_active():
-            ad.record_impression()
+            # ظهورات الروبوتات لا تُحتسب
+            if not is_bot_request(request):
+                ad.record_impression()
             
             # إرجاع صورة 1x1 شفافة لتعقب الظهور
             response = HttpResponse(
@@ -76,7 +74,8 @@ def record_click(request, ad_id):
         
         # التحقق من أن الإعلان نشط وفعال
         if ad.is_active():
-            ad.record_click()
+            if not is_bot_request(request):
+                ad.record_click()
             
             # إعادة توجيه إلى رابط الإعلان مع إضافة معلمات التتبع
             redirect_url = ad.link
@@ -148,32 +147,21 @@ def ad_dashboard(request):
     total_ads = Advertisement.objects.count()
     active_ads = sum(1 for ad in Advertisement.objects.all() if ad.is_active())
     
-    # إحصائيات من الكاش لتحسين الأداء
-    stats_cache_key = f'ad_stats_{request.user.id}'
-    stats = cache.get(stats_cache_key)
-    
-    if not stats:
-        total_impressions = Advertisement.objects.aggregate(Sum('impressions'))['impressions__sum'] or 0
-        total_clicks = Advertisement.objects.aggregate(Sum('clicks'))['clicks__sum'] or 0
-        
-        # نسبة النقر
-        ctr = (total_clicks / total_impressions * 100) if total_impressions > 0 else 0
-        
+    # الإجماليات بدون كاش: استعلام واحد على جدول الإعلانات، ثم الفروق التي لم تُفرغ بعد
+    warning_date = timezone.now() + timedelta(days=7)
+    totals = Advertisement.objects.aggregate(
+        impressions=Sum('impressions', default=0),
+        clicks=Sum('clicks', default=0),
         # الإعلانات المنتهية قريبًا (خلال 7 أيام)
-        warning_date = timezone.now() + timedelta(days=7)
-        expiring_ads = Advertisement.objects.filter(
-            end_date__lte=warning_date,
-            end_date__gte=timezone.now(),
-            active=True
-        ).count()
-        
-        stats = {
-            'total_impressions': total_impressions,
-            'total_clicks': total_clicks,
-            'ctr': round(ctr, 2),
-            'expiring_ads': expiring_ads,
-        }
-        cache.set(stats_cache_key, stats, 300)  # 5 دقائق
+        expiring=Count('pk', filter=Q(end_date__lte=warning_date, end_date__gte=timezone.now(), active=True)),
+    )
+    counters = get_ad_counters()
+    pending_impressions, pending_clicks = counters.pending_totals()
+    total_impressions = totals['impressions'] + pending_impressions
+    total_clicks = totals['clicks'] + pending_clicks
+    
+    # نسبة النقر
+    ctr = (total_clicks / total_impressions * 100) if total_impressions > 0 else 0
     
     # الحصول على قائمة الأماكن للفلتر
     placements = AdPlacement.objects.filter(active=True)
@@ -191,16 +179,17 @@ def ad_dashboard(request):
     start_idx = (page - 1) * items_per_page
     end_idx = start_idx + items_per_page
     
-    ads_paginated = ads[start_idx:end_idx]
+    # القيم المحفوظة مع الفروق التي لم تُفرغ بعد
+    ads_paginated = counters.apply_pending(list(ads[start_idx:end_idx]))
     
     context = {
         'ads': ads_paginated,
         'total_ads': total_ads,
         'active_ads': active_ads,
-        'total_impressions': stats['total_impressions'],
-        'total_clicks': stats['total_clicks'],
-        'ctr': stats['ctr'],
-        'expiring_ads_count': stats['expiring_ads'],
+        'total_impressions': total_impressions,
+        'total_clicks': total_clicks,
+        'ctr': round(ctr, 2),
+        'expiring_ads_count': totals['expiring'],
         'placements': placements,
         'search_query': search_query,
         'placement_filter': placement_filter,
@@ -255,74 +244,75 @@ def analytics_dashboard(request):
             start_date = timezone.now() - timedelta(days=30)
             end_date = timezone.now()
     
+    # حدود الفترة: التاريخ النهائي المخصص شامل
+    if custom_range:
+        range_start, range_end = event_range(start_date.date(), end_date.date())
+    else:
+        range_start, range_end = event_range(start_date, end_date)
+    
     # الحصول على التحليلات
-    analytics = get_ad_analytics(start_date, end_date)
+    analytics = get_ad_analytics(range_start, range_end)
+    
+    # ظهورات ونقرات الفترة لكل (مكان، إعلان) باستعلام واحد
+    ad_totals = {}
+    placement_totals = {}
+    for row in event_totals(range_start, range_end, 'placement_id', 'ad_id'):
+        counts = (row['total_impressions'] or 0, row['total_clicks'] or 0)
+        ad_impressions, ad_clicks = ad_totals.get(row['ad_id'], (0, 0))
+        ad_totals[row['ad_id']] = (ad_impressions + counts[0], ad_clicks + counts[1])
+        placement_total = placement_totals.setdefault(row['placement_id'], {'ads': set(), 'impressions': 0, 'clicks': 0})
+        placement_total['ads'].add(row['ad_id'])
+        placement_total['impressions'] += counts[0]
+        placement_total['clicks'] += counts[1]
+    
+    def ctr_of(ad_id):
+        impressions, clicks = ad_totals[ad_id]
+        return clicks * 100.0 / impressions
     
     # الإعلانات الأفضل أداءً (أعلى CTR)
-    top_ads = Advertisement.objects.filter(
-        start_date__gte=start_date,
-        end_date__lte=end_date,
-        impressions__gt=0
-    ).annotate(
-        ctr_calc=Sum('clicks') * 100.0 / Sum('impressions')
-    ).order_by('-ctr_calc')[:10]
-    
-    # الإعلانات الأسوأ أداءً
-    worst_ads = Advertisement.objects.filter(
-        start_date__gte=start_date,
-        end_date__lte=end_date,
-        impressions__gt=100  # على الأقل 100 ظهور لتكون ذات دلالة
-    ).annotate(
-        ctr_calc=Sum('clicks') * 100.0 / Sum('impressions')
-    ).order_by('ctr_calc')[:10]
+    top_ids = sorted((ad_id for ad_id, counts in ad_totals.items() if counts[0] > 0), key=ctr_of, reverse=True)[:10]
+    # الإعلانات الأسوأ أداءً (على الأقل 100 ظهور لتكون ذات دلالة)
+    worst_ids = sorted((ad_id for ad_id, counts in ad_totals.items() if counts[0] > 100), key=ctr_of)[:10]
+    
+    ads_by_id = Advertisement.objects.select_related('placement').in_bulk(set(top_ids) | set(worst_ids))
+    for ad_id, ad in ads_by_id.items():
+        ad.period_impressions, ad.period_clicks = ad_totals[ad_id]
+        ad.ctr_calc = ctr_of(ad_id)
+    top_ads = [ads_by_id[ad_id] for ad_id in top_ids if ad_id in ads_by_id]
+    worst_ads = [ads_by_id[ad_id] for ad_id in worst_ids if ad_id in ads_by_id]
     
     # إحصائيات حسب المكان
     placement_stats = []
-    for placement in AdPlacement.objects.filter(active=True):
-        placement_ads = Advertisement.objects.filter(
-            placement=placement,
-            start_date__gte=start_date,
-            end_date__lte=end_date
-        )
-        if placement_ads.exists():
-            total_impressions = placement_ads.aggregate(Sum('impressions'))['impressions__sum'] or 0
-            total_clicks = placement_ads.aggregate(Sum('clicks'))['clicks__sum'] or 0
-            ctr = (total_clicks / total_impressions * 100) if total_impressions > 0 else 0
-            
-            placement_stats.append({
-                'placement': placement,
-                'ads_count': placement_ads.count(),
-                'impressions': total_impressions,
-                'clicks': total_clicks,
-                'ctr': round(ctr, 2)
-            })
-    
-    # تحليل الأداء اليومي (آخر 30 يوم)
+    for placement in AdPlacement.objects.filter(active=True, pk__in=list(placement_totals)):
+        totals = placement_totals[placement.pk]
+        total_impressions, total_clicks = totals['impressions'], totals['clicks']
+        ctr = (total_clicks / total_impressions * 100) if total_impressions > 0 else 0
+        
+        placement_stats.append({
+            'placement': placement,
+            'ads_count': len(totals['ads']),
+            'impressions': total_impressions,
+            'clicks': total_clicks,
+            'ctr': round(ctr, 2)
+        })
+    
+    # تحليل الأداء اليومي (آخر 30 يوم) باستعلام واحد
+    today = timezone.localdate()
+    first_day = today - timedelta(days=29)
+    days = daily_totals(*event_range(first_day, today))
     daily_data = []
     for i in range(30):
-        date = timezone.now() - timedelta(days=i)
-        day_start = date.replace(hour=0, minute=0, second=0, microsecond=0)
-        day_end = date.replace(hour=23, minute=59, second=59, microsecond=999999)
-        
-        day_ads = Advertisement.objects.filter(
-            start_date__lte=day_end,
-            end_date__gte=day_start,
-            active=True
-        )
-        
-        day_impressions = day_ads.aggregate(Sum('impressions'))['impressions__sum'] or 0
-        day_clicks = day_ads.aggregate(Sum('clicks'))['clicks__sum'] or 0
+        date = first_day + timedelta(days=i)
+        day_impressions, day_clicks = days.get(date, (0, 0))
         day_ctr = (day_clicks / day_impressions * 100) if day_impressions > 0 else 0
         
         daily_data.append({
-            'date': day_start.strftime('%Y-%m-%d'),
+            'date': date.strftime('%Y-%m-%d'),
             'impressions': day_impressions,
             'clicks': day_clicks,
             'ctr': round(day_ctr, 2)
         })
     
-    daily_data.reverse()  # ترتيب من الأقدم إلى الأحدث
-    
     context = {
         'analytics': analytics,
         'top_ads': top_ads,
@@ -451,6 +441,7 @@ def edit_ad(request, pk):
 def preview_ad(request, pk):
     """معاينة الإعلان"""
     ad = get_object_or_404(Advertisement, pk=pk)
+    get_ad_counters().apply_pending([ad])
     
     # التحقق من الصلاحيات: المحررون يمكنهم معاينة إعلاناتهم فقط
     if request.user.user_type == 'editor' and ad.advertiser_email != request.user.email:
@@ -492,13 +483,9 @@ def manage_placements(request):
     
     # إحصائيات الأماكن
     placements_with_stats = []
+    ad_index = get_ad_index()
     for placement in placements:
-        active_ads = Advertisement.objects.filter(
-            placement=placement,
-            active=True,
-            start_date__lte=timezone.now(),
-            end_date__gte=timezone.now()
-        ).count()
+        active_ads = ad_index.count(placement.code)
         
         total_ads = Advertisement.objects.filter(placement=placement).count()
         
@@ -608,10 +595,13 @@ def export_analytics(request):
         try:
             start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
             end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
+            custom_range = True
         except ValueError:
+            custom_range = False
             start_date = timezone.now() - timedelta(days=30)
             end_date = timezone.now()
     else:
+        custom_range = False
         start_date = timezone.now() - timedelta(days=30)
         end_date = timezone.now()
     
@@ -631,14 +621,20 @@ def export_analytics(request):
         _('CTR'), _('Status'), _('Created At')
     ])
     
-    # الحصول على الإعلانات في الفترة المحددة
-    ads = Advertisement.objects.filter(
-        start_date__gte=start_date,
-        end_date__lte=end_date
-    ).select_related('placement')
+    # الإعلانات التي ظهرت في الفترة مع ظهوراتها ونقراتها فيها (التاريخ النهائي شامل)
+    if custom_range:
+        range_start, range_end = event_range(start_date.date(), end_date.date())
+    else:
+        range_start, range_end = event_range(start_date, end_date)
+    ad_totals = {
+        row['ad_id']: (row['total_impressions'] or 0, row['total_clicks'] or 0)
+        for row in event_totals(range_start, range_end, 'ad_id')
+    }
+    ads = Advertisement.objects.filter(pk__in=list(ad_totals)).select_related('placement')
     
     for ad in ads:
-        ctr = ad.get_ctr()
+        impressions, clicks = ad_totals[ad.pk]
+        ctr = (clicks / impressions * 100) if impressions > 0 else 0
         status = _('Active') if ad.is_active() else _('Inactive')
         
         writer.writerow([
@@ -648,8 +644,8 @@ def export_analytics(request):
             ad.advertiser_name,
             ad.start_date.strftime('%Y-%m-%d %H:%M'),
             ad.end_date.strftime('%Y-%m-%d %H:%M'),
-            ad.impressions,
-            ad.clicks,
+            impressions,
+            clicks,
             f'{ctr:.2f}%',
             status,
             ad.created_at.strftime('%Y-%m-%d %H:%M')
@@ -670,46 +666,8 @@ def ad_json_feed(request, placement_code=None):
     count = int(request.GET.get('count', 3))
     count = min(count, 10)  # حد أقصى 10 إعلانات
     
-    # إنشاء استعلام للإعلانات النشطة
-    ads_query = Advertisement.objects.filter(
-        active=True,
-        start_date__lte=timezone.now(),
-        end_date__gte=timezone.now()
-    ).select_related('placement')
-    
-    if placement_code:
-        ads_query = ads_query.filter(placement__code=placement_code)
-    
-    # تطبيق الأولوية ثم عشوائية
-    ads = list(ads_query.order_by('-priority'))
-    
-    # إذا كان هناك أكثر من العدد المطلوب، نختار عشوائياً مع مراعاة الأولوية
-    if len(ads) > count:
-        # فرز حسب الأولوية أولاً
-        ads.sort(key=lambda x: x.priority, reverse=True)
-        
-        # أخذ أعلى الأولويات
-        high_priority = [ad for ad in ads if ad.priority >= 3]
-        medium_priority = [ad for ad in ads if ad.priority == 2]
-        low_priority = [ad for ad in ads if ad.priority <= 1]
-        
-        selected_ads = []
-        
-        # توزيع الإعلانات حسب الأولوية
-        if high_priority:
-            selected_ads.extend(high_priority[:min(count, len(high_priority))])
-        
-        if len(selected_ads) < count and medium_priority:
-            import random
-            needed = count - len(selected_ads)
-            selected_ads.extend(random.sample(medium_priority, min(needed, len(medium_priority))))
-        
-        if len(selected_ads) < count and low_priority:
-            import random
-            needed = count - len(selected_ads)
-            selected_ads.extend(random.sample(low_priority, min(needed, len(low_priority))))
-        
-        ads = selected_ads
+    # تدوير موزون بالأولوية من فهرس الإعلانات المؤهلة (بدون استعلام)
+    ads = get_ad_index().rotate(placement_code or None, count)
     
     # تحضير بيانات JSON
     ads_data = []
@@ -3,7 +3,7 @@ from django.contrib import admin
 from django.utils.html import format_html
 from .models import (
     Country, VisitorSession, PageView, 
-    RealTimeVisitor, AnalyticsDashboard, AlertRule
+    RealTimeVisitor, AnalyticsDashboard, AlertRule, AnalyticsSettings
 )
 
 @admin.register(Country)
@@ -49,7 +49,7 @@ class VisitorSessionAdmin(admin.ModelAdmin):
 class PageViewAdmin(admin.ModelAdmin):
     list_display = ['title_short', 'session_link', 'time_spent', 'scroll_depth_display', 
                     'is_bounce_display', 'timestamp']
-    list_filter = ['is_bounce', 'timestamp']
+    list_filter = ['is_bounce', 'is_exit', 'timestamp']
     search_fields = ['title', 'url']
     readonly_fields = ['timestamp']
     
@@ -116,4 +116,8 @@ class AlertRuleAdmin(admin.ModelAdmin):
         if obj.enabled:
             return format_html('<span style="color: green;">● مفعل</span>')
         return format_html('<span style="color: red;">● معطل</span>')
-    enabled_display.short_description = 'الحالة'
\ No newline at end of file
+    enabled_display.short_description = 'الحالة'
+
+@admin.register(AnalyticsSettings)
+class AnalyticsSettingsAdmin(admin.ModelAdmin):
+    list_display = ['__str__', 'enable_tracking', 'sampling_rate', 'dashboard_refresh_interval']
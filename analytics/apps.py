@@ -1,6 +1,38 @@
+import os
+import sys
+import warnings
+
 from django.apps import AppConfig
 
+# أوامر الإدارة التي تخدم طلبات (الباقي لا يحتاج تحميل خريطة الدول)
+SERVING_COMMANDS = {'runserver'}
+
+
+def is_serving_process(argv=None):
+    """العملية تخدم طلبات (gunicorn/uvicorn/runserver) وليست أمر إدارة"""
+    argv = argv if argv is not None else sys.argv
+    program = os.path.basename(argv[0]) if argv else ''
+    # manage.py و django-admin و python -m django
+    if program in ('manage.py', 'django-admin', '__main__.py'):
+        return len(argv) > 1 and argv[1] in SERVING_COMMANDS
+    return True
+
 
 class AnalyticsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "analytics"
+
+    def ready(self):
+        import analytics.signals  # noqa: F401
+
+        if is_serving_process():
+            self.preload()
+
+    def preload(self):
+        """فتح قاعدة GeoIP وتحميل خريطة الدول قبل أول طلب في العامل"""
+        from .geo import get_geo_resolver
+
+        with warnings.catch_warnings():
+            # استعلام واحد مقصود أثناء التهيئة، وأوامر الإدارة مستثناة أعلاه
+            warnings.filterwarnings('ignore', message='Accessing the database during app initialization')
+            get_geo_resolver().preload()
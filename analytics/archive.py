@@ -0,0 +1,353 @@
+# analytics/archive.py
+"""
+أرشفة الأشهر المغلقة من البيانات الأصلية (VisitorSession و PageView).
+
+كل شهر يُكتب في ملفات NDJSON مضغوطة (gzip) مقسمة حسب التاريخ:
+    <ARCHIVE_ROOT>/<YYYY>/<MM>/sessions.ndjson.gz
+    <ARCHIVE_ROOT>/<YYYY>/<MM>/pageviews.ndjson.gz
+ثم تُحذف صفوفه على دفعات صغيرة (معاملة قصيرة لكل دفعة) حتى لا تُقفل
+الجداول طويلاً. الملف manifest.json يسجل لكل شهر الملفات وعدد الصفوف
+و sha256 والحالة (archived ثم purging ثم purged)، ويسمح بإعادة الشهر إلى
+قاعدة البيانات (rehydrate) للتحليل عند الحاجة. الحذف لا يبدأ إلا بعد مطابقة
+الملفات وعدد صفوف الشهر الحالي مع السجل.
+
+إذا كان PageView مقسماً شهرياً (partitioning.py) تُحذف أقسامه المؤرشفة
+بالكامل بدلاً من حذف صفوفها.
+
+لا يُؤرشف شهر إلا بعد انتهاء فترة الاحتفاظ وبعد أن تغطيه كل التجميعات
+(rollups)، فاللوحات لا تفقد شيئاً بحذف صفوفه.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from .models import Country, PageView, RealTimeVisitor, VisitorSession
+from .partitioning import drop_partitions_before, ensure_month_partition, partitioning_enabled
+from .rollups import ROLLUPS, first_tracked_day, get_watermark
+from .utils import analytics_setting
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.json'
+
+# النموذج واسم الملف لكل جدول مؤرشف (الجلسات أولاً لأن المشاهدات تشير إليها)
+ARCHIVED_MODELS = (
+    ('sessions', VisitorSession),
+    ('pageviews', PageView),
+)
+
+
+class ArchiveEncoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder يقص التوقيت إلى ميلي ثانية؛ الأرشيف يحتفظ بالميكرو ثانية"""
+
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def archive_root():
+    return analytics_setting('ARCHIVE_ROOT') or os.path.join(settings.MEDIA_ROOT, 'analytics_archive')
+
+
+def month_key(month):
+    return month.strftime('%Y-%m')
+
+
+def parse_month(value):
+    return datetime.strptime(value, '%Y-%m').date()
+
+
+def next_month(month):
+    return (month.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def month_bounds(month):
+    start = timezone.make_aware(datetime.combine(month, datetime.min.time()))
+    return start, timezone.make_aware(datetime.combine(next_month(month), datetime.min.time()))
+
+
+# ===== السجل (manifest) =====
+
+def load_manifest(root=None):
+    path = os.path.join(root or archive_root(), MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {'months': {}}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, root=None):
+    """كتابة ذرية: ملف مؤقت ثم os.replace"""
+    root = root or archive_root()
+    os.makedirs(root, exist_ok=True)
+    path = os.path.join(root, MANIFEST_NAME)
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(f'{path}.tmp', path)
+
+
+# ===== اختيار الأشهر =====
+
+def archivable_months(now=None, retention_months=None):
+    """الأشهر المغلقة الأقدم من فترة الاحتفاظ والتي غطتها كل التجميعات"""
+    now = now or timezone.now()
+    retention_months = retention_months or analytics_setting('RETENTION_MONTHS', 13)
+
+    cutoff = timezone.localdate(now).replace(day=1)
+    for _ in range(retention_months):
+        cutoff = (cutoff - timedelta(days=1)).replace(day=1)
+
+    # لا حذف قبل أن تعيد التجميعات حساب آخر يوم في الشهر
+    watermarks = [get_watermark(name) for name in ROLLUPS]
+    if any(watermark is None for watermark in watermarks):
+        return []
+    lag = timedelta(minutes=analytics_setting('SESSION_IDLE_MINUTES', 30) * 2)
+    covered = timezone.localdate(min(watermarks) - lag)
+
+    first = first_tracked_day()
+    if first is None:
+        return []
+    months = []
+    month = first.replace(day=1)
+    while month < cutoff and next_month(month) <= covered:
+        months.append(month)
+        month = next_month(month)
+    return months
+
+
+def month_querysets(month):
+    start, end = month_bounds(month)
+    sessions = VisitorSession.objects.filter(start_time__gte=start, start_time__lt=end)
+    return {
+        'sessions': sessions,
+        'pageviews': PageView.objects.filter(session__start_time__gte=start, session__start_time__lt=end),
+    }
+
+
+# ===== الكتابة =====
+
+def field_names(model):
+    return [field.attname for field in model._meta.concrete_fields]
+
+
+def write_ndjson(path, queryset, fields, chunk_size):
+    """كتابة الصفوف (مرتبة حسب pk) إلى gzip مؤقت ثم نقله؛ يعيد (العدد، sha256)"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    digest = hashlib.sha256()
+    count = 0
+    with gzip.open(f'{path}.tmp', 'wt', encoding='utf-8') as f:
+        for row in queryset.order_by('pk').values(*fields).iterator(chunk_size=chunk_size):
+            line = json.dumps(row, cls=ArchiveEncoder, ensure_ascii=False) + '\n'
+            f.write(line)
+            digest.update(line.encode('utf-8'))
+            count += 1
+    os.replace(f'{path}.tmp', path)
+    return count, digest.hexdigest()
+
+
+def export_month(month, root=None, chunk_size=2000):
+    """كتابة ملفات الشهر وتسجيلها في السجل بالحالة archived"""
+    root = root or archive_root()
+    key = month_key(month)
+    entry = load_manifest(root)['months'].get(key)
+    if entry and entry['status'] in ('purging', 'purged'):
+        # الكتابة فوق أرشيف شهر حُذفت صفوفه تفقده
+        raise ValueError(f'Month {key} has already been purged')
+    querysets = month_querysets(month)
+
+    files = {}
+    for name, model in ARCHIVED_MODELS:
+        relative = os.path.join(f'{month:%Y}', f'{month:%m}', f'{name}.ndjson.gz')
+        count, sha256 = write_ndjson(
+            os.path.join(root, relative), querysets[name], field_names(model), chunk_size,
+        )
+        files[name] = {'path': relative, 'rows': count, 'sha256': sha256}
+
+    manifest = load_manifest(root)
+    manifest['months'][key] = {
+        'status': 'archived',
+        'files': files,
+        'archived_at': timezone.now().isoformat(),
+    }
+    save_manifest(manifest, root)
+    logger.info('Archived analytics month %s: %s', key, {name: info['rows'] for name, info in files.items()})
+    return files
+
+
+def purge_month(month, root=None, batch_size=1000, pause=0.0):
+    """حذف صفوف الشهر المؤرشف على دفعات؛ يعيد عدد الجلسات المحذوفة"""
+    root = root or archive_root()
+    key = month_key(month)
+    manifest = load_manifest(root)
+    entry = manifest['months'].get(key)
+    if not entry or entry['status'] not in ('archived', 'rehydrated', 'purging'):
+        raise ValueError(f'Month {key} has not been archived')
+    # بعد حذف متقطع تكون الصفوف الباقية أقل من المؤرشفة، فالمقارنة بالملفات فقط
+    verify_month(month, entry, root, check_database=entry['status'] != 'purging')
+
+    entry['status'] = 'purging'
+    save_manifest(manifest, root)
+
+    if partitioning_enabled():
+        drop_partitions_before(partitions_archived_before(month))
+
+    sessions = month_querysets(month)['sessions']
+    deleted = 0
+    while True:
+        pks = list(sessions.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            break
+        with transaction.atomic():
+            # المشاهدات أولاً بحذف مباشر، ثم الجلسات (RealTimeVisitor يُحذف تتابعياً)
+            PageView.objects.filter(session_id__in=pks).delete()
+            VisitorSession.objects.filter(pk__in=pks).delete()
+        deleted += len(pks)
+        if pause:
+            time.sleep(pause)
+
+    entry['status'] = 'purged'
+    entry['purged_at'] = timezone.now().isoformat()
+    save_manifest(manifest, root)
+    logger.info('Purged %d archived sessions for %s', deleted, key)
+    return deleted
+
+
+def verify_month(month, entry, root, check_database=True):
+    """مطابقة ملفات الشهر مع السجل (sha256 وعدد الأسطر) ومع صفوفه الحالية؛ ValueError عند أي اختلاف"""
+    key = month_key(month)
+    querysets = month_querysets(month)
+    for name, _ in ARCHIVED_MODELS:
+        info = entry['files'][name]
+        digest = hashlib.sha256()
+        count = 0
+        try:
+            with gzip.open(os.path.join(root, info['path']), 'rt', encoding='utf-8') as f:
+                for line in f:
+                    digest.update(line.encode('utf-8'))
+                    count += 1
+        except OSError as exc:
+            raise ValueError(f'Archive file {info["path"]} for {key} is unreadable: {exc}') from exc
+        if digest.hexdigest() != info['sha256'] or count != info['rows']:
+            raise ValueError(f'Archive file {info["path"]} for {key} does not match the manifest')
+        # صفوف وصلت (أو حُذفت) بعد التصدير لم تُؤرشف كما هي
+        if check_database and querysets[name].count() != info['rows']:
+            raise ValueError(f'{name} rows for {key} changed since the export; archive the month again')
+
+
+def partitions_archived_before(month):
+    """أول شهر لا يمكن حذف قسمه بعد أرشفة month
+
+    قسم الشهر P يحوي مشاهدات جلسات بدأت في P أو قبله، فيُحذف فقط إذا لم
+    تبق في قاعدة البيانات جلسة غير مؤرشفة بدأت قبل نهايته.
+    """
+    start, end = month_bounds(month)
+    earliest = VisitorSession.objects.exclude(start_time__gte=start, start_time__lt=end).aggregate(
+        first=Min('start_time'),
+    )['first']
+    limit = next_month(month)
+    if earliest is not None:
+        limit = min(limit, timezone.localdate(earliest).replace(day=1))
+    return limit
+
+
+def archive_months(months, root=None, batch_size=1000, pause=0.0):
+    """أرشفة ثم حذف كل شهر على حدة؛ يعيد {الشهر: عدد الجلسات}"""
+    result = {}
+    for month in months:
+        if not month_querysets(month)['sessions'].exists():
+            continue
+        entry = load_manifest(root)['months'].get(month_key(month))
+        if entry and entry['status'] == 'purging':
+            # حذف انقطع في تشغيل سابق: إكماله بدون الكتابة فوق الأرشيف
+            files = entry['files']
+        else:
+            files = export_month(month, root)
+        purge_month(month, root, batch_size=batch_size, pause=pause)
+        result[month_key(month)] = files['sessions']['rows']
+    return result
+
+
+def prune_realtime_visitors(now=None, batch_size=1000):
+    """حذف صفوف RealTimeVisitor الأقدم من نافذة الحضور (لا قيمة لها بعد ذلك) على دفعات"""
+    cutoff = (now or timezone.now()) - timedelta(seconds=analytics_setting('PRESENCE_WINDOW', 300))
+    stale = RealTimeVisitor.objects.filter(last_activity__lt=cutoff)
+    deleted = 0
+    while True:
+        pks = list(stale.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        RealTimeVisitor.objects.filter(pk__in=pks).delete()
+        deleted += len(pks)
+
+
+# ===== القراءة والاستعادة =====
+
+def iter_archive(month, name, root=None):
+    """قراءة صفوف ملف مؤرشف كقواميس (للتحليل المباشر بدون استعادة)"""
+    root = root or archive_root()
+    entry = load_manifest(root)['months'][month_key(month)]
+    with gzip.open(os.path.join(root, entry['files'][name]['path']), 'rt', encoding='utf-8') as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def decode_row(model, row):
+    fields = {field.attname: field for field in model._meta.concrete_fields}
+    return model(**{name: fields[name].to_python(value) for name, value in row.items() if name in fields})
+
+
+def insert_rows(model, rows):
+    if model is VisitorSession:
+        # الدول أو المستخدمون المحذوفون بعد الأرشفة
+        countries = set(Country.objects.filter(pk__in={row.country_id for row in rows}).values_list('pk', flat=True))
+        users = set(User.objects.filter(pk__in={row.user_id for row in rows}).values_list('pk', flat=True))
+        for row in rows:
+            if row.country_id not in countries:
+                row.country_id = None
+            if row.user_id not in users:
+                row.user_id = None
+    return len(model.objects.bulk_create(rows, ignore_conflicts=True))
+
+
+def rehydrate_month(month, root=None, batch_size=1000):
+    """إعادة صفوف شهر مؤرشف إلى قاعدة البيانات بنفس المفاتيح؛ يعيد {الجدول: العدد}"""
+    root = root or archive_root()
+    key = month_key(month)
+    manifest = load_manifest(root)
+    entry = manifest['months'].get(key)
+    if not entry:
+        raise ValueError(f'Month {key} is not in the archive manifest')
+
+    # أقسام الشهر والشهر التالي (جلسات نهاية الشهر) إذا حُذفت عند الأرشفة
+    ensure_month_partition(month)
+    ensure_month_partition(next_month(month))
+
+    result = {}
+    for name, model in ARCHIVED_MODELS:
+        batch = []
+        count = 0
+        for row in iter_archive(month, name, root):
+            batch.append(decode_row(model, row))
+            if len(batch) >= batch_size:
+                count += insert_rows(model, batch)
+                batch = []
+        if batch:
+            count += insert_rows(model, batch)
+        result[name] = count
+
+    entry['status'] = 'rehydrated'
+    entry['rehydrated_at'] = timezone.now().isoformat()
+    save_manifest(manifest, root)
+    return result
@@ -0,0 +1,12 @@
+from django.urls import reverse
+
+
+def analytics_beacon(request):
+    """معرف المشاهدة الحالية ورابط إشارات التفاعل لسكربت analytics-beacon.js"""
+    view_id = getattr(request, 'analytics_view_id', None)
+    if not view_id:
+        return {}
+    return {
+        'analytics_view_id': view_id,
+        'analytics_beacon_url': reverse('analytics_engagement'),
+    }
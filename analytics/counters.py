@@ -0,0 +1,79 @@
+# analytics/counters.py
+"""
+عدادات الدول (Country.visits و total_time_spent و last_visit).
+
+كل دفعة إدخال أو sessionize تجمع الفروق لكل دولة في الذاكرة ثم تطبقها
+بزيادات F() - تحديث واحد لكل دولة في الدفعة - بدلاً من إعادة عد الجلسات.
+القيم موزونة بأوزان العينة مثل باقي التقارير.
+"""
+import math
+import random
+from datetime import timedelta
+
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Country, CountryAnalytics
+
+
+class CountryDeltas:
+    """فروق العدادات لكل دولة داخل دفعة واحدة"""
+
+    def __init__(self):
+        self.visits = {}
+        self.durations = {}
+        self.last_visits = {}
+
+    def __bool__(self):
+        return bool(self.visits or self.durations or self.last_visits)
+
+    def add_visit(self, country_id, weight, timestamp):
+        if country_id is None:
+            return
+        self.visits[country_id] = self.visits.get(country_id, 0.0) + weight
+        if self.last_visits.get(country_id) is None or timestamp > self.last_visits[country_id]:
+            self.last_visits[country_id] = timestamp
+
+    def add_duration(self, country_id, delta):
+        if country_id is None or not delta:
+            return
+        self.durations[country_id] = self.durations.get(country_id, timedelta(0)) + delta
+
+    def apply(self):
+        """تطبيق الفروق: UPDATE واحد لكل دولة تغيرت"""
+        for country_id in self.visits.keys() | self.durations.keys():
+            changes = {}
+            visits = stochastic_round(self.visits.get(country_id, 0.0))
+            if visits:
+                changes['visits'] = F('visits') + visits
+            duration = self.durations.get(country_id)
+            if duration:
+                changes['total_time_spent'] = F('total_time_spent') + duration
+            last_visit = self.last_visits.get(country_id)
+            if last_visit is not None:
+                changes['last_visit'] = Greatest(Coalesce('last_visit', last_visit), last_visit)
+            if changes:
+                Country.objects.filter(pk=country_id).update(**changes)
+
+
+def stochastic_round(value):
+    """تقريب غير متحيز إلى عدد صحيح: مجموع أوزان كسرية عبر دفعات كثيرة يبقى صحيحاً في المتوسط"""
+    whole = math.floor(value)
+    return whole + (1 if random.random() < value - whole else 0)
+
+
+def rebuild_country_counters():
+    """إعادة حساب visits و total_time_spent من التجميع اليومي للدول (لتصحيح أي انحراف)"""
+    totals = {
+        row['country']: row
+        for row in CountryAnalytics.objects.values('country').annotate(
+            weight=Sum('sessions'), duration=Sum('total_duration'),
+        ).order_by()
+    }
+    countries = list(Country.objects.all())
+    for country in countries:
+        row = totals.get(country.pk)
+        country.visits = round(row['weight']) if row else 0
+        country.total_time_spent = (row['duration'] or timedelta(0)) if row else timedelta(0)
+    Country.objects.bulk_update(countries, ['visits', 'total_time_spent'], batch_size=500)
+    return len(countries)
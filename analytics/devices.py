@@ -0,0 +1,137 @@
+# analytics/devices.py
+"""
+تصنيف User-Agent مع كاش مشترك.
+
+تحليل user_agents.parse() سلسلة طويلة من التعابير النمطية، ونصوص UA
+الحقيقية تتكرر بكثرة، لذلك يتم حفظ النتيجة في LRU مفتاحه بصمة النص.
+تستخدمه التحليلات و UserAgentMiddleware وكود عرض الإعلانات.
+"""
+import hashlib
+import threading
+
+import user_agents
+
+from .utils import LRUCache, analytics_setting
+
+
+def ua_key(ua_string):
+    """بصمة ثابتة الطول لنص User-Agent"""
+    return hashlib.blake2b(ua_string.encode('utf-8', 'ignore'), digest_size=16).digest()
+
+
+def describe(user_agent):
+    """استخراج معلومات الجهاز من User Agent"""
+    return {
+        'device_type': 'mobile' if user_agent.is_mobile else
+                      'tablet' if user_agent.is_tablet else
+                      'desktop',
+        'browser': user_agent.browser.family,
+        'browser_version': user_agent.browser.version_string,
+        'os': user_agent.os.family,
+        'os_version': user_agent.os.version_string,
+        'is_bot': user_agent.is_bot,
+    }
+
+
+class UAClassifier:
+    """تحليل User-Agent مرة واحدة لكل نص مميز"""
+
+    def __init__(self, cache_size=5000):
+        self.results = LRUCache(cache_size)
+
+    def _lookup(self, ua_string):
+        key = ua_key(ua_string or '')
+        result = self.results.get(key)
+        if result is None:
+            user_agent = user_agents.parse(ua_string or '')
+            result = (user_agent, describe(user_agent))
+            self.results.set(key, result)
+        return result
+
+    def parse(self, ua_string):
+        """كائن UserAgent (نفس نتيجة user_agents.parse)"""
+        return self._lookup(ua_string)[0]
+
+    def classify(self, ua_string):
+        """قاموس معلومات الجهاز - للقراءة فقط لأنه مشترك بين الطلبات"""
+        return self._lookup(ua_string)[1]
+
+    def is_bot(self, ua_string):
+        return self._lookup(ua_string)[1]['is_bot']
+
+    def stats(self):
+        return self.results.stats()
+
+
+_classifier = None
+_classifier_lock = threading.Lock()
+
+
+def get_ua_classifier():
+    """المصنف المشترك لهذه العملية"""
+    global _classifier
+    if _classifier is None:
+        with _classifier_lock:
+            if _classifier is None:
+                _classifier = UAClassifier(
+                    cache_size=analytics_setting('UA_CACHE_SIZE', 5000),
+                )
+    return _classifier
+
+
+# ===== عائلات المتصفحات وأنظمة التشغيل (للتجميعات) =====
+
+# بادئة اسم العائلة في ua-parser -> الاسم المجمع؛ الأكثر تحديداً أولاً
+BROWSER_FAMILIES = (
+    ('Chrome Mobile WebView', 'WebView'),
+    ('Chrome', 'Chrome'),
+    ('Chromium', 'Chrome'),
+    ('Mobile Safari', 'Safari'),
+    ('Safari', 'Safari'),
+    ('Firefox', 'Firefox'),
+    ('Edge', 'Edge'),
+    ('Samsung Internet', 'Samsung Internet'),
+    ('Opera', 'Opera'),
+    ('Yandex Browser', 'Yandex'),
+    ('UC Browser', 'UC Browser'),
+    ('Facebook', 'Facebook'),
+    ('Instagram', 'Instagram'),
+    ('MiuiBrowser', 'MIUI Browser'),
+    ('Huawei Browser', 'Huawei Browser'),
+    ('IE', 'Internet Explorer'),
+)
+
+OS_FAMILIES = (
+    ('Windows', 'Windows'),
+    ('Mac OS X', 'macOS'),
+    ('iOS', 'iOS'),
+    ('iPadOS', 'iOS'),
+    ('Android', 'Android'),
+    ('Chrome OS', 'Chrome OS'),
+    ('Ubuntu', 'Linux'),
+    ('Fedora', 'Linux'),
+    ('Debian', 'Linux'),
+    ('Linux', 'Linux'),
+    ('HarmonyOS', 'HarmonyOS'),
+)
+
+
+def normalize_family(name, families):
+    """اسم مجمع من قائمة ثابتة (وإلا Other) حتى يبقى عدد التركيبات صغيراً"""
+    for prefix, family in families:
+        if name and name.startswith(prefix):
+            return family
+    return 'Other'
+
+
+def browser_family(name):
+    return normalize_family(name, BROWSER_FAMILIES)
+
+
+def os_family(name):
+    return normalize_family(name, OS_FAMILIES)
+
+
+def request_device_info(request):
+    """معلومات الجهاز لطلب معين"""
+    return get_ua_classifier().classify(request.META.get('HTTP_USER_AGENT', ''))
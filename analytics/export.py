@@ -0,0 +1,147 @@
+# analytics/export.py
+"""
+تصدير الجلسات والمشاهدات الأصلية لفترة زمنية بصيغة CSV أو NDJSON.
+
+الصفوف تُقرأ بـ values_list(...).iterator(chunk_size) وتُكتب سطراً سطراً
+(مولد)، فالذاكرة ثابتة مهما كان عدد الصفوف؛ يستخدمه StreamingHttpResponse
+في export_raw_analytics والأمر export_analytics_raw.
+
+عنوان IP ومعلومات المتصفح الخام لا تُصدر.
+"""
+import csv
+import json
+from datetime import datetime, timedelta
+
+from django.utils import timezone
+
+from .archive import ArchiveEncoder
+from .models import PageView, VisitorSession
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+}
+
+# (اسم العمود، المسار في values_list)
+EXPORT_COLUMNS = {
+    'sessions': (
+        ('id', 'id'),
+        ('session_id', 'session_id'),
+        ('user_id', 'user_id'),
+        ('start_time', 'start_time'),
+        ('end_time', 'end_time'),
+        ('country', 'country__code'),
+        ('region', 'region'),
+        ('city', 'city'),
+        ('device_type', 'device_type'),
+        ('browser', 'browser'),
+        ('browser_version', 'browser_version'),
+        ('os', 'os'),
+        ('os_version', 'os_version'),
+        ('referrer', 'referrer'),
+        ('landing_page', 'landing_page'),
+        ('page_count', 'page_count'),
+        ('total_time_spent', 'total_time_spent'),
+        ('sample_weight', 'sample_weight'),
+    ),
+    'pageviews': (
+        ('id', 'id'),
+        ('view_id', 'view_id'),
+        ('session_id', 'session__session_id'),
+        ('timestamp', 'timestamp'),
+        ('url', 'url'),
+        ('title', 'title'),
+        ('time_spent', 'time_spent'),
+        ('scroll_depth', 'scroll_depth'),
+        ('is_bounce', 'is_bounce'),
+        ('is_exit', 'is_exit'),
+        ('country', 'session__country__code'),
+        ('device_type', 'session__device_type'),
+        ('sample_weight', 'session__sample_weight'),
+    ),
+}
+
+DEFAULT_CHUNK_SIZE = 2000
+
+
+def parse_date_range(start=None, end=None, default_days=30):
+    """(بداية، نهاية) كتواريخ محلية شاملة؛ الافتراضي آخر default_days يوماً"""
+    end = datetime.strptime(end, '%Y-%m-%d').date() if end else timezone.localdate()
+    start = datetime.strptime(start, '%Y-%m-%d').date() if start else end - timedelta(days=default_days - 1)
+    if start > end:
+        raise ValueError('Export start date is after its end date')
+    return start, end
+
+
+def export_queryset(kind, start, end, country=None, device=None, url_prefix=None):
+    """الاستعلام المرشح مرتباً حسب الوقت (start/end تواريخ محلية شاملة)"""
+    since = timezone.make_aware(datetime.combine(start, datetime.min.time()))
+    until = timezone.make_aware(datetime.combine(end + timedelta(days=1), datetime.min.time()))
+
+    if kind == 'sessions':
+        queryset = VisitorSession.objects.filter(start_time__gte=since, start_time__lt=until)
+        prefix = ''
+        url_field, order = 'landing_page', 'start_time'
+    elif kind == 'pageviews':
+        queryset = PageView.objects.filter(timestamp__gte=since, timestamp__lt=until)
+        prefix = 'session__'
+        url_field, order = 'url', 'timestamp'
+    else:
+        raise ValueError(f'Unknown export kind: {kind}')
+
+    if country:
+        queryset = queryset.filter(**{f'{prefix}country__code': country.upper()})
+    if device:
+        queryset = queryset.filter(**{f'{prefix}device_type': device})
+    if url_prefix:
+        queryset = queryset.filter(**{f'{url_field}__startswith': url_prefix})
+    return queryset.order_by(order, 'pk')
+
+
+def export_rows(kind, queryset, chunk_size=DEFAULT_CHUNK_SIZE):
+    """الصفوف كـ tuples بترتيب EXPORT_COLUMNS"""
+    paths = [path for _, path in EXPORT_COLUMNS[kind]]
+    return queryset.values_list(*paths).iterator(chunk_size=chunk_size)
+
+
+class Echo:
+    """كائن بواجهة ملف يعيد ما يُكتب فيه (csv.writer بدون تخزين)"""
+
+    def write(self, value):
+        return value
+
+
+def csv_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return value
+
+
+def stream_csv(kind, rows):
+    """BOM (ليقرأ Excel العربية بشكل صحيح) ثم العناوين ثم سطر لكل صف"""
+    writer = csv.writer(Echo())
+    yield '\ufeff' + writer.writerow([name for name, _ in EXPORT_COLUMNS[kind]])
+    for row in rows:
+        yield writer.writerow([csv_value(value) for value in row])
+
+
+def stream_ndjson(kind, rows):
+    names = [name for name, _ in EXPORT_COLUMNS[kind]]
+    for row in rows:
+        values = [value.total_seconds() if isinstance(value, timedelta) else value for value in row]
+        yield json.dumps(dict(zip(names, values)), cls=ArchiveEncoder, ensure_ascii=False) + '\n'
+
+
+def stream_export(kind, fmt, queryset, chunk_size=DEFAULT_CHUNK_SIZE):
+    """مولد النص المصدر بالصيغة المطلوبة"""
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown export format: {fmt}')
+    rows = export_rows(kind, queryset, chunk_size)
+    return stream_csv(kind, rows) if fmt == 'csv' else stream_ndjson(kind, rows)
+
+
+def export_filename(kind, fmt, start, end):
+    extension = 'csv' if fmt == 'csv' else 'ndjson'
+    return f'analytics_{kind}_{start:%Y%m%d}_{end:%Y%m%d}.{extension}'
@@ -0,0 +1,201 @@
+# analytics/geo.py
+"""
+خدمة تحديد الموقع الجغرافي مع كاش.
+
+- LRU مفتاحه بادئة IP (/24 لـ IPv4 و /48 لـ IPv6) لأن نفس الشبكات تتكرر كثيراً
+- خريطة كود الدولة -> Country.id محملة مسبقاً عند بدء العامل (apps.py) ويتم
+  تحديثها عند تغيير الدول
+"""
+import ipaddress
+import logging
+import os
+import threading
+import time
+
+import geoip2.database
+from django.conf import settings
+from django.db import DatabaseError
+
+from .utils import LRUCache, analytics_setting
+
+logger = logging.getLogger(__name__)
+
+# قيمة مميزة لتخزين النتائج الفارغة (عناوين خاصة أو غير معروفة) في الكاش
+_NO_RESULT = object()
+
+COUNTRY_TRANSLATIONS = {
+    'Egypt': 'مصر',
+    'Saudi Arabia': 'السعودية',
+    'United Arab Emirates': 'الإمارات',
+    'Qatar': 'قطر',
+    'Kuwait': 'الكويت',
+    'Oman': 'عُمان',
+    'Bahrain': 'البحرين',
+    'Jordan': 'الأردن',
+    'Lebanon': 'لبنان',
+    'Syria': 'سوريا',
+    'Iraq': 'العراق',
+    'Yemen': 'اليمن',
+    'Sudan': 'السودان',
+    'Algeria': 'الجزائر',
+    'Morocco': 'المغرب',
+    'Tunisia': 'تونس',
+    'Libya': 'ليبيا',
+    'Palestine': 'فلسطين',
+    'United States': 'الولايات المتحدة',
+    'United Kingdom': 'المملكة المتحدة',
+    'France': 'فرنسا',
+    'Germany': 'ألمانيا',
+    'Turkey': 'تركيا',
+    'India': 'الهند',
+    'China': 'الصين',
+    'Russia': 'روسيا',
+    'Brazil': 'البرازيل',
+}
+
+
+def get_flag_emoji(country_code):
+    """تحويل كود الدولة إلى إيموجي علم"""
+    if not country_code or len(country_code) != 2:
+        return "🌐"
+
+    # تحويل ASCII إلى إيموجي علم
+    try:
+        base = ord('🇦') - ord('A')
+        return ''.join(chr(ord(c.upper()) + base) for c in country_code)
+    except:
+        return "🌐"
+
+
+def translate_country_name(country_name):
+    """ترجمة أسماء الدول إلى العربية"""
+    return COUNTRY_TRANSLATIONS.get(country_name, country_name)
+
+
+def ip_prefix(ip_address):
+    """بادئة الشبكة المستخدمة كمفتاح للكاش"""
+    try:
+        ip = ipaddress.ip_address(ip_address)
+    except (TypeError, ValueError):
+        return None
+    prefix = 24 if ip.version == 4 else 48
+    return str(ipaddress.ip_network(f'{ip}/{prefix}', strict=False).network_address)
+
+
+class GeoResolver:
+    """تحديد الموقع من IP مع كاش للبادئات وخريطة الدول"""
+
+    def __init__(self, geoip_path=None, cache_size=20000, country_ttl=300):
+        self.reader = None
+        self.lookups = LRUCache(cache_size)
+        self.country_ttl = country_ttl
+        self._country_ids = None
+        self._countries_loaded_at = 0
+        self._lock = threading.Lock()
+
+        # تحميل قاعدة بيانات GeoIP2 إذا كانت موجودة
+        if geoip_path and os.path.exists(geoip_path):
+            try:
+                self.reader = geoip2.database.Reader(geoip_path)
+            except Exception:
+                logger.exception('Could not open GeoIP database at %s', geoip_path)
+
+    def resolve(self, ip_address):
+        """المعلومات الجغرافية لعنوان IP (من الكاش إن أمكن)"""
+        if not self.reader:
+            return None
+
+        key = ip_prefix(ip_address)
+        if key is None:
+            return None
+
+        geo_info = self.lookups.get(key)
+        if geo_info is None:
+            geo_info = self.lookup(ip_address) or _NO_RESULT
+            self.lookups.set(key, geo_info)
+        return None if geo_info is _NO_RESULT else geo_info
+
+    def lookup(self, ip_address):
+        """استعلام مباشر من قاعدة GeoIP بدون كاش"""
+        try:
+            response = self.reader.city(ip_address)
+        except Exception:
+            return None
+
+        # الحصول على كود الدولة وإيموجي العلم
+        country_code = response.country.iso_code
+
+        return {
+            'country_code': country_code,
+            'country_name': response.country.name,
+            'country_name_ar': translate_country_name(response.country.name),
+            'flag_emoji': get_flag_emoji(country_code),
+            'region': response.subdivisions.most_specific.name if response.subdivisions else None,
+            'city': response.city.name if response.city else None,
+            'latitude': response.location.latitude,
+            'longitude': response.location.longitude,
+            'timezone': response.location.time_zone,
+        }
+
+    # ===== خريطة الدول =====
+
+    def country_ids(self):
+        """{code: id} لكل الدول، يعاد تحميلها بعد انتهاء صلاحيتها"""
+        if self._country_ids is None or time.monotonic() - self._countries_loaded_at > self.country_ttl:
+            self.load_countries()
+        return self._country_ids
+
+    def load_countries(self):
+        from .models import Country
+
+        country_ids = dict(Country.objects.values_list('code', 'id'))
+        with self._lock:
+            self._country_ids = country_ids
+            self._countries_loaded_at = time.monotonic()
+
+    def add_country(self, code, country_id):
+        with self._lock:
+            if self._country_ids is not None:
+                self._country_ids[code] = country_id
+
+    def invalidate_countries(self):
+        with self._lock:
+            self._country_ids = None
+
+    def preload(self):
+        """تحميل خريطة الدول قبل أول طلب (من AnalyticsConfig.ready)"""
+        try:
+            self.load_countries()
+        except DatabaseError as exc:
+            # قبل migrate أو بدون قاعدة بيانات: تُحمّل عند أول طلب
+            logger.warning('Country map not preloaded: %s', exc)
+
+    def stats(self):
+        return {
+            'lookups': self.lookups.stats(),
+            'countries': len(self._country_ids or {}),
+            'enabled': self.reader is not None,
+        }
+
+    def close(self):
+        if self.reader:
+            self.reader.close()
+            self.reader = None
+
+
+_resolver = None
+_resolver_lock = threading.Lock()
+
+
+def get_geo_resolver():
+    """خدمة تحديد الموقع المشتركة لهذه العملية"""
+    global _resolver
+    if _resolver is None:
+        with _resolver_lock:
+            if _resolver is None:
+                _resolver = GeoResolver(
+                    geoip_path=getattr(settings, 'GEOIP_PATH', None),
+                    cache_size=analytics_setting('GEO_CACHE_SIZE', 20000),
+                    country_ttl=analytics_setting('COUNTRY_MAP_TTL', 300),
+                )
+    return _resolver
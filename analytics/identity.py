@@ -0,0 +1,106 @@
+# analytics/identity.py
+"""
+ربط هوية الزائر بجلسة VisitorSession.
+
+مفتاح جلسة Django -> معرف VisitorSession (UUID) -> المفتاح الأساسي (pk)،
+محفوظ في LRU داخل العملية مع كاش Django المشترك كمستوى ثانٍ، حتى لا
+يحتاج الزائر المعروف أي قراءة من قاعدة البيانات لتحديد جلسته.
+
+المستوى الثاني هو الكاش ANALYTICS_SETTINGS['IDENTITY_CACHE'] (Redis عند
+ضبط REDIS_URL). إذا كان locmem فهو خاص بكل عملية: كل عامل يبني خريطته
+بنفسه، والزائر الذي ينتقل إلى عامل آخر يُقرأ من قاعدة البيانات مرة.
+
+لا توجد هوية بديلة من IP + User-Agent: عملاء مختلفون خلف نفس NAT بنفس
+المتصفح كانوا يُدمجون في زائر واحد طوال عمر كوكي الجلسة.
+"""
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .utils import LRUCache, analytics_setting
+
+CACHE_PREFIX = 'analytics:visitor'
+
+
+class VisitorIdentityMap:
+    """خريطة هوية الزوار: مفتاح الجلسة -> visitor_id و visitor_id -> pk"""
+
+    def __init__(self, maxsize=50000, session_timeout=None, cache_alias='default'):
+        self.session_timeout = session_timeout or settings.SESSION_COOKIE_AGE
+        self.cache_alias = cache_alias
+        self._visitors = LRUCache(maxsize)
+        self._pks = LRUCache(maxsize)
+
+    @property
+    def cache(self):
+        # caches[...] يعيد اتصالاً لكل خيط
+        return caches[self.cache_alias]
+
+    def lookup(self, key):
+        """visitor_id المرتبط بمفتاح جلسة، أو None"""
+        visitor_id = self._visitors.get(key)
+        if visitor_id is None:
+            visitor_id = self.cache.get(f'{CACHE_PREFIX}:{key}')
+            if visitor_id is not None:
+                self._visitors.set(key, visitor_id)
+        return visitor_id
+
+    def bind(self, key, visitor_id):
+        """ربط مفتاح جلسة بمعرف الزائر"""
+        if self._visitors.get(key) == visitor_id:
+            return
+        self._visitors.set(key, visitor_id)
+        self.cache.set(f'{CACHE_PREFIX}:{key}', visitor_id, self.session_timeout)
+
+    def get_pks(self, visitor_ids):
+        """{visitor_id: pk} للمعروف منها (LRU ثم get_many على الكاش المشترك)"""
+        found = {}
+        remote = []
+        for visitor_id in visitor_ids:
+            pk = self._pks.get(visitor_id)
+            if pk is None:
+                remote.append(visitor_id)
+            else:
+                found[visitor_id] = pk
+
+        if remote:
+            cached = self.cache.get_many([f'{CACHE_PREFIX}_pk:{v}' for v in remote])
+            for visitor_id in remote:
+                pk = cached.get(f'{CACHE_PREFIX}_pk:{visitor_id}')
+                if pk is not None:
+                    self._pks.set(visitor_id, pk)
+                    found[visitor_id] = pk
+        return found
+
+    def set_pks(self, pks):
+        """حفظ {visitor_id: pk} بعد إنشاء الجلسات أو قراءتها"""
+        for visitor_id, pk in pks.items():
+            self._pks.set(visitor_id, pk)
+        self.cache.set_many(
+            {f'{CACHE_PREFIX}_pk:{v}': pk for v, pk in pks.items()},
+            self.session_timeout
+        )
+
+    def stats(self):
+        return {
+            'visitors': self._visitors.stats(),
+            'pks': self._pks.stats(),
+        }
+
+
+_identity_map = None
+_identity_lock = threading.Lock()
+
+
+def get_identity_map():
+    """خريطة الهوية المشتركة لهذه العملية"""
+    global _identity_map
+    if _identity_map is None:
+        with _identity_lock:
+            if _identity_map is None:
+                _identity_map = VisitorIdentityMap(
+                    maxsize=analytics_setting('IDENTITY_CACHE_SIZE', 50000),
+                    cache_alias=analytics_setting('IDENTITY_CACHE', 'default'),
+                )
+    return _identity_map
@@ -0,0 +1,491 @@
+# analytics/ingest.py
+"""
+خط إدخال مؤجل (write-behind) لأحداث التحليلات.
+
+الـ middleware يضيف سجلاً مختصراً لكل طلب إلى مخزن مؤقت داخل العملية،
+وخيط خلفي يفرغه على دفعات (bulk_create / تحديثات جماعية) كل N حدث
+أو كل T ميلي ثانية، بدلاً من ~7 استعلامات داخل كل طلب.
+
+إشارات التفاعل من المتصفح (عمق التمرير ووقت التفاعل) تُدمج في نفس المخزن
+حسب معرف المشاهدة، فآلاف الإشارات تصبح تحديثاً جماعياً واحداً لكل دفعة.
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import Counter, deque, namedtuple, OrderedDict
+from datetime import timedelta
+
+from django.db import close_old_connections, transaction
+from django.db.models import F
+
+from .counters import CountryDeltas
+from .geo import get_geo_resolver
+from .identity import get_identity_map
+from .models import VisitorSession, PageView, Country
+from .presence import get_presence_store
+from .routing import record_route_counts
+from .topk import get_top_pages_tracker
+from .utils import analytics_setting
+
+logger = logging.getLogger(__name__)
+
+# سجل حدث واحد - device_info و geo_info موجودان فقط في أول طلب للزائر
+# view_id معرف المشاهدة الذي ترسله صفحة المتصفح مع إشارات التفاعل
+# sample_weight وزن الزائر في وضع العينة (يُحفظ مع الجلسة عند إنشائها)
+PageEvent = namedtuple('PageEvent', [
+    'visitor_id', 'timestamp', 'method', 'url', 'title',
+    'ip_address', 'user_agent', 'referrer', 'user_id',
+    'device_info', 'geo_info', 'view_id', 'sample_weight',
+])
+
+# أقصى وقت تفاعل مقبول لمشاهدة واحدة (ملي ثانية)
+MAX_ENGAGED_MS = 6 * 60 * 60 * 1000
+
+# مدة انتظار إشارة لم تُكتب مشاهدتها بعد (ما زالت في مخزن عامل آخر)
+ENGAGEMENT_RETRY_SECONDS = 60
+
+
+def parse_engagement(body, max_events=20):
+    """تحقق سريع من جسم إشارة التفاعل: [{"v": view_id, "s": scroll%, "t": ms}]
+
+    يعيد [(view_id, scroll_depth, engaged_ms)] ويتجاهل العناصر غير الصالحة.
+    """
+    try:
+        items = json.loads(body)
+    except ValueError:
+        return []
+    if not isinstance(items, list):
+        return []
+
+    events = []
+    for item in items[:max_events]:
+        if not isinstance(item, dict):
+            continue
+        try:
+            view_id = str(uuid.UUID(str(item['v'])))
+            scroll_depth = min(max(int(item.get('s', 0)), 0), 100)
+            engaged_ms = min(max(int(item.get('t', 0)), 0), MAX_ENGAGED_MS)
+        except (KeyError, TypeError, ValueError):
+            continue
+        events.append((view_id, scroll_depth, engaged_ms))
+    return events
+
+
+class EventBuffer:
+    """مخزن مؤقت آمن للخيوط يتم تفريغه على دفعات بواسطة خيط خلفي"""
+
+    def __init__(self, max_events=500, flush_interval_ms=1000, max_backlog=50000):
+        self.max_events = max_events
+        self.flush_interval = flush_interval_ms / 1000.0
+        self._events = deque(maxlen=max_backlog)
+        self._counts = Counter()
+        # {view_id: [scroll_depth, engaged_ms, first_seen]} مدمجة بالقيمة القصوى
+        self._engagement = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.dropped = 0
+        self.flushed = 0
+
+    def __len__(self):
+        return len(self._events)
+
+    def append(self, event):
+        """إضافة حدث - لا يلمس قاعدة البيانات"""
+        with self._lock:
+            if len(self._events) == self._events.maxlen:
+                # امتلأ المخزن: يتم إسقاط أقدم حدث بدلاً من إبطاء الطلبات
+                self.dropped += 1
+            self._events.append(event)
+            pending = len(self._events)
+        self._ensure_thread()
+        if pending >= self.max_events:
+            self._wakeup.set()
+
+    def count(self, route):
+        """زيادة عداد مسار (count-only) بدون إنشاء حدث"""
+        with self._lock:
+            self._counts[route] += 1
+        self._ensure_thread()
+
+    def engage(self, events):
+        """دمج إشارات التفاعل حسب معرف المشاهدة - لا يلمس قاعدة البيانات"""
+        now = time.monotonic()
+        with self._lock:
+            for view_id, scroll_depth, engaged_ms in events:
+                pending = self._engagement.get(view_id)
+                if pending is None:
+                    self._engagement[view_id] = [scroll_depth, engaged_ms, now]
+                else:
+                    pending[0] = max(pending[0], scroll_depth)
+                    pending[1] = max(pending[1], engaged_ms)
+        self._ensure_thread()
+
+    def drain(self, limit=None):
+        """سحب الأحداث المعلقة من المخزن"""
+        with self._lock:
+            count = len(self._events) if limit is None else min(limit, len(self._events))
+            return [self._events.popleft() for _ in range(count)]
+
+    def flush(self, final=False):
+        """تفريغ كل الأحداث المعلقة إلى قاعدة البيانات على دفعات
+
+        final: حفظ ملخص أكثر الصفحات فوراً بدون انتظار فترة الحفظ (عند الخروج)
+        """
+        with self._flush_lock:
+            with self._lock:
+                counts, self._counts = self._counts, Counter()
+            if counts:
+                try:
+                    record_route_counts(counts)
+                except Exception:
+                    logger.exception('Failed to flush analytics route counters')
+
+            while True:
+                batch = self.drain(self.max_events)
+                if not batch:
+                    break
+                try:
+                    apply_events(batch)
+                    self.flushed += len(batch)
+                except Exception:
+                    logger.exception('Failed to flush %d analytics events', len(batch))
+
+            # بعد الأحداث حتى تكون مشاهدات هذه الدفعة موجودة
+            with self._lock:
+                engagement, self._engagement = self._engagement, {}
+            if engagement:
+                try:
+                    unresolved = apply_engagement(engagement)
+                except Exception:
+                    logger.exception('Failed to flush %d engagement updates', len(engagement))
+                    unresolved = {}
+                self._requeue_engagement(unresolved)
+
+            get_top_pages_tracker().checkpoint(force=final)
+
+    def _requeue_engagement(self, unresolved):
+        """إعادة الإشارات التي لم تُكتب مشاهدتها بعد، حتى ENGAGEMENT_RETRY_SECONDS"""
+        cutoff = time.monotonic() - ENGAGEMENT_RETRY_SECONDS
+        with self._lock:
+            for view_id, pending in unresolved.items():
+                if pending[2] < cutoff:
+                    continue
+                current = self._engagement.get(view_id)
+                if current is None:
+                    self._engagement[view_id] = pending
+                else:
+                    current[0] = max(current[0], pending[0])
+                    current[1] = max(current[1], pending[1])
+                    current[2] = min(current[2], pending[2])
+
+    def _ensure_thread(self):
+        # إعادة تشغيل الخيط بعد fork (عمال gunicorn)
+        pid = os.getpid()
+        if self._thread is not None and self._pid == pid and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == pid and self._thread.is_alive():
+                return
+            self._pid = pid
+            self._thread = threading.Thread(
+                target=self._run, name='analytics-flusher', daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if not self._events and not self._counts and not self._engagement:
+                continue
+            try:
+                self.flush()
+            finally:
+                # الخيط الخلفي يملك اتصاله الخاص بقاعدة البيانات
+                close_old_connections()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_event_buffer():
+    """المخزن المشترك لهذه العملية"""
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = EventBuffer(
+                    max_events=analytics_setting('BUFFER_MAX_EVENTS', 500),
+                    flush_interval_ms=analytics_setting('BUFFER_FLUSH_INTERVAL_MS', 1000),
+                    max_backlog=analytics_setting('BUFFER_MAX_BACKLOG', 50000),
+                )
+                atexit.register(_buffer.flush, True)
+    return _buffer
+
+
+# ===== تطبيق الدفعات على قاعدة البيانات =====
+
+def apply_events(events):
+    """كتابة دفعة من الأحداث بعدد ثابت من الاستعلامات"""
+    by_visitor = OrderedDict()
+    for event in sorted(events, key=lambda e: e.timestamp):
+        by_visitor.setdefault(event.visitor_id, []).append(event)
+
+    with transaction.atomic():
+        sessions = resolve_sessions(by_visitor)
+        record_page_views(by_visitor, sessions)
+    record_presence(by_visitor, sessions)
+    record_top_pages(by_visitor, sessions)
+
+
+def resolve_sessions(by_visitor):
+    """إرجاع {visitor_id: pk} مع إنشاء الجلسات الجديدة دفعة واحدة"""
+    identity = get_identity_map()
+    sessions = identity.get_pks(by_visitor)
+
+    # الزوار غير الموجودين في خريطة الهوية فقط يحتاجون قراءة من قاعدة البيانات
+    unknown = [visitor_id for visitor_id in by_visitor if visitor_id not in sessions]
+    if not unknown:
+        return sessions
+
+    resolved = {
+        str(session_id): pk
+        for session_id, pk in VisitorSession.objects.filter(
+            session_id__in=unknown
+        ).values_list('session_id', 'pk')
+    }
+
+    missing = [visitor_id for visitor_id in unknown if visitor_id not in resolved]
+    if missing:
+        countries = resolve_countries(
+            by_visitor[visitor_id][0].geo_info for visitor_id in missing
+        )
+        new_sessions = [
+            build_session(visitor_id, by_visitor[visitor_id][0], countries)
+            for visitor_id in missing
+        ]
+        VisitorSession.objects.bulk_create(new_sessions, ignore_conflicts=True)
+
+        # ignore_conflicts لا يعيد المفاتيح، لذا نقرأها في استعلام واحد. الصف
+        # الذي أنشأه عامل آخر لنفس الزائر يبدأ بحدث آخر (start_time مختلف)
+        built = {session.session_id: session for session in new_sessions}
+        country_deltas = CountryDeltas()
+        for session_id, pk, start_time in VisitorSession.objects.filter(
+            session_id__in=missing
+        ).values_list('session_id', 'pk', 'start_time'):
+            session_id = str(session_id)
+            resolved[session_id] = pk
+            session = built[session_id]
+            # زيادة عدادات الدول للجلسات التي أُدرجت فعلاً في هذه الدفعة فقط
+            if start_time == session.start_time:
+                country_deltas.add_visit(session.country_id, session.sample_weight, session.start_time)
+        country_deltas.apply()
+
+    identity.set_pks(resolved)
+    sessions.update(resolved)
+    return sessions
+
+
+def resolve_countries(geo_infos):
+    """{country_code: country_id} من الخريطة المحملة مسبقاً، مع إنشاء الدول الجديدة فقط"""
+    geo = get_geo_resolver()
+    country_ids = geo.country_ids()
+
+    countries = {}
+    for geo_info in geo_infos:
+        code = geo_info and geo_info.get('country_code')
+        if not code or code in countries:
+            continue
+        if code not in country_ids:
+            country, _ = Country.objects.get_or_create(
+                code=code,
+                defaults={
+                    'name': geo_info['country_name_ar'],
+                    'flag_emoji': geo_info['flag_emoji'],
+                }
+            )
+            geo.add_country(code, country.id)
+            countries[code] = country.id
+        else:
+            countries[code] = country_ids[code]
+    return countries
+
+
+def build_session(visitor_id, event, countries):
+    """بناء كائن VisitorSession من أول حدث للزائر"""
+    device_info = event.device_info or {}
+    geo_info = event.geo_info or {}
+
+    return VisitorSession(
+        session_id=visitor_id,
+        user_id=event.user_id,
+        ip_address=event.ip_address,
+        user_agent=event.user_agent,
+        device_type=device_info.get('device_type', 'desktop'),
+        browser=device_info.get('browser', 'Other'),
+        browser_version=device_info.get('browser_version'),
+        os=device_info.get('os', 'Other'),
+        os_version=device_info.get('os_version'),
+        country_id=countries.get(geo_info.get('country_code')),
+        region=geo_info.get('region'),
+        city=geo_info.get('city'),
+        latitude=geo_info.get('latitude'),
+        longitude=geo_info.get('longitude'),
+        referrer=event.referrer,
+        landing_page=event.url,
+        start_time=event.timestamp,
+        page_count=0,
+        sample_weight=event.sample_weight,
+        metadata={
+            'is_bot': device_info.get('is_bot', False),
+            'timezone': geo_info.get('timezone'),
+        }
+    )
+
+
+def record_page_views(by_visitor, sessions):
+    """إدراج مشاهدات الصفحات (إضافة فقط) وزيادة عدد الصفحات جماعياً
+
+    الوقت المنقضي والارتداد وصفحة الخروج تُحسب لاحقاً في sessionize
+    بعد خمول الجلسة، لذلك لا يتم قراءة أو تعديل أي مشاهدة سابقة هنا.
+    """
+    page_views = []
+    page_deltas = {}
+
+    for visitor_id, events in by_visitor.items():
+        if visitor_id not in sessions:
+            continue
+        pk = sessions[visitor_id]
+        views = [event for event in events if event.method == 'GET']
+        if not views:
+            continue
+
+        page_deltas[pk] = len(views)
+        page_views.extend(
+            PageView(
+                session_id=pk,
+                url=event.url,
+                title=event.title,
+                timestamp=event.timestamp,
+                time_spent=timedelta(0),
+                scroll_depth=0,
+                is_bounce=False,
+                view_id=event.view_id,
+            )
+            for event in views
+        )
+
+    if not page_views:
+        return
+
+    PageView.objects.bulk_create(page_views)
+
+    # تجميع الجلسات حسب مقدار الزيادة: استعلام UPDATE واحد لكل قيمة
+    # (is_active يعيد فتح جلسة أغلقها sessionize إذا عاد الزائر)
+    by_delta = {}
+    for pk, delta in page_deltas.items():
+        by_delta.setdefault(delta, []).append(pk)
+    for delta, pks in by_delta.items():
+        VisitorSession.objects.filter(pk__in=pks).update(
+            page_count=F('page_count') + delta,
+            is_active=True,
+        )
+
+
+def apply_engagement(engagement):
+    """تطبيق إشارات التفاعل المدمجة على PageView بتحديث جماعي واحد
+
+    عمق التمرير يؤخذ بالقيمة القصوى، ووقت التفاعل المقاس يحل محل التقدير
+    من الطلب التالي. الجلسات المغلقة (بعد sessionize) تُعدل مدتها بالفرق.
+    يعيد الإشارات التي لم توجد مشاهداتها بعد.
+    """
+    rows = PageView.objects.filter(view_id__in=list(engagement)).values_list(
+        'view_id', 'pk', 'session_id', 'scroll_depth', 'time_spent',
+        'session__is_active', 'session__total_time_spent',
+        'session__country_id', 'session__sample_weight',
+    )
+
+    page_views = []
+    closed_sessions = {}
+    country_deltas = CountryDeltas()
+    found = set()
+    for view_id, pk, session_id, scroll_depth, time_spent, is_active, total, country_id, weight in rows:
+        view_id = str(view_id)
+        found.add(view_id)
+        new_scroll, engaged_ms, _ = engagement[view_id]
+        new_scroll = max(scroll_depth, new_scroll)
+        new_time = timedelta(milliseconds=engaged_ms) if engaged_ms else time_spent
+        if (new_scroll, new_time) == (scroll_depth, time_spent):
+            continue
+        page_views.append(PageView(pk=pk, scroll_depth=new_scroll, time_spent=new_time))
+        if not is_active and new_time != time_spent:
+            session = closed_sessions.setdefault(
+                session_id, VisitorSession(pk=session_id, total_time_spent=total)
+            )
+            session.total_time_spent += new_time - time_spent
+            country_deltas.add_duration(country_id, (new_time - time_spent) * weight)
+
+    with transaction.atomic():
+        if page_views:
+            PageView.objects.bulk_update(page_views, ['scroll_depth', 'time_spent'])
+        if closed_sessions:
+            VisitorSession.objects.bulk_update(list(closed_sessions.values()), ['total_time_spent'])
+        country_deltas.apply()
+
+    return {view_id: pending for view_id, pending in engagement.items() if view_id not in found}
+
+
+def record_presence(by_visitor, sessions):
+    """تحديث مخزن الزوار المتصلين بآخر صفحة لكل زائر"""
+    entries = []
+    for visitor_id, events in by_visitor.items():
+        if visitor_id not in sessions:
+            continue
+        first, last = events[0], events[-1]
+        entry = {
+            'visitor_id': visitor_id,
+            'session_pk': sessions[visitor_id],
+            'last_activity': last.timestamp,
+            'current_page': last.url,
+        }
+        # ملف الزائر يُرسل مع أول حدث فقط، وبعدها تُحدّث الصفحة والدرجة
+        if first.device_info:
+            entry.update({
+                'device': first.device_info['device_type'],
+                'browser': first.device_info['browser'],
+                'started': first.timestamp,
+            })
+        if first.geo_info:
+            entry.update({
+                'country': first.geo_info['country_name_ar'],
+                'flag': first.geo_info['flag_emoji'],
+                'city': first.geo_info['city'],
+            })
+        entries.append(entry)
+
+    if entries:
+        get_presence_store().touch_many(entries)
+
+
+def record_top_pages(by_visitor, sessions):
+    """إضافة المشاهدات المكتوبة إلى متتبع أكثر الصفحات (في الذاكرة)"""
+    tracker = get_top_pages_tracker()
+    for visitor_id, events in by_visitor.items():
+        if visitor_id not in sessions:
+            continue
+        for event in events:
+            if event.method == 'GET':
+                tracker.add(event.url, event.title, event.sample_weight, event.timestamp)
+
+
+def flush_now():
+    """تفريغ فوري (للأوامر والاختبارات)"""
+    get_event_buffer().flush(final=True)
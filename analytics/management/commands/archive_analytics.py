@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics.archive import (
+    archivable_months, archive_months, archive_root, load_manifest, month_key, parse_month,
+    prune_realtime_visitors, rehydrate_month,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'أرشفة الأشهر المغلقة الأقدم من RETENTION_MONTHS إلى ملفات NDJSON مضغوطة ثم حذفها على دفعات '
+        '(مع حذف صفوف RealTimeVisitor المنتهية)، '
+        'أو إعادة شهر مؤرشف إلى قاعدة البيانات (--rehydrate)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--month', action='append', default=[],
+                            help='شهر محدد YYYY-MM (يمكن تكراره)؛ الافتراضي كل الأشهر المستحقة')
+        parser.add_argument('--retention-months', type=int, default=None,
+                            help='عدد الأشهر المحتفظ بها (الافتراضي ANALYTICS_SETTINGS["RETENTION_MONTHS"])')
+        parser.add_argument('--batch-size', type=int, default=1000, help='عدد الجلسات في كل دفعة حذف')
+        parser.add_argument('--pause', type=float, default=0.0, help='ثوان بين دفعات الحذف')
+        parser.add_argument('--dry-run', action='store_true', help='عرض الأشهر المستحقة فقط')
+        parser.add_argument('--rehydrate', metavar='YYYY-MM', help='إعادة شهر مؤرشف إلى قاعدة البيانات')
+        parser.add_argument('--list', action='store_true', help='عرض سجل الأرشيف')
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for key, entry in sorted(load_manifest()['months'].items()):
+                rows = ', '.join(f'{name}={info["rows"]}' for name, info in entry['files'].items())
+                self.stdout.write(f'{key}  {entry["status"]:<11} {rows}')
+            return
+
+        if options['rehydrate']:
+            try:
+                result = rehydrate_month(parse_month(options['rehydrate']))
+            except (ValueError, KeyError) as e:
+                raise CommandError(str(e))
+            self.stdout.write(self.style.SUCCESS(f'تمت الاستعادة: {result}'))
+            return
+
+        if not options['dry_run']:
+            pruned = prune_realtime_visitors(batch_size=options['batch_size'])
+            self.stdout.write(f'حذف {pruned} زائر فوري منتهي')
+
+        eligible = archivable_months(retention_months=options['retention_months'])
+        if options['month']:
+            requested = [parse_month(value) for value in options['month']]
+            not_eligible = [month_key(month) for month in requested if month not in eligible]
+            if not_eligible:
+                raise CommandError(f'أشهر غير مستحقة للأرشفة (ضمن فترة الاحتفاظ أو لم تغطها التجميعات): {not_eligible}')
+            eligible = requested
+
+        if not eligible:
+            self.stdout.write('لا توجد أشهر مستحقة للأرشفة')
+            return
+        if options['dry_run']:
+            self.stdout.write('الأشهر المستحقة: ' + ', '.join(month_key(month) for month in eligible))
+            return
+
+        try:
+            result = archive_months(eligible, batch_size=options['batch_size'], pause=options['pause'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        for key, sessions in result.items():
+            self.stdout.write(self.style.SUCCESS(f'{key}: تمت أرشفة وحذف {sessions} جلسة'))
+        self.stdout.write(f'المسار: {archive_root()}')
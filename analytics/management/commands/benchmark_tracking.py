@@ -0,0 +1,78 @@
+import asyncio
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+
+from analytics.ingest import flush_now
+
+TRACKING_MIDDLEWARE = 'analytics.middleware.AdvancedAnalyticsMiddleware'
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36'
+
+
+class Command(BaseCommand):
+    help = (
+        'قياس زمن استجابة الصفحة الرئيسية (p50/p99) عبر WSGI و ASGI مع التتبع وبدونه. '
+        'الطلبات تُنفذ داخل العملية بدون شبكة، وتُكتب بيانات تحليلات حقيقية في قاعدة البيانات الحالية.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='عدد الطلبات المقاسة لكل وضع')
+        parser.add_argument('--warmup', type=int, default=50, help='طلبات إحماء غير مقاسة')
+        parser.add_argument('--visitors', type=int, default=50, help='عدد الزوار المختلفين (كوكيز منفصلة)')
+        parser.add_argument('--path', default=None, help='المسار المقاس (الافتراضي: home)')
+
+    def handle(self, *args, **options):
+        path = options['path'] or reverse('home')
+        allowed_hosts = [*settings.ALLOWED_HOSTS, 'testserver']
+
+        results = []
+        for tracking in (False, True):
+            middleware = [m for m in settings.MIDDLEWARE if tracking or m != TRACKING_MIDDLEWARE]
+            with override_settings(MIDDLEWARE=middleware, ALLOWED_HOSTS=allowed_hosts):
+                results.append(('wsgi', tracking, self.run_wsgi(path, options)))
+                results.append(('asgi', tracking, asyncio.run(self.run_asgi(path, options))))
+        flush_now()
+
+        self.stdout.write(f'{path}  ({options["requests"]} طلب لكل وضع)')
+        self.stdout.write(f'{"mode":<6}{"tracking":<10}{"p50 ms":>10}{"p99 ms":>10}{"mean ms":>10}')
+        for mode, tracking, timings in results:
+            p50, p99, mean = summarize(timings)
+            self.stdout.write(f'{mode:<6}{"on" if tracking else "off":<10}{p50:>10.2f}{p99:>10.2f}{mean:>10.2f}')
+
+    def run_wsgi(self, path, options):
+        # كل عميل زائر مستقل: معرف الزائر في جلسته (كوكي الجلسة الخاصة به)
+        clients = [Client(HTTP_USER_AGENT=USER_AGENT) for _ in range(options['visitors'])]
+        for i in range(options['warmup']):
+            clients[i % len(clients)].get(path)
+
+        timings = []
+        for i in range(options['requests']):
+            started = time.perf_counter()
+            clients[i % len(clients)].get(path)
+            timings.append(time.perf_counter() - started)
+        return timings
+
+    async def run_asgi(self, path, options):
+        clients = [AsyncClient(HTTP_USER_AGENT=USER_AGENT) for _ in range(options['visitors'])]
+        for i in range(options['warmup']):
+            await clients[i % len(clients)].get(path)
+
+        timings = []
+        for i in range(options['requests']):
+            started = time.perf_counter()
+            await clients[i % len(clients)].get(path)
+            timings.append(time.perf_counter() - started)
+
+        # إعطاء مهام التتبع المعلقة فرصة للانتهاء قبل إغلاق الحلقة
+        await asyncio.sleep(0.1)
+        return timings
+
+
+def summarize(timings):
+    """(p50، p99، المتوسط) بالملي ثانية"""
+    cuts = statistics.quantiles(timings, n=100)
+    return cuts[49] * 1000, cuts[98] * 1000, statistics.fmean(timings) * 1000
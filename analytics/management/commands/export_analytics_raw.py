@@ -0,0 +1,49 @@
+import gzip
+
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics.export import DEFAULT_CHUNK_SIZE, FORMATS, export_queryset, parse_date_range, stream_export
+
+
+class Command(BaseCommand):
+    help = (
+        'تصدير الجلسات أو المشاهدات الأصلية لفترة إلى ملف CSV أو NDJSON '
+        '(نفس مخرجات /analytics/export/raw/؛ الملف المنتهي بـ .gz يُضغط)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=['sessions', 'pageviews'])
+        parser.add_argument('--format', choices=list(FORMATS), default='csv')
+        parser.add_argument('--start', help='أول يوم YYYY-MM-DD (الافتراضي قبل 30 يوماً)')
+        parser.add_argument('--end', help='آخر يوم YYYY-MM-DD (الافتراضي اليوم)')
+        parser.add_argument('--country', help='كود الدولة')
+        parser.add_argument('--device', help='نوع الجهاز (desktop, mobile, tablet)')
+        parser.add_argument('--url-prefix', help='بداية رابط الصفحة (صفحة الهبوط للجلسات)')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument('--output', '-o', help='مسار الملف (الافتراضي stdout)')
+
+    def handle(self, *args, **options):
+        try:
+            start, end = parse_date_range(options['start'], options['end'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        queryset = export_queryset(
+            options['kind'], start, end,
+            country=options['country'], device=options['device'], url_prefix=options['url_prefix'],
+        )
+        chunks = stream_export(options['kind'], options['format'], queryset, chunk_size=options['chunk_size'])
+
+        output = options['output']
+        if not output:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+
+        opener = gzip.open if output.endswith('.gz') else open
+        lines = 0
+        with opener(output, 'wt', encoding='utf-8', newline='') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                lines += 1
+        self.stderr.write(self.style.SUCCESS(f'{output}: {lines} سطر ({start} - {end})'))
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics.partitioning import (
+    PARTITIONED_TABLES, convert_to_partitioned, ensure_partitions, is_partitioned, is_postgresql, partitions,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'تقسيم جدول PageView شهرياً في PostgreSQL: تحويل الجدول مرة واحدة (--convert، يقفله أثناء النسخ) '
+        'ثم إنشاء أقسام الأشهر القادمة وعرض الأقسام الموجودة'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--convert', action='store_true',
+                            help='تحويل الجدول العادي إلى جدول مقسم (نافذة صيانة)')
+        parser.add_argument('--keep-old', action='store_true',
+                            help='الاحتفاظ بالجدول القديم باسم <table>_unpartitioned بعد التحويل')
+        parser.add_argument('--months-ahead', type=int, default=None,
+                            help='عدد الأشهر القادمة (الافتراضي ANALYTICS_SETTINGS["PARTITION_MONTHS_AHEAD"])')
+
+    def handle(self, *args, **options):
+        if not is_postgresql():
+            if options['convert']:
+                raise CommandError('التقسيم متاح في PostgreSQL فقط')
+            self.stdout.write('قاعدة البيانات ليست PostgreSQL: الجداول تبقى عادية')
+            return
+
+        if options['convert']:
+            for table in PARTITIONED_TABLES:
+                if convert_to_partitioned(table, keep_old=options['keep_old'], months_ahead=options['months_ahead']):
+                    self.stdout.write(self.style.SUCCESS(f'{table}: تم التحويل'))
+                else:
+                    self.stdout.write(f'{table}: مقسم مسبقاً')
+
+        ensured = ensure_partitions(months_ahead=options['months_ahead'])
+        self.stdout.write(f'الأقسام المضمونة للأشهر القادمة: {ensured}')
+
+        for table in PARTITIONED_TABLES:
+            if not is_partitioned(table):
+                self.stdout.write(f'{table}: غير مقسم (استخدم --convert)')
+                continue
+            names = [name for name, _ in partitions(table)]
+            self.stdout.write(f'{table}: {len(names)} قسم ({names[0]} ... {names[-1]})' if names else f'{table}: لا أقسام')
@@ -0,0 +1,74 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import FloatField, Max, Sum
+from django.utils import timezone
+
+from analytics.models import PageView, RealTimeStat
+from analytics.rollups import day_bounds
+from analytics.topk import WINDOWS, SpaceSaving, day_key, get_top_pages_tracker
+
+
+def exact_counts(start, end, limit=None):
+    """[(url, title, المشاهدات الموزونة)] من PageView مباشرة"""
+    rows = PageView.objects.filter(timestamp__gte=start, timestamp__lt=end).values('url').annotate(
+        views=Sum('session__sample_weight', output_field=FloatField()),
+        page_title=Max('title'),
+    ).order_by('-views')
+    if limit:
+        rows = rows[:limit]
+    return [(row['url'], row['page_title'], row['views']) for row in rows]
+
+
+class Command(BaseCommand):
+    help = 'مقارنة ملخص أكثر الصفحات بالعد الدقيق من PageView، أو إعادة بنائه منه (--rebuild)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--window', choices=list(WINDOWS), default='30d', help='النافذة المقارنة')
+        parser.add_argument('--k', type=int, default=10, help='عدد الصفحات المقارنة')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='استبدال ملخصات أيام النافذة بالعد الدقيق')
+
+    def handle(self, *args, **options):
+        window, k = options['window'], options['k']
+        tracker = get_top_pages_tracker()
+        tracker.checkpoint(force=True)
+
+        today = timezone.localdate()
+        days = [today - timedelta(days=offset) for offset in range(WINDOWS[window])]
+
+        if options['rebuild']:
+            for day in days:
+                self.rebuild_day(day, tracker.capacity)
+            tracker.invalidate(days)
+            self.stdout.write(self.style.SUCCESS(f'تمت إعادة بناء {len(days)} يوم'))
+
+        start, _ = day_bounds(days[-1])
+        _, end = day_bounds(today)
+        exact = exact_counts(start, end, k)
+        sketch = tracker.top(window, k)
+
+        sketch_views = {page['url']: page for page in sketch}
+        self.stdout.write(f'{"url":<60}{"exact":>10}{"sketch":>10}{"error":>8}')
+        for url, _, views in exact:
+            page = sketch_views.get(url)
+            estimate = f'{page["views"]:>10}{page["error"]:>8}' if page else f'{"-":>10}{"":>8}'
+            self.stdout.write(f'{url[:58]:<60}{round(views):>10}{estimate}')
+
+        overlap = len({url for url, _, _ in exact} & set(sketch_views))
+        self.stdout.write(f'تطابق أول {k}: {overlap}/{len(exact) or 0}')
+
+    def rebuild_day(self, day, capacity):
+        start, end = day_bounds(day)
+        rows = exact_counts(start, end, capacity)
+        name = day_key(day)
+        if not rows:
+            RealTimeStat.objects.filter(name=name).delete()
+            return
+        sketch = SpaceSaving(capacity)
+        for url, _, views in rows:
+            sketch.offer(url, views)
+        RealTimeStat.objects.update_or_create(name=name, defaults={'value': {
+            'sketch': sketch.to_dict(),
+            'titles': {url: title for url, title, _ in rows},
+        }})
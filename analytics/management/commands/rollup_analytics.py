@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from analytics.rollups import run_rollups
+
+
+class Command(BaseCommand):
+    help = 'تحديث التجميعات (اليومية والساعية والدول) للأيام التي تغيرت منذ آخر تشغيل'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='إعادة حساب كل الأيام من أول جلسة مسجلة وإعادة بناء عدادات الدول')
+
+    def handle(self, *args, **options):
+        result = run_rollups(full=options['full'])
+        for name, count in result.items():
+            self.stdout.write(self.style.SUCCESS(f'{name}: تم تحديث {count}'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from analytics.sessionize import sessionize
+
+
+class Command(BaseCommand):
+    help = 'حساب الوقت المنقضي والارتداد وصفحة الخروج للجلسات الخاملة وإغلاقها'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--idle-minutes', type=int, default=None,
+                            help='مدة الخمول قبل اعتبار الجلسة منتهية (الافتراضي من ANALYTICS_SETTINGS)')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='عدد الجلسات في كل دفعة')
+
+    def handle(self, *args, **options):
+        closed, updated = sessionize(
+            idle_minutes=options['idle_minutes'],
+            batch_size=options['batch_size'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'تمت معالجة {closed} جلسة وتحديث {updated} مشاهدة'
+        ))
@@ -1,79 +1,214 @@
 # analytics/middleware.py
-import geoip2.database
-import geoip2.errors
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
 from django.utils import timezone
-import user_agents
-from datetime import timedelta
-import os
-from django.conf import settings
-import json
-from .models import VisitorSession, PageView, Country, RealTimeVisitor
+from django.utils.functional import SimpleLazyObject
+from collections import namedtuple
+import asyncio
+import logging
+import uuid
+from .devices import get_ua_classifier
+from .geo import get_geo_resolver
+from .identity import get_identity_map
+from .ingest import PageEvent, get_event_buffer
+from .rollups import start_rollup_runner
+from .routing import COUNT, TRACK, build_route_classifier
+from .sampling import get_sampler
+
+logger = logging.getLogger(__name__)
+
+# مفتاح معرف الزائر داخل جلسة Django
+VISITOR_ID_SESSION_KEY = '_analytics_visitor_id'
+
+# ما يتم تحديده قبل الـ view (يحتاج الجلسة)، والباقي يُحسب عند الإضافة للمخزن
+PendingEvent = namedtuple('PendingEvent', [
+    'visitor_id', 'is_new', 'timestamp', 'ip_address', 'user_agent',
+    'view_id', 'sample_weight',
+])
+
+class UserAgentMiddleware:
+    """
+    بديل django_user_agents.middleware.UserAgentMiddleware يستخدم نفس كاش التحليل
+    حتى لا يتم تحليل نفس User-Agent مرتين في الطلب
+    """
+    sync_capable = True
+    async_capable = True
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+    
+    def __call__(self, request):
+        request.user_agent = SimpleLazyObject(
+            lambda: get_ua_classifier().parse(request.META.get('HTTP_USER_AGENT', ''))
+        )
+        return self.get_response(request)
+
 
 class AdvancedAnalyticsMiddleware:
-    """Middleware متقدم لتتبع الزوار بدقة"""
+    """Middleware متقدم لتتبع الزوار بدقة
+    
+    يعمل مع WSGI (gunicorn) و ASGI: في الوضع غير المتزامن يتم تجهيز الحدث
+    قبل الـ view (معرف الزائر والعينة من الجلسة) ثم إضافته للمخزن في مهمة
+    منفصلة بعد بدء الاستجابة، فلا يضيف التتبع أي زمن للطلب.
+    """
+    sync_capable = True
+    async_capable = True
     
     def __init__(self, get_response):
         self.get_response = get_response
-        self.geoip_reader = None
-        
-        # تحميل قاعدة بيانات GeoIP2 إذا كانت موجودة
-        geoip_path = getattr(settings, 'GEOIP_PATH', None)
-        if geoip_path and os.path.exists(geoip_path):
-            try:
-                self.geoip_reader = geoip2.database.Reader(geoip_path)
-            except:
-                self.geoip_reader = None
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        # خدمة GeoIP مشتركة مع كاش للبادئات
+        self.geo = get_geo_resolver()
+        # قواعد التصنيف (track / count / ignore) مجمعة مرة واحدة
+        self.routes = build_route_classifier()
+        self.sampler = get_sampler()
+        # التجميعات الدورية (إذا كانت مفعلة في الإعدادات)
+        start_rollup_runner()
+        # مراجع للمهام الجارية حتى لا يتم جمعها قبل انتهائها
+        self._tasks = set()
     
     def __call__(self, request):
-        # تجنب تتبع طلبات AJAX أو static أو admin
-        if self.should_skip_tracking(request):
-            return self.get_response(request)
+        if self.is_async:
+            return self.__acall__(request)
+        
+        pending = None
+        try:
+            pending = self.prepare_event(request)
+            if pending is not None:
+                user = request.user
+                self.enqueue_event(request, pending, user.pk if user.is_authenticated else None)
+        except Exception:
+            # التتبع لا يجب أن يعطل الطلب
+            logger.exception('Failed to enqueue analytics event')
+        
+        return self.get_response(request)
+    
+    async def __acall__(self, request):
+        pending = None
+        try:
+            classified = self.routes.classify(request)
+            if classified[0] == TRACK:
+                # تحميل الجلسة بدون حجب، وبعدها قراءتها وتعديلها لا يلمسان قاعدة البيانات
+                await request.session.aget(VISITOR_ID_SESSION_KEY)
+                # نسبة العينة من AnalyticsSettings تُحمّل مرة كل فترة خارج حلقة الأحداث
+                if self.sampler.settings_stale():
+                    await sync_to_async(self.sampler.load_settings)()
+            pending = self.prepare_event(request, classified)
+        except Exception:
+            logger.exception('Failed to prepare analytics event')
+        
+        response = await self.get_response(request)
+        
+        if pending is not None:
+            task = asyncio.create_task(self.atrack(request, pending))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return response
+    
+    async def atrack(self, request, pending):
+        """إضافة الحدث للمخزن بعد بدء الاستجابة (fire-and-forget)"""
+        try:
+            user = await request.auser()
+            # تحليل User Agent وقراءة ملف GeoIP حاجبان: يتمان في خيط خارج حلقة الأحداث
+            profile = await sync_to_async(self.resolve_profile, thread_sensitive=False)(pending)
+            self.enqueue_event(request, pending, user.pk if user.is_authenticated else None, profile)
+        except Exception:
+            logger.exception('Failed to enqueue analytics event')
+    
+    def prepare_event(self, request, classified=None):
+        """تصنيف الطلب وتحديد الزائر؛ يعيد PendingEvent للطلبات المتتبعة فقط
+        
+        classified: نتيجة routes.classify إذا صُنف الطلب مسبقاً (__acall__)
+        """
+        # طلبات admin و static لا تُتتبع، والإعلانات و AJAX والروبوتات تُعد فقط
+        action, route = classified or self.routes.classify(request)
+        if action == COUNT:
+            get_event_buffer().count(route)
+        if action != TRACK:
+            return None
         
-        # استخراج معلومات المستخدم
-        session_key = request.session.session_key
         ip_address = self.get_client_ip(request)
         user_agent_string = request.META.get('HTTP_USER_AGENT', '')
+        visitor_id, is_new = self.get_visitor_id(request)
         
-        # تحليل User Agent
-        user_agent = user_agents.parse(user_agent_string)
-        
-        # معلومات الجهاز والمتصفح
-        device_info = self.get_device_info(user_agent)
-        
-        # معلومات جغرافية
-        geo_info = self.get_geo_info(ip_address)
+        # وضع العينة: الزوار خارج العينة يُعدون فقط
+        buffer = get_event_buffer()
+        sample_weight = self.sampler.request_weight(request, visitor_id, backlog=len(buffer))
+        if not sample_weight:
+            buffer.count('unsampled')
+            return None
         
-        # إنشاء أو تحديث جلسة الزائر
-        visitor_session = self.create_or_update_session(
-            request, session_key, ip_address, user_agent_string, device_info, geo_info
+        # معرف المشاهدة يُرسل إلى الصفحة لربط إشارات التفاعل بها
+        view_id = str(uuid.uuid4()) if request.method == 'GET' else None
+        
+        # إضافة معرف الجلسة إلى request للوصول إليه في views
+        request.visitor_session_id = visitor_id
+        request.analytics_view_id = view_id
+        
+        return PendingEvent(
+            visitor_id=visitor_id,
+            is_new=is_new,
+            timestamp=timezone.now(),
+            ip_address=ip_address,
+            user_agent=user_agent_string,
+            view_id=view_id,
+            sample_weight=sample_weight,
         )
+    
+    def resolve_profile(self, pending):
+        """(device_info, geo_info) للزائر الجديد فقط، وإلا (None, None)"""
+        # تحليل User Agent والموقع يتم فقط عند أول ظهور للزائر
+        if not pending.is_new:
+            return None, None
+        return self.get_device_info(pending.user_agent), self.get_geo_info(pending.ip_address)
+    
+    def enqueue_event(self, request, pending, user_id, profile=None):
+        """إضافة سجل مختصر للطلب إلى مخزن الإدخال المؤجل"""
+        device_info, geo_info = profile or self.resolve_profile(pending)
+        
+        get_event_buffer().append(PageEvent(
+            visitor_id=pending.visitor_id,
+            timestamp=pending.timestamp,
+            method=request.method,
+            url=request.build_absolute_uri(),
+            title=self.get_page_title(request) or request.path,
+            ip_address=pending.ip_address,
+            user_agent=pending.user_agent,
+            referrer=request.META.get('HTTP_REFERER'),
+            user_id=user_id,
+            device_info=device_info,
+            geo_info=geo_info,
+            view_id=pending.view_id,
+            sample_weight=pending.sample_weight,
+        ))
+    
+    def get_visitor_id(self, request):
+        """معرف VisitorSession (UUID) للزائر: من خريطة الهوية أولاً ثم جلسة Django
+        
+        الطلب بدون كوكي جلسة زائر جديد دائماً؛ المعرف يُحفظ في الجلسة فيصل
+        كوكيها مع الاستجابة. لا يُستنتج الزائر من IP + User-Agent لأن عملاء
+        مختلفين خلف نفس NAT يتشاركونهما.
+        """
+        identity = get_identity_map()
+        session_key = request.session.session_key
         
-        # تتبع المشاهدة الحالية
-        if request.method == 'GET':
-            self.track_page_view(request, visitor_session)
-        
-        # تحديث الزوار المتصلين حالياً
-        self.update_realtime_visitor(visitor_session, request)
-        
-        # إضافة الجلسة إلى request للوصول إليها في views
-        request.visitor_session = visitor_session
+        visitor_id = identity.lookup(session_key) if session_key else None
+        if visitor_id is None:
+            visitor_id = request.session.get(VISITOR_ID_SESSION_KEY)
         
-        response = self.get_response(request)
+        is_new = visitor_id is None
+        if is_new:
+            visitor_id = str(uuid.uuid4())
         
-        # تحديث وقت النشاط بعد إرجاع الاستجابة
-        self.update_session_activity(visitor_session)
+        if request.session.get(VISITOR_ID_SESSION_KEY) != visitor_id:
+            request.session[VISITOR_ID_SESSION_KEY] = visitor_id
+        if session_key:
+            identity.bind(session_key, visitor_id)
         
-        return response
-    
-    def should_skip_tracking(self, request):
-        """التحقق إذا كان يجب تخطي التتبع"""
-        skip_paths = [
-            '/admin/', '/static/', '/media/', 
-            '/api/analytics/', '/favicon.ico',
-            '/health/', '/robots.txt'
-        ]
-        
-        return any(request.path.startswith(path) for path in skip_paths)
+        return visitor_id, is_new
     
     def get_client_ip(self, request):
         """استخراج عنوان IP الحقيقي"""
@@ -84,209 +219,13 @@ class AdvancedAnalyticsMiddleware:
             ip = request.META.get('REMOTE_ADDR')
         return ip
     
-    def get_device_info(self, user_agent):
-        """استخراج معلومات الجهاز من User Agent"""
-        return {
-            'device_type': 'mobile' if user_agent.is_mobile else 
-                          'tablet' if user_agent.is_tablet else 
-                          'desktop',
-            'browser': user_agent.browser.family,
-            'browser_version': user_agent.browser.version_string,
-            'os': user_agent.os.family,
-            'os_version': user_agent.os.version_string,
-            'is_bot': user_agent.is_bot,
-        }
+    def get_device_info(self, user_agent_string):
+        """استخراج معلومات الجهاز من User Agent (من الكاش المشترك)"""
+        return get_ua_classifier().classify(user_agent_string)
     
     def get_geo_info(self, ip_address):
         """الحصول على المعلومات الجغرافية"""
-        if not self.geoip_reader:
-            return None
-        
-        try:
-            response = self.geoip_reader.city(ip_address)
-            
-            # الحصول على كود الدولة وإيموجي العلم
-            country_code = response.country.iso_code
-            flag_emoji = self.get_flag_emoji(country_code)
-            
-            return {
-                'country_code': country_code,
-                'country_name': response.country.name,
-                'country_name_ar': self.translate_country_name(response.country.name),
-                'flag_emoji': flag_emoji,
-                'region': response.subdivisions.most_specific.name if response.subdivisions else None,
-                'city': response.city.name if response.city else None,
-                'latitude': response.location.latitude,
-                'longitude': response.location.longitude,
-                'timezone': response.location.time_zone,
-            }
-        except:
-            return None
-    
-    def get_flag_emoji(self, country_code):
-        """تحويل كود الدولة إلى إيموجي علم"""
-        if not country_code or len(country_code) != 2:
-            return "🌐"
-        
-        # تحويل ASCII إلى إيموجي علم
-        try:
-            base = ord('🇦') - ord('A')
-            emoji = ''.join(chr(ord(c.upper()) + base) for c in country_code)
-            return emoji
-        except:
-            return "🌐"
-    
-    def translate_country_name(self, country_name):
-        """ترجمة أسماء الدول إلى العربية"""
-        translations = {
-            'Egypt': 'مصر',
-            'Saudi Arabia': 'السعودية',
-            'United Arab Emirates': 'الإمارات',
-            'Qatar': 'قطر',
-            'Kuwait': 'الكويت',
-            'Oman': 'عُمان',
-            'Bahrain': 'البحرين',
-            'Jordan': 'الأردن',
-            'Lebanon': 'لبنان',
-            'Syria': 'سوريا',
-            'Iraq': 'العراق',
-            'Yemen': 'اليمن',
-            'Sudan': 'السودان',
-            'Algeria': 'الجزائر',
-            'Morocco': 'المغرب',
-            'Tunisia': 'تونس',
-            'Libya': 'ليبيا',
-            'Palestine': 'فلسطين',
-            'United States': 'الولايات المتحدة',
-            'United Kingdom': 'المملكة المتحدة',
-            'France': 'فرنسا',
-            'Germany': 'ألمانيا',
-            'Turkey': 'تركيا',
-            'India': 'الهند',
-            'China': 'الصين',
-            'Russia': 'روسيا',
-            'Brazil': 'البرازيل',
-        }
-        
-        return translations.get(country_name, country_name)
-    
-    def create_or_update_session(self, request, session_key, ip_address, user_agent_string, device_info, geo_info):
-        """إنشاء أو تحديث جلسة الزائر"""
-        try:
-            # البحث عن جلسة نشطة
-            session = VisitorSession.objects.filter(
-                session_id=session_key,
-                is_active=True
-            ).first()
-            
-            if not session:
-                # إنشاء دولة جديدة إذا لم تكن موجودة
-                country = None
-                if geo_info:
-                    country, _ = Country.objects.get_or_create(
-                        code=geo_info['country_code'],
-                        defaults={
-                            'name': geo_info['country_name_ar'],
-                            'flag_emoji': geo_info['flag_emoji']
-                        }
-                    )
-                
-                # إنشاء جلسة جديدة
-                session = VisitorSession.objects.create(
-                    session_id=session_key,
-                    user=request.user if request.user.is_authenticated else None,
-                    ip_address=ip_address,
-                    user_agent=user_agent_string,
-                    device_type=device_info['device_type'],
-                    browser=device_info['browser'],
-                    browser_version=device_info['browser_version'],
-                    os=device_info['os'],
-                    os_version=device_info['os_version'],
-                    country=country,
-                    region=geo_info['region'] if geo_info else None,
-                    city=geo_info['city'] if geo_info else None,
-                    latitude=geo_info['latitude'] if geo_info else None,
-                    longitude=geo_info['longitude'] if geo_info else None,
-                    referrer=request.META.get('HTTP_REFERER'),
-                    landing_page=request.build_absolute_uri(),
-                    metadata={
-                        'is_bot': device_info['is_bot'],
-                        'timezone': geo_info.get('timezone') if geo_info else None,
-                    }
-                )
-            
-            return session
-            
-        except Exception as e:
-            # في حالة الخطأ، إرجاع جلسة افتراضية
-            return None
-    
-    def track_page_view(self, request, visitor_session):
-        """تتبع مشاهدة الصفحة الحالية"""
-        if not visitor_session:
-            return
-        
-        # حساب الوقت المنقضي في الصفحة السابقة
-        self.update_previous_page_time(visitor_session)
-        
-        # تسجيل مشاهدة الصفحة الجديدة
-        PageView.objects.create(
-            session=visitor_session,
-            url=request.build_absolute_uri(),
-            title=self.get_page_title(request) or request.path,
-            time_spent=timedelta(0),  # سيتم تحديثه لاحقاً
-            scroll_depth=0,
-            is_bounce=False
-        )
-        
-        # زيادة عدد صفحات الجلسة
-        visitor_session.page_count += 1
-        visitor_session.save()
-    
-    def update_previous_page_time(self, visitor_session):
-        """تحديث الوقت المنقضي في الصفحة السابقة"""
-        if not visitor_session:
-            return
-        
-        # البحث عن آخر مشاهدة صفحة لم يتم تحديث وقتها
-        last_pageview = PageView.objects.filter(
-            session=visitor_session
-        ).order_by('-timestamp').first()
-        
-        if last_pageview and last_pageview.time_spent.total_seconds() == 0:
-            # حساب الوقت المنقضي
-            time_spent = timezone.now() - last_pageview.timestamp
-            
-            # تحديث وقت الصفحة
-            last_pageview.time_spent = time_spent
-            
-            # تحديد إذا كانت الصفحة ارتداد (مشاهدة صفحة واحدة فقط)
-            if visitor_session.page_count == 1:
-                last_pageview.is_bounce = True
-            
-            last_pageview.save()
-    
-    def update_realtime_visitor(self, visitor_session, request):
-        """تحديث بيانات الزائر الفوري"""
-        if not visitor_session:
-            return
-        
-        realtime_visitor, created = RealTimeVisitor.objects.get_or_create(
-            session=visitor_session,
-            defaults={
-                'current_page': request.build_absolute_uri(),
-                'time_on_page': timedelta(0),
-            }
-        )
-        
-        if not created:
-            realtime_visitor.current_page = request.build_absolute_uri()
-            realtime_visitor.save()
-    
-    def update_session_activity(self, visitor_session):
-        """تحديث آخر نشاط للجلسة"""
-        if visitor_session:
-            visitor_session.save()
+        return self.geo.resolve(ip_address)
     
     def get_page_title(self, request):
         """استخراج عنوان الصفحة"""
@@ -296,8 +235,3 @@ class AdvancedAnalyticsMiddleware:
     def process_exception(self, request, exception):
         """معالجة الاستثناءات"""
         pass
-    
-    def __del__(self):
-        """إغلاق قارئ GeoIP عند الإغلاق"""
-        if self.geoip_reader:
-            self.geoip_reader.close()
\ No newline at end of file
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.9 on 2026-10-17 03:26
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="pageview",
+            name="timestamp",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now, verbose_name="الوقت"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="visitorsession",
+            name="start_time",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now, verbose_name="وقت البدء"
+            ),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.9 on 2026-10-17 03:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0002_alter_pageview_timestamp_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="pageview",
+            name="is_exit",
+            field=models.BooleanField(default=False, verbose_name="صفحة خروج"),
+        ),
+        migrations.AddIndex(
+            model_name="pageview",
+            index=models.Index(
+                fields=["session", "timestamp"], name="analytics_p_session_5e7fef_idx"
+            ),
+        ),
+    ]
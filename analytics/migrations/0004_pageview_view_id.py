@@ -0,0 +1,24 @@
+# Generated by Django 5.2.9 on 2026-10-17 03:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0003_pageview_is_exit_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="pageview",
+            name="view_id",
+            field=models.UUIDField(
+                blank=True,
+                editable=False,
+                null=True,
+                unique=True,
+                verbose_name="معرف المشاهدة",
+            ),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.9 on 2026-10-17 03:36
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0004_pageview_view_id"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="analyticssettings",
+            name="sampling_rate",
+            field=models.PositiveSmallIntegerField(
+                default=100,
+                help_text="نسبة الزوار الذين يتم تسجيلهم، وتُصحح التقارير بالوزن المقابل",
+                validators=[
+                    django.core.validators.MinValueValidator(1),
+                    django.core.validators.MaxValueValidator(100),
+                ],
+                verbose_name="نسبة العينة (%)",
+            ),
+        ),
+        migrations.AddField(
+            model_name="visitorsession",
+            name="sample_weight",
+            field=models.FloatField(default=1.0, verbose_name="وزن العينة"),
+        ),
+    ]
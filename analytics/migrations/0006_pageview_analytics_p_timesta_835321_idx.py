@@ -0,0 +1,19 @@
+# Generated by Django 5.2.9 on 2026-10-17 03:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0005_analyticssettings_sampling_rate_and_more"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="pageview",
+            index=models.Index(
+                fields=["timestamp"], name="analytics_p_timesta_835321_idx"
+            ),
+        ),
+    ]
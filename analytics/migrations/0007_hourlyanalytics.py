@@ -0,0 +1,52 @@
+# Generated by Django 5.2.9 on 2026-10-17 03:48
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0006_pageview_analytics_p_timesta_835321_idx"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="HourlyAnalytics",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField(verbose_name="التاريخ")),
+                ("hour", models.PositiveSmallIntegerField(verbose_name="الساعة")),
+                ("sessions", models.FloatField(default=0.0, verbose_name="جلسات")),
+                (
+                    "page_views",
+                    models.FloatField(default=0.0, verbose_name="مشاهدات الصفحات"),
+                ),
+                (
+                    "total_duration",
+                    models.DurationField(
+                        default=datetime.timedelta(0), verbose_name="إجمالي مدة الجلسات"
+                    ),
+                ),
+                ("bounces", models.FloatField(default=0.0, verbose_name="جلسات مرتدة")),
+            ],
+            options={
+                "verbose_name": "إحصائيات ساعية",
+                "verbose_name_plural": "إحصائيات ساعية",
+                "ordering": ["-date", "hour"],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("date", "hour"), name="analytics_hourly_date_hour_uniq"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.9 on 2026-10-17 03:51
+
+import datetime
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0007_hourlyanalytics"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CountryAnalytics",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField(verbose_name="التاريخ")),
+                ("sessions", models.FloatField(default=0.0, verbose_name="جلسات")),
+                (
+                    "page_views",
+                    models.FloatField(default=0.0, verbose_name="مشاهدات الصفحات"),
+                ),
+                (
+                    "total_duration",
+                    models.DurationField(
+                        default=datetime.timedelta(0), verbose_name="إجمالي مدة الجلسات"
+                    ),
+                ),
+                (
+                    "country",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="daily_stats",
+                        to="analytics.country",
+                        verbose_name="الدولة",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "إحصائيات دولة يومية",
+                "verbose_name_plural": "إحصائيات الدول اليومية",
+                "ordering": ["-date"],
+                "indexes": [
+                    models.Index(fields=["date"], name="analytics_c_date_76469c_idx")
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("country", "date"), name="analytics_country_date_uniq"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.9 on 2026-10-17 03:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0008_countryanalytics"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DailyVisitorSketch",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField(unique=True, verbose_name="التاريخ")),
+                ("registers", models.BinaryField(verbose_name="سجلات HyperLogLog")),
+                (
+                    "sessions",
+                    models.PositiveIntegerField(default=0, verbose_name="جلسات مسجلة"),
+                ),
+                (
+                    "weight",
+                    models.FloatField(default=0.0, verbose_name="مجموع أوزان العينة"),
+                ),
+            ],
+            options={
+                "verbose_name": "ملخص زوار يومي",
+                "verbose_name_plural": "ملخصات الزوار اليومية",
+                "ordering": ["-date"],
+            },
+        ),
+    ]
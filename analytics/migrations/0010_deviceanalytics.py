@@ -0,0 +1,58 @@
+# Generated by Django 5.2.9 on 2026-10-17 04:02
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0009_dailyvisitorsketch"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DeviceAnalytics",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField(verbose_name="التاريخ")),
+                (
+                    "device_type",
+                    models.CharField(max_length=50, verbose_name="نوع الجهاز"),
+                ),
+                ("browser", models.CharField(max_length=50, verbose_name="المتصفح")),
+                ("os", models.CharField(max_length=50, verbose_name="نظام التشغيل")),
+                ("sessions", models.FloatField(default=0.0, verbose_name="جلسات")),
+                (
+                    "page_views",
+                    models.FloatField(default=0.0, verbose_name="مشاهدات الصفحات"),
+                ),
+                (
+                    "total_duration",
+                    models.DurationField(
+                        default=datetime.timedelta(0), verbose_name="إجمالي مدة الجلسات"
+                    ),
+                ),
+                ("bounces", models.FloatField(default=0.0, verbose_name="جلسات مرتدة")),
+            ],
+            options={
+                "verbose_name": "إحصائيات أجهزة يومية",
+                "verbose_name_plural": "إحصائيات الأجهزة اليومية",
+                "ordering": ["-date"],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("date", "device_type", "browser", "os"),
+                        name="analytics_device_date_uniq",
+                    )
+                ],
+            },
+        ),
+    ]
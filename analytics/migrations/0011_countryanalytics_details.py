@@ -0,0 +1,28 @@
+# Generated by Django 5.2.9 on 2026-10-17 04:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0010_deviceanalytics"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="countryanalytics",
+            name="devices",
+            field=models.JSONField(default=dict, verbose_name="الجلسات حسب الجهاز"),
+        ),
+        migrations.AddField(
+            model_name="countryanalytics",
+            name="hours",
+            field=models.JSONField(default=list, verbose_name="الجلسات حسب الساعة"),
+        ),
+        migrations.AddField(
+            model_name="countryanalytics",
+            name="top_pages",
+            field=models.JSONField(default=list, verbose_name="أكثر الصفحات مشاهدة"),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.2.9 on 2026-10-17 04:24
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0011_countryanalytics_details"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PageAnalytics",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField(verbose_name="التاريخ")),
+                ("url", models.URLField(verbose_name="رابط الصفحة")),
+                (
+                    "title",
+                    models.CharField(
+                        blank=True, max_length=500, verbose_name="عنوان الصفحة"
+                    ),
+                ),
+                ("views", models.FloatField(default=0.0, verbose_name="مشاهدات")),
+                (
+                    "total_time",
+                    models.DurationField(
+                        default=datetime.timedelta(0),
+                        verbose_name="إجمالي الوقت المنقضي",
+                    ),
+                ),
+                (
+                    "bounces",
+                    models.FloatField(default=0.0, verbose_name="مشاهدات مرتدة"),
+                ),
+                (
+                    "entrances",
+                    models.FloatField(default=0.0, verbose_name="جلسات بدأت بالصفحة"),
+                ),
+                (
+                    "entrance_duration",
+                    models.DurationField(
+                        default=datetime.timedelta(0),
+                        verbose_name="إجمالي مدة هذه الجلسات",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "إحصائيات صفحة يومية",
+                "verbose_name_plural": "إحصائيات الصفحات اليومية",
+                "ordering": ["-date"],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("date", "url"), name="analytics_page_date_uniq"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.9 on 2026-10-17 04:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("analytics", "0012_pageanalytics"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="pageview",
+            name="view_id",
+            field=models.UUIDField(
+                blank=True, editable=False, null=True, verbose_name="معرف المشاهدة"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="pageview",
+            constraint=models.UniqueConstraint(
+                fields=("view_id", "timestamp"), name="analytics_pageview_view_id_uniq"
+            ),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.contrib.auth.models import User
 from django.utils import timezone
 from datetime import timedelta, datetime
@@ -51,13 +52,15 @@ class VisitorSession(models.Model):
     # بيانات الجلسة
     referrer = models.URLField(blank=True, null=True, verbose_name="المصدر")
     landing_page = models.URLField(verbose_name="صفحة الهبوط")
-    start_time = models.DateTimeField(auto_now_add=True, verbose_name="وقت البدء")
+    start_time = models.DateTimeField(default=timezone.now, verbose_name="وقت البدء")
     end_time = models.DateTimeField(null=True, blank=True, verbose_name="وقت الانتهاء")
     is_active = models.BooleanField(default=True, verbose_name="نشطة")
     
     # إحصائيات الجلسة
     page_count = models.PositiveIntegerField(default=1, verbose_name="عدد الصفحات")
     total_time_spent = models.DurationField(default=timedelta(0), verbose_name="إجمالي الوقت المنقضي")
+    # عدد الجلسات التي تمثلها هذه الجلسة في وضع العينة (1 = بدون عينة)
+    sample_weight = models.FloatField(default=1.0, verbose_name="وزن العينة")
     
     # بيانات إضافية
     metadata = models.JSONField(default=dict, blank=True, verbose_name="بيانات إضافية")
@@ -119,20 +122,146 @@ class SiteAnalytics(models.Model):
     def __str__(self):
         return f"إحصائيات {self.date}"
 
+
+class HourlyAnalytics(models.Model):
+    """تجميع لكل (يوم، ساعة) حسب وقت بدء الجلسة لتحليلات الوقت
+
+    القيم مجاميع أوزان العينة (أعداد كسرية) حتى لا يتراكم خطأ التقريب عند جمع أيام كثيرة
+    """
+    date = models.DateField(verbose_name="التاريخ")
+    hour = models.PositiveSmallIntegerField(verbose_name="الساعة")
+    sessions = models.FloatField(default=0.0, verbose_name="جلسات")
+    page_views = models.FloatField(default=0.0, verbose_name="مشاهدات الصفحات")
+    total_duration = models.DurationField(default=timedelta(0), verbose_name="إجمالي مدة الجلسات")
+    bounces = models.FloatField(default=0.0, verbose_name="جلسات مرتدة")
+
+    class Meta:
+        verbose_name = "إحصائيات ساعية"
+        verbose_name_plural = "إحصائيات ساعية"
+        ordering = ['-date', 'hour']
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'hour'], name='analytics_hourly_date_hour_uniq'),
+        ]
+
+    def __str__(self):
+        return f"إحصائيات {self.date} {self.hour:02d}:00"
+
+class DailyVisitorSketch(models.Model):
+    """سجلات HyperLogLog لزوار يوم واحد (لعد الفريدين عبر أي مجموعة أيام)"""
+    date = models.DateField(unique=True, verbose_name="التاريخ")
+    registers = models.BinaryField(verbose_name="سجلات HyperLogLog")
+    sessions = models.PositiveIntegerField(default=0, verbose_name="جلسات مسجلة")
+    weight = models.FloatField(default=0.0, verbose_name="مجموع أوزان العينة")
+
+    class Meta:
+        verbose_name = "ملخص زوار يومي"
+        verbose_name_plural = "ملخصات الزوار اليومية"
+        ordering = ['-date']
+
+    def __str__(self):
+        return f"زوار {self.date}"
+
+
+class CountryAnalytics(models.Model):
+    """تجميع لكل (دولة، يوم) حسب وقت بدء الجلسة؛ القيم مجاميع أوزان العينة"""
+    country = models.ForeignKey(Country, on_delete=models.CASCADE, related_name='daily_stats', verbose_name="الدولة")
+    date = models.DateField(verbose_name="التاريخ")
+    sessions = models.FloatField(default=0.0, verbose_name="جلسات")
+    page_views = models.FloatField(default=0.0, verbose_name="مشاهدات الصفحات")
+    total_duration = models.DurationField(default=timedelta(0), verbose_name="إجمالي مدة الجلسات")
+    # تفاصيل صفحة الدولة: {نوع الجهاز: جلسات}، جلسات كل ساعة (24 قيمة)، [[url, title, مشاهدات]]
+    devices = models.JSONField(default=dict, verbose_name="الجلسات حسب الجهاز")
+    hours = models.JSONField(default=list, verbose_name="الجلسات حسب الساعة")
+    top_pages = models.JSONField(default=list, verbose_name="أكثر الصفحات مشاهدة")
+
+    class Meta:
+        verbose_name = "إحصائيات دولة يومية"
+        verbose_name_plural = "إحصائيات الدول اليومية"
+        ordering = ['-date']
+        constraints = [
+            models.UniqueConstraint(fields=['country', 'date'], name='analytics_country_date_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['date']),
+        ]
+
+    def __str__(self):
+        return f"{self.country} {self.date}"
+
+
+class DeviceAnalytics(models.Model):
+    """تجميع لكل (يوم، نوع الجهاز، عائلة المتصفح، عائلة النظام) حسب وقت بدء الجلسة؛ القيم مجاميع أوزان العينة"""
+    date = models.DateField(verbose_name="التاريخ")
+    device_type = models.CharField(max_length=50, verbose_name="نوع الجهاز")
+    browser = models.CharField(max_length=50, verbose_name="المتصفح")
+    os = models.CharField(max_length=50, verbose_name="نظام التشغيل")
+    sessions = models.FloatField(default=0.0, verbose_name="جلسات")
+    page_views = models.FloatField(default=0.0, verbose_name="مشاهدات الصفحات")
+    total_duration = models.DurationField(default=timedelta(0), verbose_name="إجمالي مدة الجلسات")
+    bounces = models.FloatField(default=0.0, verbose_name="جلسات مرتدة")
+
+    class Meta:
+        verbose_name = "إحصائيات أجهزة يومية"
+        verbose_name_plural = "إحصائيات الأجهزة اليومية"
+        ordering = ['-date']
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'device_type', 'browser', 'os'], name='analytics_device_date_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.device_type} {self.browser} {self.os}"
+
+
+class PageAnalytics(models.Model):
+    """تجميع لكل (يوم، صفحة) لأكثر الصفحات مشاهدة ودخولاً فقط؛ القيم مجاميع أوزان العينة
+
+    المشاهدات حسب وقت المشاهدة، والدخول (صفحة الهبوط) حسب وقت بدء الجلسة
+    """
+    date = models.DateField(verbose_name="التاريخ")
+    url = models.URLField(verbose_name="رابط الصفحة")
+    title = models.CharField(max_length=500, blank=True, verbose_name="عنوان الصفحة")
+    views = models.FloatField(default=0.0, verbose_name="مشاهدات")
+    total_time = models.DurationField(default=timedelta(0), verbose_name="إجمالي الوقت المنقضي")
+    bounces = models.FloatField(default=0.0, verbose_name="مشاهدات مرتدة")
+    entrances = models.FloatField(default=0.0, verbose_name="جلسات بدأت بالصفحة")
+    entrance_duration = models.DurationField(default=timedelta(0), verbose_name="إجمالي مدة هذه الجلسات")
+
+    class Meta:
+        verbose_name = "إحصائيات صفحة يومية"
+        verbose_name_plural = "إحصائيات الصفحات اليومية"
+        ordering = ['-date']
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'url'], name='analytics_page_date_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.url}"
+
+
 class PageView(models.Model):
     """تتبع مشاهدات الصفحات مع الوقت المنقضي"""
     session = models.ForeignKey(VisitorSession, on_delete=models.CASCADE, related_name='pageviews', verbose_name="الجلسة")
     url = models.URLField(verbose_name="رابط الصفحة")
     title = models.CharField(max_length=500, verbose_name="عنوان الصفحة")
     time_spent = models.DurationField(verbose_name="الوقت المنقضي")
-    timestamp = models.DateTimeField(auto_now_add=True, verbose_name="الوقت")
+    timestamp = models.DateTimeField(default=timezone.now, verbose_name="الوقت")
     scroll_depth = models.PositiveIntegerField(default=0, verbose_name="عمق التمرير (%)")
     is_bounce = models.BooleanField(default=False, verbose_name="ارتداد")
+    is_exit = models.BooleanField(default=False, verbose_name="صفحة خروج")
+    view_id = models.UUIDField(null=True, blank=True, editable=False, verbose_name="معرف المشاهدة")
     
     class Meta:
         verbose_name = "مشاهدة صفحة"
         verbose_name_plural = "مشاهدات الصفحات"
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['session', 'timestamp']),
+            models.Index(fields=['timestamp']),
+        ]
+        constraints = [
+            # يتضمن عمود التقسيم حتى يبقى قيداً بعد تقسيم الجدول (partitioning.py)
+            models.UniqueConstraint(fields=['view_id', 'timestamp'], name='analytics_pageview_view_id_uniq'),
+        ]
     
     def __str__(self):
         return f"{self.title} - {self.time_spent}"
@@ -190,6 +319,12 @@ class AnalyticsSettings(models.Model):
     anonymize_ip = models.BooleanField(default=True, verbose_name="إخفاء عناوين IP")
     store_user_data = models.BooleanField(default=True, verbose_name="تخزين بيانات المستخدم")
     dashboard_refresh_interval = models.PositiveIntegerField(default=30, verbose_name="فترة تحديث الداشبورد (ثانية)")
+    sampling_rate = models.PositiveSmallIntegerField(
+        default=100,
+        validators=[MinValueValidator(1), MaxValueValidator(100)],
+        verbose_name="نسبة العينة (%)",
+        help_text="نسبة الزوار الذين يتم تسجيلهم، وتُصحح التقارير بالوزن المقابل",
+    )
     
     class Meta:
         verbose_name = "إعدادات التحليلات"
@@ -0,0 +1,281 @@
+# analytics/partitioning.py
+"""
+تقسيم جدول PageView شهرياً (RANGE على timestamp) في PostgreSQL - اختياري.
+
+- التحويل مرة واحدة بأمر `partition_analytics --convert` (يقفل الجدول أثناء النسخ)
+- الأقسام القادمة تُنشأ تلقائياً مع كل تشغيل للتجميعات (PARTITION_MONTHS_AHEAD)
+- الاحتفاظ: أرشفة شهر (archive_analytics) تحذف أقسامه كاملة بدلاً من حذف صفوفه
+- الاستعلامات المحددة بالتاريخ (التجميعات والتصدير) تقرأ أقسامها فقط
+
+VisitorSession يبقى جدولاً عادياً: PageView و RealTimeVisitor يشيران إليه
+بمفتاح أجنبي على id، و PostgreSQL لا يسمح بمفتاح أجنبي إلى جدول مقسم
+إلا إذا تضمن المفتاح المرجعي عمود التقسيم.
+
+مع SQLite (LOCAL=True) أو جدول غير محول، كل الدوال هنا لا تفعل شيئاً.
+"""
+import logging
+from datetime import datetime, timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .utils import analytics_setting
+
+logger = logging.getLogger(__name__)
+
+# الجدول المقسم وعمود التقسيم
+PARTITIONED_TABLES = {
+    'analytics_pageview': 'timestamp',
+}
+
+
+def month_start(value):
+    return value.replace(day=1)
+
+
+def add_months(month, count):
+    for _ in range(count):
+        month = (month.replace(day=1) + timedelta(days=32)).replace(day=1)
+    return month
+
+
+def month_range(month):
+    """حدود الشهر بالتوقيت المحلي (مثل الأرشيف والتجميعات)"""
+    start = timezone.make_aware(datetime.combine(month, datetime.min.time()))
+    end = timezone.make_aware(datetime.combine(add_months(month, 1), datetime.min.time()))
+    return start, end
+
+
+def partition_name(table, month):
+    return f'{table}_{month:%Y_%m}'
+
+
+def is_postgresql():
+    return connection.vendor == 'postgresql'
+
+
+def partitioning_enabled():
+    return any(is_partitioned(table) for table in PARTITIONED_TABLES)
+
+
+def is_partitioned(table):
+    if not is_postgresql():
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid '
+            'WHERE c.relname = %s AND c.relnamespace = current_schema()::regnamespace',
+            [table],
+        )
+        return cursor.fetchone() is not None
+
+
+def partitions(table):
+    """[(اسم القسم، بداية الشهر)] للأقسام الشهرية الموجودة (بدون القسم الافتراضي)"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT child.relname FROM pg_inherits i '
+            'JOIN pg_class parent ON parent.oid = i.inhparent '
+            'JOIN pg_class child ON child.oid = i.inhrelid '
+            'WHERE parent.relname = %s AND parent.relnamespace = current_schema()::regnamespace',
+            [table],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+
+    result = []
+    for name in names:
+        suffix = name[len(table) + 1:]
+        try:
+            result.append((name, datetime.strptime(suffix, '%Y_%m').date()))
+        except ValueError:
+            continue
+    return sorted(result, key=lambda item: item[1])
+
+
+def default_partition_name(table):
+    return f'{table}_default'
+
+
+def table_exists(name):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT to_regclass(%s) IS NOT NULL', [connection.ops.quote_name(name)])
+        return cursor.fetchone()[0]
+
+
+def create_partition(table, month):
+    """إنشاء قسم الشهر إذا لم يكن موجوداً؛ يعيد True إذا أُنشئ
+
+    صفوف الشهر في القسم الافتراضي تُنقل إلى القسم الجديد في نفس المعاملة،
+    وإلا يرفض PostgreSQL إنشاءه (صفوف القسم الافتراضي تخالف حدوده الجديدة)
+    """
+    column = PARTITIONED_TABLES[table]
+    name = partition_name(table, month)
+    default = default_partition_name(table)
+    start, end = month_range(month)
+    qn = connection.ops.quote_name
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        if table_exists(name):
+            return False
+        if not table_exists(default):
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS {qn(name)} PARTITION OF {qn(table)} FOR VALUES FROM (%s) TO (%s)',
+                [start, end],
+            )
+        else:
+            # لا إدخال في القسم الافتراضي بين النقل وربط القسم الجديد
+            cursor.execute(f'LOCK TABLE {qn(default)} IN ACCESS EXCLUSIVE MODE')
+            # عامل آخر أنشأه أثناء انتظار القفل
+            if table_exists(name):
+                return False
+            cursor.execute(f'CREATE TABLE {qn(name)} (LIKE {qn(table)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+            cursor.execute(
+                f'WITH moved AS (DELETE FROM {qn(default)} WHERE {qn(column)} >= %s AND {qn(column)} < %s RETURNING *) '
+                f'INSERT INTO {qn(name)} SELECT * FROM moved',
+                [start, end],
+            )
+            moved = cursor.rowcount
+            # الفهارس والمفتاح الأساسي تُنشأ على القسم عند ربطه
+            cursor.execute(
+                f'ALTER TABLE {qn(table)} ATTACH PARTITION {qn(name)} FOR VALUES FROM (%s) TO (%s)',
+                [start, end],
+            )
+            if moved:
+                logger.info('Moved %d rows from %s to %s', moved, default, name)
+    logger.debug('Created partition %s for %s (%s)', name, table, column)
+    return True
+
+
+def ensure_partitions(now=None, months_ahead=None):
+    """إنشاء أقسام الشهر الحالي والأشهر القادمة لكل جدول مقسم؛ يعيد عدد الأقسام المضمونة"""
+    months_ahead = analytics_setting('PARTITION_MONTHS_AHEAD', 3) if months_ahead is None else months_ahead
+    current = month_start(timezone.localdate(now or timezone.now()))
+    ensured = 0
+    for table in PARTITIONED_TABLES:
+        if not is_partitioned(table):
+            continue
+        for offset in range(months_ahead + 1):
+            create_partition(table, add_months(current, offset))
+            ensured += 1
+    return ensured
+
+
+def ensure_month_partition(month):
+    """قسم لشهر محدد قبل إدخال صفوفه (مثل الاستعادة من الأرشيف)"""
+    for table in PARTITIONED_TABLES:
+        if is_partitioned(table):
+            create_partition(table, month_start(month))
+
+
+def drop_partitions_before(month):
+    """حذف الأقسام التي تنتهي قبل بداية month بالكامل؛ يعيد أسماءها
+
+    المستدعي يضمن أن كل الجلسات التي بدأت قبل month مؤرشفة: مشاهدات قسم
+    الشهر M تخص جلسات بدأت في M أو قبله.
+    """
+    dropped = []
+    qn = connection.ops.quote_name
+    for table in PARTITIONED_TABLES:
+        if not is_partitioned(table):
+            continue
+        for name, partition_month in partitions(table):
+            if partition_month >= month:
+                break
+            with connection.cursor() as cursor:
+                cursor.execute(f'DROP TABLE {qn(name)}')
+            dropped.append(name)
+    if dropped:
+        logger.info('Dropped analytics partitions: %s', dropped)
+    return dropped
+
+
+# ===== التحويل =====
+
+def convert_to_partitioned(table, keep_old=False, months_ahead=None):
+    """تحويل جدول عادي إلى جدول مقسم شهرياً مع نسخ بياناته (معاملة واحدة)
+
+    - المفتاح الأساسي يصبح (id, عمود التقسيم)؛ قيود UNIQUE التي تتضمنه تبقى
+      كما هي (مثل (view_id, timestamp)) والتي لا تتضمنه تصبح فهارس عادية
+    - القسم الافتراضي يستقبل ما خرج عن الأقسام الشهرية، و create_partition
+      تنقل صفوف الشهر منه قبل إنشاء قسمه
+    - الفهارس والمفاتيح الأجنبية تُنشأ بنفس أسمائها حتى تبقى الترحيلات متوافقة
+    - id يأخذ قيمه من تسلسل جديد يبدأ بعد أكبر قيمة
+    """
+    if not is_postgresql():
+        raise RuntimeError('Partitioning is only available on PostgreSQL')
+    if is_partitioned(table):
+        return False
+
+    column = PARTITIONED_TABLES[table]
+    old = f'{table}_unpartitioned'
+    qn = connection.ops.quote_name
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'LOCK TABLE {qn(table)} IN ACCESS EXCLUSIVE MODE')
+
+        cursor.execute(
+            "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s AND schemaname = current_schema()",
+            [table],
+        )
+        indexes = cursor.fetchall()
+        cursor.execute(
+            "SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'f')",
+            [table],
+        )
+        constraints = cursor.fetchall()
+        constraint_names = {name for name, _, _ in constraints}
+
+        # تحرير الأسماء للجدول الجديد
+        cursor.execute(f'ALTER TABLE {qn(table)} RENAME TO {qn(old)}')
+        for name, _, _ in constraints:
+            cursor.execute(f'ALTER TABLE {qn(old)} RENAME CONSTRAINT {qn(name)} TO {qn(name + "_old")}')
+        for name, _ in indexes:
+            if name not in constraint_names:
+                cursor.execute(f'ALTER INDEX {qn(name)} RENAME TO {qn(name + "_old")}')
+
+        cursor.execute(
+            f'CREATE TABLE {qn(table)} (LIKE {qn(old)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+            f'PARTITION BY RANGE ({qn(column)})'
+        )
+        sequence = f'{table}_id_partitioned_seq'
+        cursor.execute(f'CREATE SEQUENCE {qn(sequence)} OWNED BY {qn(table)}.id')
+        cursor.execute(f"ALTER TABLE {qn(table)} ALTER COLUMN id SET DEFAULT nextval('{sequence}')")
+        cursor.execute(f'ALTER TABLE {qn(table)} ADD PRIMARY KEY (id, {qn(column)})')
+
+        for name, contype, definition in constraints:
+            if contype == 'f':
+                cursor.execute(f'ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(name)} {definition}')
+            elif contype == 'u':
+                columns = definition[definition.index('(') + 1:definition.rindex(')')]
+                if column in [part.strip().strip('"') for part in columns.split(',')]:
+                    cursor.execute(f'ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(name)} {definition}')
+                else:
+                    # UNIQUE بدون عمود التقسيم غير مسموح في جدول مقسم
+                    cursor.execute(f'CREATE INDEX {qn(name)} ON {qn(table)} ({columns})')
+        for name, definition in indexes:
+            if name in constraint_names:
+                continue
+            # تعريف الفهرس الأصلي على الجدول الجديد (يُنشأ على كل الأقسام)
+            columns = definition[definition.index(' USING '):]
+            cursor.execute(f'CREATE INDEX {qn(name)} ON {qn(table)}{columns}')
+
+        # أقسام لكل شهر فيه بيانات حتى الأشهر القادمة، وقسم افتراضي لما خرج عنها
+        cursor.execute(f'SELECT MIN({qn(column)}) FROM {qn(old)}')
+        first = cursor.fetchone()[0]
+        current = month_start(timezone.localdate())
+        month = month_start(timezone.localdate(first)) if first else current
+        last = add_months(current, analytics_setting('PARTITION_MONTHS_AHEAD', 3) if months_ahead is None else months_ahead)
+        while month <= last:
+            create_partition(table, month)
+            month = add_months(month, 1)
+        cursor.execute(f'CREATE TABLE {qn(default_partition_name(table))} PARTITION OF {qn(table)} DEFAULT')
+
+        cursor.execute(f'INSERT INTO {qn(table)} SELECT * FROM {qn(old)}')
+        cursor.execute(f"SELECT setval('{sequence}', COALESCE((SELECT MAX(id) FROM {qn(table)}), 0) + 1, false)")
+
+        if not keep_old:
+            cursor.execute(f'DROP TABLE {qn(old)}')
+
+    logger.info('Converted %s to monthly partitions on %s', table, column)
+    return True
@@ -0,0 +1,239 @@
+# analytics/presence.py
+"""
+مخزن الزوار المتصلين حالياً (live presence).
+
+كل زائر عضو في مجموعة مرتبة (sorted set) درجتها وقت آخر نشاط، مع hash
+لكل زائر فيه الصفحة الحالية والجهاز والدولة. الأعضاء المنتهية صلاحيتهم
+يُحذفون بـ ZREMRANGEBYSCORE بتكلفة O(log n) بدلاً من تحديث صف
+RealTimeVisitor مع كل طلب.
+
+الخلفيات المتاحة (ANALYTICS_SETTINGS['PRESENCE_BACKEND']):
+- redis: مشتركة بين كل العمال (الإنتاج؛ docker-compose.yml يشغل Redis ويختارها)
+- memory: بايثون خالص داخل العملية (الاختبارات والتطوير)
+- database: جدول RealTimeVisitor كما كان (بدون Redis)
+"""
+import heapq
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from .models import RealTimeVisitor, VisitorSession
+from .utils import analytics_setting
+
+# حقول ملف الزائر المحفوظة مع الصفحة الحالية
+PROFILE_FIELDS = ('current_page', 'device', 'browser', 'country', 'flag', 'city', 'started')
+
+
+def to_score(value):
+    """تحويل datetime إلى ثوانٍ (درجة المجموعة المرتبة)"""
+    return value.timestamp() if isinstance(value, datetime) else float(value)
+
+
+def from_score(score):
+    return datetime.fromtimestamp(float(score), tz=dt_timezone.utc)
+
+
+class MemoryPresenceStore:
+    """خلفية بايثون خالصة: heap بحذف كسول يعطي نفس تكلفة التقليم O(log n)"""
+
+    def __init__(self, window=300):
+        self.window = window
+        self._scores = {}
+        self._profiles = {}
+        self._heap = []
+        self._lock = threading.Lock()
+
+    def touch_many(self, entries, now=None):
+        with self._lock:
+            for entry in entries:
+                visitor_id = entry['visitor_id']
+                score = to_score(entry['last_activity'])
+                self._scores[visitor_id] = score
+                profile = self._profiles.setdefault(visitor_id, {})
+                profile.update({
+                    field: to_score(entry[field]) if field == 'started' else entry[field]
+                    for field in PROFILE_FIELDS if entry.get(field) is not None
+                })
+                heapq.heappush(self._heap, (score, visitor_id))
+            self._trim(now)
+
+    def _trim(self, now=None):
+        cutoff = (now or time.time()) - self.window
+        while self._heap and self._heap[0][0] < cutoff:
+            score, visitor_id = heapq.heappop(self._heap)
+            # الإدخالات القديمة لزائر تم تحديثه لاحقاً يتم تجاهلها فقط
+            if self._scores.get(visitor_id) == score:
+                del self._scores[visitor_id]
+                self._profiles.pop(visitor_id, None)
+
+    def active(self, now=None):
+        with self._lock:
+            self._trim(now)
+            visitors = [
+                dict(self._profiles.get(visitor_id, {}), visitor_id=visitor_id, last_activity=score)
+                for visitor_id, score in self._scores.items()
+            ]
+        return sorted(visitors, key=lambda v: v['last_activity'], reverse=True)
+
+    def count(self, now=None):
+        with self._lock:
+            self._trim(now)
+            return len(self._scores)
+
+    def clear(self):
+        with self._lock:
+            self._scores.clear()
+            self._profiles.clear()
+            self._heap.clear()
+
+
+class RedisPresenceStore:
+    """خلفية Redis: ZSET للنشاط و HASH لملف كل زائر"""
+
+    def __init__(self, url, window=300, prefix='analytics:presence'):
+        import redis
+
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.window = window
+        self.key = f'{prefix}:active'
+        self.profile_prefix = f'{prefix}:visitor'
+
+    def touch_many(self, entries, now=None):
+        if not entries:
+            return
+        pipe = self.client.pipeline(transaction=False)
+        for entry in entries:
+            visitor_id = entry['visitor_id']
+            pipe.zadd(self.key, {visitor_id: to_score(entry['last_activity'])})
+            profile = {
+                field: str(to_score(entry[field]) if field == 'started' else entry[field])
+                for field in PROFILE_FIELDS if entry.get(field) is not None
+            }
+            profile_key = f'{self.profile_prefix}:{visitor_id}'
+            if profile:
+                pipe.hset(profile_key, mapping=profile)
+            pipe.expire(profile_key, self.window * 2)
+        pipe.zremrangebyscore(self.key, '-inf', f'({(now or time.time()) - self.window}')
+        pipe.execute()
+
+    def active(self, now=None):
+        cutoff = (now or time.time()) - self.window
+        members = self.client.zrevrangebyscore(self.key, '+inf', cutoff, withscores=True)
+        pipe = self.client.pipeline(transaction=False)
+        for visitor_id, _ in members:
+            pipe.hgetall(f'{self.profile_prefix}:{visitor_id}')
+        profiles = pipe.execute() if members else []
+
+        visitors = []
+        for (visitor_id, score), profile in zip(members, profiles):
+            if 'started' in profile:
+                profile['started'] = float(profile['started'])
+            visitors.append(dict(profile, visitor_id=visitor_id, last_activity=score))
+        return visitors
+
+    def count(self, now=None):
+        cutoff = (now or time.time()) - self.window
+        return self.client.zcount(self.key, cutoff, '+inf')
+
+    def clear(self):
+        self.client.delete(self.key)
+
+
+class DatabasePresenceStore:
+    """الخلفية الأصلية: upsert على RealTimeVisitor (عند عدم توفر Redis)"""
+
+    def __init__(self, window=300):
+        self.window = window
+
+    def touch_many(self, entries, now=None):
+        visitors = [
+            RealTimeVisitor(
+                session_id=entry['session_pk'],
+                current_page=entry['current_page'],
+                time_on_page=timedelta(0),
+            )
+            for entry in entries
+        ]
+        if visitors:
+            RealTimeVisitor.objects.bulk_create(
+                visitors,
+                update_conflicts=True,
+                unique_fields=['session'],
+                update_fields=['current_page', 'last_activity'],
+            )
+
+    def _recent(self, now=None):
+        cutoff = from_score((now or time.time()) - self.window)
+        return RealTimeVisitor.objects.filter(last_activity__gte=cutoff)
+
+    def active(self, now=None):
+        visitors = []
+        for rv in self._recent(now).select_related('session', 'session__country'):
+            session = rv.session
+            visitors.append({
+                'visitor_id': str(session.session_id),
+                'last_activity': rv.last_activity.timestamp(),
+                'current_page': rv.current_page,
+                'device': session.device_type,
+                'browser': session.browser,
+                'country': session.country.name if session.country else None,
+                'flag': session.country.flag_emoji if session.country else None,
+                'city': session.city,
+                'started': session.start_time.timestamp(),
+            })
+        return visitors
+
+    def count(self, now=None):
+        return self._recent(now).count()
+
+    def clear(self):
+        pass
+
+
+def fill_missing_profiles(visitors):
+    """استكمال ملفات الزوار التي انتهت صلاحيتها من VisitorSession باستعلام واحد"""
+    missing = [v['visitor_id'] for v in visitors if 'device' not in v]
+    if not missing:
+        return visitors
+
+    sessions = {
+        str(s.session_id): s
+        for s in VisitorSession.objects.filter(session_id__in=missing).select_related('country')
+    }
+    for visitor in visitors:
+        session = sessions.get(visitor['visitor_id'])
+        if 'device' in visitor or session is None:
+            continue
+        visitor.update({
+            'device': session.device_type,
+            'browser': session.browser,
+            'country': session.country.name if session.country else None,
+            'flag': session.country.flag_emoji if session.country else None,
+            'city': session.city,
+            'started': session.start_time.timestamp(),
+        })
+    return visitors
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def build_presence_store():
+    backend = analytics_setting('PRESENCE_BACKEND', 'database')
+    window = analytics_setting('PRESENCE_WINDOW', 300)
+    if backend == 'redis':
+        return RedisPresenceStore(analytics_setting('PRESENCE_REDIS_URL'), window=window)
+    if backend == 'memory':
+        return MemoryPresenceStore(window=window)
+    return DatabasePresenceStore(window=window)
+
+
+def get_presence_store():
+    """مخزن الحضور المشترك لهذه العملية"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = build_presence_store()
+    return _store
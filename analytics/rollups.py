@@ -0,0 +1,473 @@
+# analytics/rollups.py
+"""
+تجميعات يومية تدريجية (rollups) تقرأ منها لوحات التحليلات.
+
+كل تشغيل يعيد حساب الأيام التي تغيرت منذ آخر علامة مائية (watermark)
+فقط، ويكتب صف SiteAnalytics لكل يوم وصفوف HourlyAnalytics لكل ساعة. الحساب من البيانات
+الأصلية لليوم كاملاً، لذلك تكرار التشغيل آمن (idempotent).
+
+يبدأ النطاق قبل العلامة المائية بمهلة الخمول، لأن sessionize يكمل مدة
+الجلسة والارتداد بعد انتهائها.
+"""
+import logging
+import os
+import threading
+from datetime import datetime, time as dt_time, timedelta
+from itertools import groupby, islice
+from operator import itemgetter
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from django.db.models import (
+    Case, Count, ExpressionWrapper, F, FloatField, Max, Min, Q, Sum, Value, When,
+)
+from django.db.models.functions import ExtractHour
+from django.utils import timezone
+
+from .counters import rebuild_country_counters
+from .devices import browser_family, os_family
+from .hyperloglog import HyperLogLog
+from .models import (
+    CountryAnalytics, DailyVisitorSketch, DeviceAnalytics, HourlyAnalytics, PageAnalytics, PageView, RealTimeStat,
+    SiteAnalytics, VisitorSession,
+)
+from .partitioning import ensure_partitions
+from .sampling import weighted_avg_duration, weighted_count, weighted_ratio, weighted_sum_duration
+from .sessionize import sessionize
+from .utils import analytics_setting
+
+logger = logging.getLogger(__name__)
+
+WATERMARK_PREFIX = 'rollup_watermark'
+ROLLUP_LOCK_KEY = 'analytics:rollup:lock'
+
+# مشاهدات صفحات الأقسام (المسار بعد النطاق)
+CATEGORY_PATTERNS = {
+    'courses_views': r'^https?://[^/]+/courses/',
+    'articles_views': r'^https?://[^/]+/articles/',
+    'grants_views': r'^https?://[^/]+/grants/',
+    'books_views': r'^https?://[^/]+/books/',
+}
+
+SITE_ANALYTICS_FIELDS = [
+    'page_views', 'unique_visitors', 'sessions', 'bounce_rate', 'avg_session_duration',
+    'active_users', 'new_users', *CATEGORY_PATTERNS,
+]
+
+
+# ===== العلامة المائية =====
+
+def get_watermark(name):
+    stat = RealTimeStat.objects.filter(name=f'{WATERMARK_PREFIX}:{name}').first()
+    if stat is None or not stat.value.get('at'):
+        return None
+    return datetime.fromisoformat(stat.value['at'])
+
+
+def set_watermark(name, value):
+    RealTimeStat.objects.update_or_create(
+        name=f'{WATERMARK_PREFIX}:{name}',
+        defaults={'value': {'at': value.isoformat()}},
+    )
+
+
+def day_bounds(day):
+    """بداية ونهاية اليوم بالتوقيت المحلي"""
+    start = timezone.make_aware(datetime.combine(day, dt_time.min))
+    return start, start + timedelta(days=1)
+
+
+def days_between(first, last):
+    day = first
+    while day <= last:
+        yield day
+        day += timedelta(days=1)
+
+
+def first_tracked_day():
+    first = VisitorSession.objects.aggregate(first=Min('start_time'))['first']
+    return timezone.localdate(first) if first else None
+
+
+def pending_days(name, now, full=False):
+    """الأيام التي يجب إعادة حسابها منذ آخر تشغيل"""
+    watermark = None if full else get_watermark(name)
+    if watermark is None:
+        first = first_tracked_day()
+    else:
+        lag = timedelta(minutes=analytics_setting('SESSION_IDLE_MINUTES', 30) * 2)
+        first = timezone.localdate(watermark - lag)
+    if first is None:
+        return []
+    return list(days_between(first, timezone.localdate(now)))
+
+
+# ===== SiteAnalytics =====
+
+def compute_site_analytics(day):
+    """قيم صف SiteAnalytics ليوم واحد من البيانات الأصلية (موزونة بأوزان العينة)"""
+    start, end = day_bounds(day)
+
+    sessions = VisitorSession.objects.filter(start_time__gte=start, start_time__lt=end).aggregate(
+        sessions=weighted_count(),
+        avg_duration=weighted_avg_duration('total_time_spent'),
+        bounce=weighted_ratio(Q(page_count=1)),
+    )
+
+    day_views = PageView.objects.filter(timestamp__gte=start, timestamp__lt=end)
+    views = day_views.aggregate(
+        page_views=weighted_count('session__'),
+        active_users=Count('session__user', distinct=True),
+        **{
+            field: Sum(
+                Case(When(url__regex=pattern, then=F('session__sample_weight')),
+                     default=Value(0.0), output_field=FloatField()),
+                default=0.0,
+            )
+            for field, pattern in CATEGORY_PATTERNS.items()
+        }
+    )
+
+    # الزوار الفريدون = الجلسات التي لها مشاهدة في هذا اليوم
+    unique_visitors = VisitorSession.objects.filter(
+        pk__in=day_views.values('session_id')
+    ).aggregate(n=weighted_count())['n']
+
+    return {
+        'page_views': views['page_views'],
+        'unique_visitors': unique_visitors,
+        'sessions': sessions['sessions'],
+        'bounce_rate': (sessions['bounce'] or 0) * 100,
+        'avg_session_duration': sessions['avg_duration'] or timedelta(0),
+        'active_users': views['active_users'],
+        'new_users': User.objects.filter(date_joined__gte=start, date_joined__lt=end).count(),
+        **{field: round(views[field]) for field in CATEGORY_PATTERNS},
+    }
+
+
+def rollup_site_analytics(days):
+    """upsert لصفوف SiteAnalytics للأيام المحددة"""
+    rows = [SiteAnalytics(date=day, **compute_site_analytics(day)) for day in days]
+    if rows:
+        SiteAnalytics.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=['date'],
+            update_fields=SITE_ANALYTICS_FIELDS + ['updated_at'],
+        )
+    return len(rows)
+
+
+# ===== HourlyAnalytics =====
+
+def compute_hourly_analytics(day):
+    """صفوف HourlyAnalytics ليوم واحد (الساعات التي بها جلسات فقط)"""
+    start, end = day_bounds(day)
+    hours = VisitorSession.objects.filter(start_time__gte=start, start_time__lt=end).annotate(
+        hour=ExtractHour('start_time'),
+    ).values('hour').annotate(
+        weight=Sum('sample_weight'),
+        weighted_pages=Sum(ExpressionWrapper(F('page_count') * F('sample_weight'), output_field=FloatField())),
+        duration=weighted_sum_duration('total_time_spent'),
+        bounce_weight=Sum(Case(When(page_count=1, then=F('sample_weight')),
+                               default=Value(0.0), output_field=FloatField())),
+    ).order_by('hour')
+
+    return [
+        HourlyAnalytics(
+            date=day,
+            hour=row['hour'],
+            sessions=row['weight'],
+            page_views=row['weighted_pages'],
+            total_duration=row['duration'] or timedelta(0),
+            bounces=row['bounce_weight'],
+        )
+        for row in hours
+    ]
+
+
+def rollup_hourly_analytics(days):
+    """استبدال صفوف الأيام المحددة بالقيم المعاد حسابها"""
+    if not days:
+        return 0
+    rows = [row for day in days for row in compute_hourly_analytics(day)]
+    with transaction.atomic():
+        # الأيام متتالية، فالحذف بنطاق بدلاً من قائمة طويلة
+        HourlyAnalytics.objects.filter(date__gte=days[0], date__lte=days[-1]).delete()
+        HourlyAnalytics.objects.bulk_create(rows, batch_size=1000)
+    return len(days)
+
+
+# ===== CountryAnalytics =====
+
+def compute_country_analytics(day):
+    """صفوف CountryAnalytics ليوم واحد (الدول التي لها جلسات أو مشاهدات فقط)
+
+    مع تفاصيل صفحة الدولة: الأجهزة وساعات بدء الجلسات وأكثر الصفحات مشاهدة
+    """
+    start, end = day_bounds(day)
+    sessions = VisitorSession.objects.filter(start_time__gte=start, start_time__lt=end, country__isnull=False)
+
+    rows = {}
+
+    def row_for(country_id):
+        row = rows.get(country_id)
+        if row is None:
+            row = rows[country_id] = CountryAnalytics(
+                country_id=country_id, date=day, sessions=0.0, page_views=0.0, total_duration=timedelta(0),
+                devices={}, hours=[0.0] * 24, top_pages=[],
+            )
+        return row
+
+    for totals in sessions.values('country').annotate(
+        weight=Sum('sample_weight'),
+        weighted_pages=Sum(ExpressionWrapper(F('page_count') * F('sample_weight'), output_field=FloatField())),
+        duration=weighted_sum_duration('total_time_spent'),
+    ).order_by():
+        row = row_for(totals['country'])
+        row.sessions = totals['weight']
+        row.page_views = totals['weighted_pages']
+        row.total_duration = totals['duration'] or timedelta(0)
+
+    for group in sessions.values('country', 'device_type').annotate(weight=Sum('sample_weight')).order_by():
+        row_for(group['country']).devices[group['device_type']] = group['weight']
+
+    for group in sessions.annotate(hour=ExtractHour('start_time')).values('country', 'hour').annotate(
+        weight=Sum('sample_weight'),
+    ).order_by():
+        row_for(group['country']).hours[group['hour']] = group['weight']
+
+    # أكثر الصفحات لكل دولة في هذا اليوم (حسب وقت المشاهدة)
+    pages = PageView.objects.filter(
+        timestamp__gte=start, timestamp__lt=end, session__country__isnull=False,
+    ).values('session__country', 'url', 'title').annotate(
+        views=Sum('session__sample_weight'),
+    ).order_by('session__country', '-views', 'url')
+    limit = analytics_setting('COUNTRY_TOP_PAGES', 20)
+    for country_id, group in groupby(pages.iterator(chunk_size=2000), key=itemgetter('session__country')):
+        row_for(country_id).top_pages = [[page['url'], page['title'], page['views']] for page in islice(group, limit)]
+
+    return list(rows.values())
+
+
+def rollup_country_analytics(days):
+    """استبدال صفوف الأيام المحددة بالقيم المعاد حسابها"""
+    if not days:
+        return 0
+    rows = [row for day in days for row in compute_country_analytics(day)]
+    with transaction.atomic():
+        CountryAnalytics.objects.filter(date__gte=days[0], date__lte=days[-1]).delete()
+        CountryAnalytics.objects.bulk_create(rows, batch_size=1000)
+    return len(days)
+
+
+# ===== DeviceAnalytics =====
+
+def compute_device_analytics(day):
+    """صفوف DeviceAnalytics ليوم واحد
+
+    التجميع في قاعدة البيانات على القيم الخام (device_type, browser, os) ثم
+    دمجها بعد توحيد عائلات المتصفح والنظام (Chrome Mobile -> Chrome ...)
+    """
+    start, end = day_bounds(day)
+    groups = VisitorSession.objects.filter(start_time__gte=start, start_time__lt=end).values(
+        'device_type', 'browser', 'os',
+    ).annotate(
+        weight=Sum('sample_weight'),
+        weighted_pages=Sum(ExpressionWrapper(F('page_count') * F('sample_weight'), output_field=FloatField())),
+        duration=weighted_sum_duration('total_time_spent'),
+        bounce_weight=Sum(Case(When(page_count=1, then=F('sample_weight')),
+                               default=Value(0.0), output_field=FloatField())),
+    ).order_by()
+
+    buckets = {}
+    for row in groups:
+        key = (row['device_type'], browser_family(row['browser']), os_family(row['os']))
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = DeviceAnalytics(
+                date=day, device_type=key[0], browser=key[1], os=key[2],
+                sessions=0.0, page_views=0.0, total_duration=timedelta(0), bounces=0.0,
+            )
+        bucket.sessions += row['weight']
+        bucket.page_views += row['weighted_pages']
+        bucket.total_duration += row['duration'] or timedelta(0)
+        bucket.bounces += row['bounce_weight']
+    return list(buckets.values())
+
+
+def rollup_device_analytics(days):
+    """استبدال صفوف الأيام المحددة بالقيم المعاد حسابها"""
+    if not days:
+        return 0
+    rows = [row for day in days for row in compute_device_analytics(day)]
+    with transaction.atomic():
+        DeviceAnalytics.objects.filter(date__gte=days[0], date__lte=days[-1]).delete()
+        DeviceAnalytics.objects.bulk_create(rows, batch_size=1000)
+    return len(days)
+
+
+# ===== PageAnalytics =====
+
+def compute_page_analytics(day):
+    """صفوف PageAnalytics ليوم واحد: أكثر TOP_PAGES_CAPACITY صفحة مشاهدةً وأكثرها دخولاً"""
+    start, end = day_bounds(day)
+    limit = analytics_setting('TOP_PAGES_CAPACITY', 200)
+
+    views = PageView.objects.filter(timestamp__gte=start, timestamp__lt=end).values('url').annotate(
+        weight=Sum('session__sample_weight'),
+        duration=weighted_sum_duration('time_spent', 'session__'),
+        bounce_weight=Sum(Case(When(is_bounce=True, then=F('session__sample_weight')),
+                               default=Value(0.0), output_field=FloatField())),
+        page_title=Max('title'),
+    ).order_by('-weight', 'url')[:limit]
+    entrances = VisitorSession.objects.filter(start_time__gte=start, start_time__lt=end).values(
+        'landing_page',
+    ).annotate(
+        weight=Sum('sample_weight'),
+        duration=weighted_sum_duration('total_time_spent'),
+    ).order_by('-weight', 'landing_page')[:limit]
+
+    rows = {}
+    for row in views:
+        rows[row['url']] = PageAnalytics(
+            date=day, url=row['url'], title=row['page_title'] or '', views=row['weight'],
+            total_time=row['duration'] or timedelta(0), bounces=row['bounce_weight'],
+        )
+    for row in entrances:
+        page = rows.get(row['landing_page'])
+        if page is None:
+            page = rows[row['landing_page']] = PageAnalytics(date=day, url=row['landing_page'])
+        page.entrances = row['weight']
+        page.entrance_duration = row['duration'] or timedelta(0)
+    return list(rows.values())
+
+
+def rollup_page_analytics(days):
+    """استبدال صفوف الأيام المحددة بالقيم المعاد حسابها"""
+    if not days:
+        return 0
+    rows = [row for day in days for row in compute_page_analytics(day)]
+    with transaction.atomic():
+        PageAnalytics.objects.filter(date__gte=days[0], date__lte=days[-1]).delete()
+        PageAnalytics.objects.bulk_create(rows, batch_size=1000)
+    return len(days)
+
+
+# ===== DailyVisitorSketch =====
+
+def compute_visitor_sketch(day):
+    """HyperLogLog لزوار اليوم (من لهم مشاهدة فيه) مع عدد الجلسات ومجموع أوزانها"""
+    start, end = day_bounds(day)
+    visitors = VisitorSession.objects.filter(
+        pk__in=PageView.objects.filter(timestamp__gte=start, timestamp__lt=end).values('session_id')
+    ).values_list('session_id', 'sample_weight').iterator(chunk_size=2000)
+
+    sketch = HyperLogLog()
+    sessions = 0
+    weight = 0.0
+    for visitor_id, sample_weight in visitors:
+        sketch.add(visitor_id)
+        sessions += 1
+        weight += sample_weight
+    if not sessions:
+        return None
+    return DailyVisitorSketch(date=day, registers=sketch.to_bytes(), sessions=sessions, weight=weight)
+
+
+def rollup_visitor_sketches(days):
+    """upsert لملخصات الزوار اليومية للأيام المحددة"""
+    rows = [row for row in (compute_visitor_sketch(day) for day in days) if row is not None]
+    if rows:
+        DailyVisitorSketch.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=['date'],
+            update_fields=['registers', 'sessions', 'weight'],
+        )
+    return len(days)
+
+
+# ===== التشغيل =====
+
+# اسم التجميع (للعلامة المائية) ودالة إعادة حساب أيامه
+ROLLUPS = {
+    'site_analytics': rollup_site_analytics,
+    'hourly_analytics': rollup_hourly_analytics,
+    'country_analytics': rollup_country_analytics,
+    'device_analytics': rollup_device_analytics,
+    'page_analytics': rollup_page_analytics,
+    'visitor_sketches': rollup_visitor_sketches,
+}
+
+
+def run_rollups(now=None, full=False):
+    """sessionize ثم إعادة حساب الأيام المتأثرة؛ يعيد {اسم التجميع: عدد الأيام}"""
+    now = now or timezone.now()
+    # أقسام PageView للأشهر القادمة (PostgreSQL المقسم فقط)
+    ensure_partitions(now=now)
+    sessionize(now=now)
+
+    result = {}
+    for name, rollup in ROLLUPS.items():
+        result[name] = rollup(pending_days(name, now, full=full))
+        set_watermark(name, now)
+
+    if full:
+        # إعادة الحساب الكامل تصحح أيضاً أي انحراف في عدادات الدول
+        result['country_counters'] = rebuild_country_counters()
+
+    logger.info('Analytics rollups done: %s', result)
+    return result
+
+
+class RollupRunner:
+    """خيط خلفي اختياري يشغل run_rollups كل ROLLUP_INTERVAL ثانية"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        # إعادة التشغيل بعد fork (عمال gunicorn)
+        pid = os.getpid()
+        with self._lock:
+            if self._thread is not None and self._pid == pid and self._thread.is_alive():
+                return
+            self._pid = pid
+            self._thread = threading.Thread(target=self._run, name='analytics-rollups', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        stop = threading.Event()
+        while not stop.wait(self.interval):
+            # عامل واحد فقط ينفذ التجميع في كل دورة (عند وجود كاش مشترك)
+            if not cache.add(ROLLUP_LOCK_KEY, os.getpid(), self.interval):
+                continue
+            try:
+                run_rollups()
+            except Exception:
+                logger.exception('Periodic analytics rollup failed')
+            finally:
+                close_old_connections()
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def start_rollup_runner():
+    """تشغيل المشغل الدوري إذا كان ANALYTICS_SETTINGS['ROLLUP_INTERVAL'] أكبر من صفر"""
+    global _runner
+    interval = analytics_setting('ROLLUP_INTERVAL', 0)
+    if not interval:
+        return None
+    if _runner is None:
+        with _runner_lock:
+            if _runner is None:
+                _runner = RollupRunner(interval)
+    _runner.ensure_started()
+    return _runner
@@ -0,0 +1,107 @@
+# analytics/routing.py
+"""
+تصنيف الطلبات قبل التتبع: track / count / ignore.
+
+- track: مشاهدة صفحة كاملة (جلسة + PageView)
+- count: عداد فقط بدون أي كتابة في جداول التحليلات (الإعلانات، الإكمال التلقائي، AJAX، الروبوتات)
+- ignore: لا شيء (admin، الملفات الثابتة...)
+
+القواعد تُقرأ من ANALYTICS_SETTINGS['ROUTE_RULES'] وتُجمّع مرة واحدة في تعبير نمطي واحد.
+"""
+import re
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from .devices import get_ua_classifier
+from .utils import analytics_setting
+
+TRACK = 'track'
+COUNT = 'count'
+IGNORE = 'ignore'
+
+DEFAULT_ROUTE_RULES = [
+    # (الاسم، النمط، الإجراء)
+    ('admin', r'^/admin/', IGNORE),
+    ('static', r'^/(static|media)/', IGNORE),
+    ('analytics_api', r'^/api/analytics/', IGNORE),
+    ('meta', r'^/(favicon\.ico|robots\.txt|health/)', IGNORE),
+    ('ads', r'^/ads/', COUNT),
+    ('autocomplete', r'^/autocomplete_search/', COUNT),
+    ('ajax_checks', r'^/check-(username|email)/', COUNT),
+    ('sitemap', r'^/sitemap\.xml$', COUNT),
+]
+
+ROUTE_COUNTS_PREFIX = 'analytics:hits'
+ROUTE_COUNTS_TIMEOUT = 60 * 60 * 24 * 8
+
+
+class RouteClassifier:
+    """تصنيف المسار ثم الطلب في خطوة واحدة"""
+
+    def __init__(self, rules, bot_action=COUNT, ajax_action=COUNT):
+        self.rules = [(name, action) for name, _, action in rules]
+        self.pattern = re.compile('|'.join(
+            f'(?P<r{index}>{pattern})' for index, (_, pattern, _) in enumerate(rules)
+        )) if rules else None
+        self.bot_action = bot_action
+        self.ajax_action = ajax_action
+
+    def classify_path(self, path):
+        """(الإجراء، اسم القاعدة) حسب المسار فقط"""
+        match = self.pattern.match(path) if self.pattern else None
+        if match is None:
+            return TRACK, None
+        name, action = self.rules[int(match.lastgroup[1:])]
+        return action, name
+
+    def classify(self, request):
+        """(الإجراء، اسم المسار للعداد) للطلب كاملاً"""
+        action, route = self.classify_path(request.path)
+        if action != TRACK:
+            return action, route
+
+        if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+            return self.ajax_action, 'ajax'
+
+        if get_ua_classifier().is_bot(request.META.get('HTTP_USER_AGENT', '')):
+            return self.bot_action, 'bots'
+
+        return TRACK, None
+
+
+def build_route_classifier():
+    return RouteClassifier(
+        rules=analytics_setting('ROUTE_RULES', DEFAULT_ROUTE_RULES),
+        bot_action=analytics_setting('BOT_ACTION', COUNT),
+        ajax_action=analytics_setting('AJAX_ACTION', COUNT),
+    )
+
+
+# ===== العدادات =====
+
+def route_counts_key(day, route):
+    return f'{ROUTE_COUNTS_PREFIX}:{day.isoformat()}:{route}'
+
+
+def record_route_counts(counts, day=None):
+    """إضافة عدادات المسارات المجمعة ({route: n}) إلى الكاش المشترك"""
+    day = day or timezone.localdate()
+    for route, delta in counts.items():
+        key = route_counts_key(day, route)
+        cache.add(key, 0, ROUTE_COUNTS_TIMEOUT)
+        try:
+            cache.incr(key, delta)
+        except ValueError:
+            # انتهت صلاحية المفتاح بين add و incr
+            cache.set(key, delta, ROUTE_COUNTS_TIMEOUT)
+
+
+def get_route_counts(day=None, routes=None):
+    """{route: n} ليوم معين"""
+    day = day or timezone.localdate()
+    if routes is None:
+        routes = [name for name, _, action in analytics_setting('ROUTE_RULES', DEFAULT_ROUTE_RULES)
+                  if action == COUNT] + ['ajax', 'bots', 'unsampled']
+    values = cache.get_many([route_counts_key(day, route) for route in routes])
+    return {route: values.get(route_counts_key(day, route), 0) for route in routes}
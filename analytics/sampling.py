@@ -0,0 +1,145 @@
+# analytics/sampling.py
+"""
+وضع العينة: تسجيل نسبة من الزوار فقط عند ضغط الزيارات.
+
+- القرار ثابت لكل زائر (بصمة معرف الزائر) ويُحفظ في جلسة Django،
+  فالجلسة المسجلة تبقى مسجلة كاملة حتى لو تغيرت النسبة بعد ذلك
+- كل VisitorSession تحفظ وزنها (100 / النسبة) وكل التجميعات تُضرب فيه
+- النسبة = أقل قيمة بين ANALYTICS_SETTINGS['SAMPLING_RATE'] و AnalyticsSettings،
+  وتنخفض تلقائياً عندما يتراكم مخزن الإدخال المؤجل
+"""
+import hashlib
+import logging
+import threading
+import time
+
+from django.db.models import (
+    Case, DurationField, ExpressionWrapper, F, FloatField, IntegerField, Sum, Value, When,
+)
+from django.db.models.functions import Cast, Round
+
+from .utils import analytics_setting
+
+logger = logging.getLogger(__name__)
+
+# قرار العينة داخل جلسة Django: الوزن، أو 0 إذا كان الزائر خارج العينة
+SAMPLE_WEIGHT_SESSION_KEY = '_analytics_sample_weight'
+
+BUCKETS = 10000
+
+
+def sample_bucket(key):
+    """رقم ثابت بين 0 و BUCKETS-1 لكل مفتاح"""
+    digest = hashlib.blake2b(str(key).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % BUCKETS
+
+
+class Sampler:
+    """تحديد نسبة العينة الحالية ووزن كل زائر"""
+
+    def __init__(self, rate=100, backlog_threshold=10000, min_rate=5, settings_ttl=30):
+        self.rate = rate
+        self.backlog_threshold = backlog_threshold
+        self.min_rate = min_rate
+        self.settings_ttl = settings_ttl
+        self._settings_rate = None
+        self._settings_loaded_at = 0
+        self._lock = threading.Lock()
+
+    def settings_stale(self):
+        return self._settings_rate is None or time.monotonic() - self._settings_loaded_at > self.settings_ttl
+
+    def configured_rate(self):
+        """النسبة من الإعدادات ولوحة التحكم (AnalyticsSettings)"""
+        if self.settings_stale():
+            self.load_settings()
+        return min(self.rate, self._settings_rate)
+
+    def load_settings(self):
+        from .models import AnalyticsSettings
+
+        try:
+            settings_rate = AnalyticsSettings.objects.values_list('sampling_rate', flat=True).first()
+        except Exception:
+            logger.exception('Could not load analytics sampling rate')
+            settings_rate = None
+        with self._lock:
+            self._settings_rate = settings_rate or 100
+            self._settings_loaded_at = time.monotonic()
+
+    def invalidate(self):
+        with self._lock:
+            self._settings_rate = None
+
+    def current_rate(self, backlog=0):
+        """النسبة الفعلية (٪) بعد الخفض التلقائي حسب حجم المخزن المعلق"""
+        rate = self.configured_rate()
+        if self.backlog_threshold and backlog > self.backlog_threshold:
+            rate = max(self.min_rate, rate * self.backlog_threshold / backlog)
+        return rate
+
+    def weight_for(self, key, backlog=0):
+        """وزن الزائر إذا كان ضمن العينة، أو 0"""
+        rate = self.current_rate(backlog)
+        if rate >= 100:
+            return 1.0
+        if sample_bucket(key) < rate * BUCKETS / 100:
+            return round(100.0 / rate, 4)
+        return 0
+
+    def request_weight(self, request, visitor_id, backlog=0):
+        """وزن الطلب: القرار المحفوظ في الجلسة أولاً ثم قرار جديد"""
+        weight = request.session.get(SAMPLE_WEIGHT_SESSION_KEY)
+        if weight is None:
+            weight = self.weight_for(visitor_id, backlog)
+            # حتى الوزن 1: بدونه يُعاد القرار عند خفض النسبة فتُقطع جلسة مسجلة
+            request.session[SAMPLE_WEIGHT_SESSION_KEY] = weight
+        return weight
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def get_sampler():
+    """محدد العينة المشترك لهذه العملية"""
+    global _sampler
+    if _sampler is None:
+        with _sampler_lock:
+            if _sampler is None:
+                _sampler = Sampler(
+                    rate=analytics_setting('SAMPLING_RATE', 100),
+                    backlog_threshold=analytics_setting('AUTO_SAMPLING_BACKLOG', 10000),
+                    min_rate=analytics_setting('MIN_SAMPLING_RATE', 5),
+                )
+    return _sampler
+
+
+# ===== تجميعات موزونة =====
+# prefix للوصول إلى الجلسة من نموذج آخر، مثل 'session__' من PageView
+
+def weighted_count(prefix='', filter=None):
+    """عدد تقديري (عدد صحيح) = مجموع أوزان الجلسات"""
+    return Cast(Round(Sum(f'{prefix}sample_weight', filter=filter, default=0.0)), output_field=IntegerField())
+
+
+def weighted_sum_duration(field, prefix=''):
+    """مجموع مدة مضروبة في الوزن"""
+    return Sum(ExpressionWrapper(F(field) * F(f'{prefix}sample_weight'), output_field=DurationField()))
+
+
+def weighted_avg_duration(field, prefix=''):
+    """متوسط مدة موزون = مجموع (المدة × الوزن) / مجموع الأوزان"""
+    return ExpressionWrapper(
+        weighted_sum_duration(field, prefix) / Sum(f'{prefix}sample_weight'),
+        output_field=DurationField(),
+    )
+
+
+def weighted_ratio(condition, prefix=''):
+    """نسبة موزونة (0-1) للصفوف التي تحقق الشرط، مثل الارتداد"""
+    return ExpressionWrapper(
+        Sum(Case(When(condition, then=F(f'{prefix}sample_weight')), default=Value(0.0), output_field=FloatField()))
+        / Sum(f'{prefix}sample_weight'),
+        output_field=FloatField(),
+    )
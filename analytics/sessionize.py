@@ -0,0 +1,152 @@
+# analytics/sessionize.py
+"""
+اشتقاق مقاييس الجلسة بعد انتهائها.
+
+PageView جدول إضافة فقط: الإدخال لا يقرأ ولا يعدل المشاهدات السابقة.
+هذه الدفعة تمر على مشاهدات كل جلسة خاملة مرتبة حسب (session, timestamp)
+- وهو الفهرس المضاف لذلك - وتحسب:
+- الزيارات: فجوة أطول من مهلة الخمول بين مشاهدتين تبدأ زيارة جديدة
+  (عودة الزائر بعد أيام بنفس الكوكي لا تُحسب وقتاً على آخر صفحة)
+- الوقت المنقضي: الفرق حتى المشاهدة التالية في نفس الزيارة ما لم يكن
+  مقاساً من المتصفح
+- الارتداد: زيارة بمشاهدة واحدة فقط
+- صفحة الخروج: آخر مشاهدة في كل زيارة
+ثم تغلق الجلسة بمدتها الإجمالية ووقت انتهائها.
+
+الحساب لا يعتمد إلا على المشاهدات نفسها، لذلك إعادة تشغيله آمنة.
+"""
+import logging
+from datetime import timedelta
+from itertools import groupby
+from operator import itemgetter
+
+from django.db import transaction
+from django.db.models import F, Max, Q
+from django.utils import timezone
+
+from .counters import CountryDeltas
+from .models import VisitorSession, PageView
+from .utils import analytics_setting
+
+logger = logging.getLogger(__name__)
+
+
+def derive_page_metrics(views, max_gap):
+    """مقاييس مشاهدات جلسة واحدة
+
+    views: [(pk, timestamp, time_spent)] مرتبة حسب الوقت
+    max_gap: مهلة الخمول؛ فجوة أطول منها تنهي الزيارة وما بعدها زيارة جديدة
+    يعيد ([(pk, time_spent, is_bounce, is_exit)], المدة الإجمالية، وقت الانتهاء)
+    """
+    # تقسيم المشاهدات إلى زيارات: جلسة الزائر تمتد طوال عمر الكوكي
+    visits = [[views[0]]]
+    for previous, view in zip(views, views[1:]):
+        if view[1] - previous[1] > max_gap:
+            visits.append([view])
+        else:
+            visits[-1].append(view)
+
+    metrics = []
+    total = timedelta(0)
+    for visit in visits:
+        is_bounce = len(visit) == 1
+        for index, (pk, timestamp, time_spent) in enumerate(visit):
+            is_exit = index == len(visit) - 1
+            # الوقت المقاس من المتصفح (إشارات التفاعل) يتقدم على التقدير من الطلب التالي
+            if not is_exit and not time_spent:
+                time_spent = visit[index + 1][1] - timestamp
+            # آخر صفحة في الزيارة لا يليها طلب: يبقى وقتها كما هو (صفر ما لم يصل من المتصفح)
+            metrics.append((pk, time_spent, is_bounce, is_exit))
+            total += time_spent
+
+    return metrics, total, views[-1][1] + metrics[-1][1]
+
+
+def idle_session_ids(cutoff, limit):
+    """الجلسات النشطة التي لم تسجل أي مشاهدة منذ cutoff"""
+    return list(
+        VisitorSession.objects.filter(is_active=True)
+        .annotate(last_seen=Max('pageviews__timestamp'))
+        .filter(Q(last_seen__lt=cutoff) | Q(last_seen__isnull=True, start_time__lt=cutoff))
+        .order_by()
+        .values_list('pk', flat=True)[:limit]
+    )
+
+
+def sessionize_batch(session_ids, cutoff, max_gap, chunk_size=2000):
+    """حساب وإغلاق مجموعة جلسات بمرور واحد مرتب على مشاهداتها"""
+    rows = (
+        PageView.objects.filter(session_id__in=session_ids)
+        .order_by('session_id', 'timestamp', 'pk')
+        .values_list('session_id', 'pk', 'timestamp', 'time_spent', 'is_bounce', 'is_exit')
+        .iterator(chunk_size=chunk_size)
+    )
+
+    # المدة السابقة لكل جلسة لزيادة وقت الدولة بالفرق فقط (إعادة المعالجة لا تضاعفه)
+    previous = {
+        pk: (country_id, weight, total)
+        for pk, country_id, weight, total in VisitorSession.objects.filter(pk__in=session_ids).values_list(
+            'pk', 'country_id', 'sample_weight', 'total_time_spent',
+        )
+    }
+    country_deltas = CountryDeltas()
+
+    page_views = []
+    sessions = []
+
+    for session_id, group in groupby(rows, key=itemgetter(0)):
+        group = list(group)
+        metrics, total, end_time = derive_page_metrics(
+            [(pk, timestamp, time_spent) for _, pk, timestamp, time_spent, _, _ in group],
+            max_gap,
+        )
+        for row, (pk, time_spent, is_bounce, is_exit) in zip(group, metrics):
+            # كتابة الصفوف التي تغيرت فقط
+            if row[3:] != (time_spent, is_bounce, is_exit):
+                page_views.append(PageView(pk=pk, time_spent=time_spent, is_bounce=is_bounce, is_exit=is_exit))
+
+        sessions.append(VisitorSession(
+            pk=session_id, total_time_spent=total, end_time=end_time, is_active=False,
+        ))
+        country_id, weight, old_total = previous.get(session_id, (None, 1.0, total))
+        country_deltas.add_duration(country_id, (total - old_total) * weight)
+
+    with transaction.atomic():
+        if page_views:
+            PageView.objects.bulk_update(page_views, ['time_spent', 'is_bounce', 'is_exit'], batch_size=chunk_size)
+        VisitorSession.objects.bulk_update(
+            sessions, ['total_time_spent', 'end_time', 'is_active'], batch_size=chunk_size
+        )
+        # جلسات بدون أي مشاهدة (طلبات POST فقط مثلاً)
+        empty = set(session_ids) - {session.pk for session in sessions}
+        for pk in empty:
+            country_id, weight, old_total = previous.get(pk, (None, 1.0, timedelta(0)))
+            country_deltas.add_duration(country_id, -old_total * weight)
+        if empty:
+            VisitorSession.objects.filter(pk__in=empty).update(
+                is_active=False, end_time=F('start_time'), total_time_spent=timedelta(0),
+            )
+        # مشاهدة وصلت أثناء الحساب تعيد فتح الجلسة لتتم معالجتها في المرة القادمة
+        VisitorSession.objects.filter(
+            pk__in=session_ids, pageviews__timestamp__gte=cutoff,
+        ).update(is_active=True)
+        country_deltas.apply()
+
+    return len(page_views)
+
+
+def sessionize(now=None, idle_minutes=None, batch_size=500):
+    """معالجة كل الجلسات الخاملة على دفعات؛ يعيد (عدد الجلسات، عدد المشاهدات المحدثة)"""
+    idle = timedelta(minutes=idle_minutes or analytics_setting('SESSION_IDLE_MINUTES', 30))
+    cutoff = (now or timezone.now()) - idle
+
+    closed = updated = 0
+    while True:
+        session_ids = idle_session_ids(cutoff, batch_size)
+        if not session_ids:
+            break
+        updated += sessionize_batch(session_ids, cutoff, max_gap=idle)
+        closed += len(session_ids)
+
+    logger.info('Sessionized %d sessions (%d page views updated)', closed, updated)
+    return closed, updated
@@ -0,0 +1,38 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .geo import get_geo_resolver
+from .models import AnalyticsSettings, Country
+from .sampling import get_sampler
+from .snapshot import get_dashboard_snapshot
+
+
+@receiver(post_save, sender=Country)
+def update_country_map_on_save(sender, instance, **kwargs):
+    """
+    إضافة الدولة إلى خريطة الأكواد المحملة مسبقاً
+    """
+    get_geo_resolver().add_country(instance.code, instance.id)
+
+
+@receiver(post_delete, sender=Country)
+def reload_country_map_on_delete(sender, instance, **kwargs):
+    """
+    إعادة تحميل خريطة الدول عند حذف دولة
+    """
+    get_geo_resolver().invalidate_countries()
+
+
+@receiver(post_save, sender=AnalyticsSettings)
+def reload_sampling_rate_on_save(sender, instance, **kwargs):
+    """
+    تطبيق نسبة العينة الجديدة فوراً في هذه العملية (والعمال الآخرون بعد انتهاء الكاش)
+    """
+    get_sampler().invalidate()
+
+
+@receiver(post_save, sender=AnalyticsSettings)
+def rebuild_dashboard_snapshot_on_save(sender, instance, **kwargs):
+    """
+    إعادة بناء لقطة اللوحة بفترة التحديث الجديدة عند أول طلب
+    """
+    get_dashboard_snapshot().invalidate()
@@ -0,0 +1,123 @@
+# analytics/snapshot.py
+"""
+لقطة مخزنة لبيانات لوحة التحليلات المتقدمة.
+
+اللقطة تُبنى مرة كل AnalyticsSettings.dashboard_refresh_interval ثانية
+وتُحفظ في الكاش، وكل طلبات اللوحة تعرض منها. عند انتهاء صلاحيتها يبنيها
+طلب واحد فقط (single-flight): داخل العملية بقفل، وبين العمال بمفتاح قفل
+في الكاش، والبقية يعرضون اللقطة السابقة إلى أن تجهز الجديدة.
+"""
+import logging
+import os
+import threading
+import time
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_CACHE_KEY = 'analytics:dashboard:snapshot'
+SNAPSHOT_LOCK_KEY = 'analytics:dashboard:snapshot:lock'
+
+DEFAULT_REFRESH_INTERVAL = 30
+
+
+def dashboard_refresh_interval():
+    from .models import AnalyticsSettings
+
+    interval = AnalyticsSettings.objects.values_list('dashboard_refresh_interval', flat=True).first()
+    return interval or DEFAULT_REFRESH_INTERVAL
+
+
+class DashboardSnapshot:
+    """قراءة اللقطة الحالية أو بناؤها مرة واحدة عند انتهاء صلاحيتها"""
+
+    def __init__(self, key=SNAPSHOT_CACHE_KEY, lock_key=SNAPSHOT_LOCK_KEY, build_timeout=60, wait_timeout=10):
+        self.key = key
+        self.lock_key = lock_key
+        self.build_timeout = build_timeout
+        self.wait_timeout = wait_timeout
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def is_fresh(snapshot):
+        return snapshot is not None and time.time() - snapshot['built_at'] < snapshot['interval']
+
+    def get(self, builder):
+        """بيانات اللقطة؛ builder دالة بدون معاملات تعيد البيانات"""
+        snapshot = cache.get(self.key)
+        if self.is_fresh(snapshot):
+            return snapshot
+
+        # طلب آخر في نفس العملية يبني اللقطة: عرض السابقة إن وجدت وإلا انتظاره
+        if not self._lock.acquire(blocking=snapshot is None):
+            return snapshot
+        try:
+            snapshot = cache.get(self.key)
+            if self.is_fresh(snapshot):
+                return snapshot
+
+            owns_lock = cache.add(self.lock_key, os.getpid(), self.build_timeout)
+            if not owns_lock:
+                # عامل آخر يبني اللقطة
+                if snapshot is not None:
+                    return snapshot
+                snapshot = self.wait_for_build()
+                if snapshot is not None:
+                    return snapshot
+                # فشل البناء هناك أو طال: البناء هنا، مع أخذ القفل إن تحرر
+                owns_lock = cache.add(self.lock_key, os.getpid(), self.build_timeout)
+
+            try:
+                return self.build(builder)
+            finally:
+                # لا نحذف قفل عامل آخر ما زال يبني
+                if owns_lock:
+                    cache.delete(self.lock_key)
+        finally:
+            self._lock.release()
+
+    def build(self, builder):
+        started = time.perf_counter()
+        interval = dashboard_refresh_interval()
+        snapshot = {'built_at': time.time(), 'interval': interval, 'data': builder()}
+        # الاحتفاظ باللقطة بعد انتهاء صلاحيتها لعرضها أثناء إعادة البناء
+        cache.set(self.key, snapshot, max(interval * 10, 300))
+        logger.info('Dashboard snapshot built in %.0f ms', (time.perf_counter() - started) * 1000)
+        return snapshot
+
+    def wait_for_build(self):
+        """انتظار لقطة يبنيها عامل آخر حتى wait_timeout ثانية على الأكثر
+
+        يتوقف فور ظهور اللقطة، أو فور تحرر القفل بدونها (فشل البناء هناك)
+        """
+        deadline = time.monotonic() + self.wait_timeout
+        delay = 0.05
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            time.sleep(min(delay, remaining))
+            snapshot = cache.get(self.key)
+            if snapshot is not None:
+                return snapshot
+            if cache.get(self.lock_key) is None:
+                return None
+            delay = min(delay * 2, 0.5)
+
+    def invalidate(self):
+        cache.delete(self.key)
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def get_dashboard_snapshot():
+    """لقطة اللوحة المشتركة لهذه العملية"""
+    global _snapshot
+    if _snapshot is None:
+        with _snapshot_lock:
+            if _snapshot is None:
+                _snapshot = DashboardSnapshot()
+    return _snapshot
@@ -1,3 +1,1141 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import uuid
+from datetime import datetime, timedelta, timezone
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import iscoroutinefunction
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.cache import cache, caches
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Sum
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path, reverse
+from django.utils import timezone as django_timezone
+
+from .counters import CountryDeltas, stochastic_round
+from .devices import browser_family, os_family
+from .apps import is_serving_process
+from .archive import (
+    archivable_months, archive_months, export_month, load_manifest, month_bounds, month_key, purge_month,
+    rehydrate_month, save_manifest,
+)
+from .export import EXPORT_COLUMNS, stream_csv, stream_ndjson
+from .geo import GeoResolver
+from .hyperloglog import HyperLogLog
+from .identity import VisitorIdentityMap
+from .ingest import EventBuffer, PageEvent, parse_engagement
+from .middleware import AdvancedAnalyticsMiddleware
+from .models import (
+    Country, CountryAnalytics, DeviceAnalytics, HourlyAnalytics, PageView, RealTimeStat, SiteAnalytics,
+    VisitorSession,
+)
+from .partitioning import (
+    convert_to_partitioned, create_partition, drop_partitions_before, ensure_month_partition, ensure_partitions,
+    partitioning_enabled,
+)
+from .presence import MemoryPresenceStore
+from .rollups import ROLLUPS, pending_days, run_rollups, set_watermark
+from .routing import COUNT, DEFAULT_ROUTE_RULES, IGNORE, TRACK, RouteClassifier, get_route_counts, record_route_counts
+from .sampling import Sampler, sample_bucket
+from .snapshot import DashboardSnapshot
+from .sessionize import derive_page_metrics, sessionize
+from .topk import SpaceSaving
+from .views import add_page_metrics, engagement_beacon, get_country_details, get_landing_pages
+
+
+class MemoryPresenceStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.store = MemoryPresenceStore(window=300)
+
+    def test_keeps_latest_page_and_profile(self):
+        self.store.touch_many([{
+            'visitor_id': 'a', 'last_activity': 1000, 'current_page': '/',
+            'device': 'mobile', 'country': 'مصر',
+        }], now=1000)
+        self.store.touch_many([{
+            'visitor_id': 'a', 'last_activity': 1010, 'current_page': '/books/',
+        }], now=1010)
+
+        [visitor] = self.store.active(now=1010)
+        self.assertEqual(visitor['current_page'], '/books/')
+        self.assertEqual(visitor['device'], 'mobile')
+        self.assertEqual(visitor['last_activity'], 1010)
+
+    def test_trims_expired_visitors(self):
+        self.store.touch_many([
+            {'visitor_id': 'old', 'last_activity': 1000, 'current_page': '/'},
+            {'visitor_id': 'new', 'last_activity': 1200, 'current_page': '/'},
+        ], now=1200)
+
+        self.assertEqual(self.store.count(now=1350), 1)
+        self.assertEqual([v['visitor_id'] for v in self.store.active(now=1350)], ['new'])
+
+    def test_stale_heap_entries_do_not_evict_active_visitor(self):
+        self.store.touch_many([{'visitor_id': 'a', 'last_activity': 1000, 'current_page': '/'}], now=1000)
+        self.store.touch_many([{'visitor_id': 'a', 'last_activity': 1250, 'current_page': '/x/'}], now=1250)
+
+        self.assertEqual(self.store.count(now=1400), 1)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'identity-default'},
+    'analytics': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'identity-shared'},
+})
+class VisitorIdentityMapTests(SimpleTestCase):
+    def test_second_level_uses_the_configured_cache(self):
+        caches['analytics'].clear()
+        VisitorIdentityMap(cache_alias='analytics').bind('session-key', 'visitor-1')
+        VisitorIdentityMap(cache_alias='analytics').set_pks({'visitor-1': 7})
+
+        # عامل آخر (خريطة جديدة) يجد الهوية في الكاش المشترك
+        other = VisitorIdentityMap(cache_alias='analytics')
+        self.assertEqual(other.lookup('session-key'), 'visitor-1')
+        self.assertEqual(other.get_pks(['visitor-1', 'visitor-2']), {'visitor-1': 7})
+        self.assertIsNone(VisitorIdentityMap().lookup('session-key'))
+
+
+class DerivePageMetricsTests(SimpleTestCase):
+    def setUp(self):
+        self.start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+    def test_time_spent_is_gap_to_next_view_and_last_is_exit(self):
+        views = [
+            (1, self.start, timedelta(0)),
+            (2, self.start + timedelta(seconds=40), timedelta(0)),
+            (3, self.start + timedelta(seconds=100), timedelta(0)),
+        ]
+        metrics, total, end_time = derive_page_metrics(views, max_gap=timedelta(minutes=30))
+
+        self.assertEqual(metrics, [
+            (1, timedelta(seconds=40), False, False),
+            (2, timedelta(seconds=60), False, False),
+            (3, timedelta(0), False, True),
+        ])
+        self.assertEqual(total, timedelta(seconds=100))
+        self.assertEqual(end_time, self.start + timedelta(seconds=100))
+
+    def test_single_view_is_bounce(self):
+        metrics, _, _ = derive_page_metrics([(1, self.start, timedelta(0))], max_gap=timedelta(minutes=30))
+        self.assertEqual(metrics, [(1, timedelta(0), True, True)])
+
+    def test_measured_time_is_kept(self):
+        views = [(1, self.start, timedelta(seconds=7)), (2, self.start + timedelta(seconds=60), timedelta(0))]
+        metrics, _, _ = derive_page_metrics(views, max_gap=timedelta(minutes=30))
+        self.assertEqual(metrics[0][1], timedelta(seconds=7))
+
+    def test_gap_longer_than_idle_timeout_starts_a_new_visit(self):
+        later = self.start + timedelta(days=3)
+        views = [
+            (1, self.start, timedelta(0)),
+            (2, self.start + timedelta(seconds=30), timedelta(seconds=12)),
+            (3, later, timedelta(0)),
+            (4, later + timedelta(seconds=50), timedelta(0)),
+            (5, later + timedelta(days=1), timedelta(0)),
+        ]
+        metrics, total, end_time = derive_page_metrics(views, max_gap=timedelta(minutes=30))
+
+        self.assertEqual(metrics, [
+            (1, timedelta(seconds=30), False, False),
+            # نهاية الزيارة الأولى: الوقت المقاس من المتصفح فقط
+            (2, timedelta(seconds=12), False, True),
+            (3, timedelta(seconds=50), False, False),
+            (4, timedelta(0), False, True),
+            (5, timedelta(0), True, True),
+        ])
+        self.assertEqual(total, timedelta(seconds=92))
+        self.assertEqual(end_time, later + timedelta(days=1))
+
+
+class EngagementTests(SimpleTestCase):
+    view_id = '8d2c1a0e-59b4-4c7e-9a55-2f1b6f0b7c11'
+
+    def test_parse_clamps_and_skips_invalid_items(self):
+        body = json.dumps([
+            {'v': self.view_id, 's': 150, 't': -5},
+            {'v': 'not-a-uuid', 's': 10, 't': 10},
+            'junk',
+        ])
+        self.assertEqual(parse_engagement(body), [(self.view_id, 100, 0)])
+        self.assertEqual(parse_engagement('{broken'), [])
+        self.assertEqual(parse_engagement('{"v": 1}'), [])
+
+    def test_beacons_are_coalesced_by_view_id(self):
+        buffer = EventBuffer()
+        buffer._ensure_thread = lambda: None
+        buffer.engage([(self.view_id, 40, 1000)])
+        buffer.engage([(self.view_id, 20, 5000)])
+
+        self.assertEqual(len(buffer._engagement), 1)
+        self.assertEqual(buffer._engagement[self.view_id][:2], [40, 5000])
+
+
+class SamplerTests(SimpleTestCase):
+    def make_sampler(self, rate, **kwargs):
+        sampler = Sampler(rate=rate, **kwargs)
+        sampler.configured_rate = lambda: rate
+        return sampler
+
+    def test_full_rate_keeps_everyone_with_weight_one(self):
+        sampler = self.make_sampler(100)
+        self.assertEqual({sampler.weight_for(f'v{i}') for i in range(100)}, {1.0})
+
+    def test_decision_is_deterministic_and_weighted(self):
+        sampler = self.make_sampler(20)
+        weights = [sampler.weight_for(f'visitor-{i}') for i in range(5000)]
+
+        self.assertEqual(weights, [sampler.weight_for(f'visitor-{i}') for i in range(5000)])
+        self.assertEqual(set(weights), {0, 5.0})
+        # مجموع الأوزان يقدّر العدد الحقيقي
+        self.assertAlmostEqual(sum(weights) / 5000, 1.0, delta=0.1)
+
+    def test_recorded_visitor_stays_recorded_when_the_rate_drops(self):
+        rate = {'value': 100}
+        sampler = Sampler()
+        sampler.configured_rate = lambda: rate['value']
+        # زائر خارج عينة 20%
+        visitor = next(f'visitor-{i}' for i in range(1000) if sample_bucket(f'visitor-{i}') >= 2000)
+        request = RequestFactory().get('/')
+        SessionMiddleware(lambda request: None).process_request(request)
+
+        self.assertEqual(sampler.request_weight(request, visitor), 1.0)
+        rate['value'] = 20
+        self.assertEqual(sampler.request_weight(request, visitor), 1.0)
+        self.assertEqual(sampler.request_weight(request, visitor, backlog=10 ** 6), 1.0)
+
+        other = RequestFactory().get('/')
+        SessionMiddleware(lambda request: None).process_request(other)
+        self.assertEqual(sampler.request_weight(other, visitor), 0)
+
+    def test_rate_drops_when_backlog_grows(self):
+        sampler = self.make_sampler(100, backlog_threshold=1000, min_rate=5)
+        self.assertEqual(sampler.current_rate(backlog=500), 100)
+        self.assertEqual(sampler.current_rate(backlog=4000), 25)
+        self.assertEqual(sampler.current_rate(backlog=10 ** 6), 5)
+
+
+class CountryDeltasTests(SimpleTestCase):
+    def test_deltas_are_merged_per_country(self):
+        start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        deltas = CountryDeltas()
+        deltas.add_visit(1, 1.0, start)
+        deltas.add_visit(1, 2.5, start + timedelta(minutes=5))
+        deltas.add_visit(None, 1.0, start)
+        deltas.add_duration(1, timedelta(seconds=30))
+        deltas.add_duration(1, timedelta(seconds=-10))
+
+        self.assertEqual(deltas.visits, {1: 3.5})
+        self.assertEqual(deltas.durations, {1: timedelta(seconds=20)})
+        self.assertEqual(deltas.last_visits, {1: start + timedelta(minutes=5)})
+
+    def test_stochastic_round_is_unbiased(self):
+        self.assertEqual(stochastic_round(4.0), 4)
+        total = sum(stochastic_round(1.25) for _ in range(4000))
+        self.assertAlmostEqual(total / 4000, 1.25, delta=0.05)
+
+
+class SpaceSavingTests(SimpleTestCase):
+    def test_heavy_hitters_survive_a_long_tail(self):
+        sketch = SpaceSaving(capacity=5)
+        for i in range(1000):
+            sketch.offer('/' if i % 2 else '/courses/')
+            sketch.offer(f'/tail/{i}/')
+
+        top = sketch.top(2)
+        self.assertEqual({key for key, _, _ in top}, {'/', '/courses/'})
+        for _, count, error in top:
+            # العد الحقيقي (500) بين (العدد - الخطأ) والعدد
+            self.assertLessEqual(count - error, 500)
+            self.assertGreaterEqual(count, 500)
+
+    def test_merge_sums_counts_and_keeps_capacity(self):
+        first, second = SpaceSaving(capacity=3), SpaceSaving(capacity=3)
+        for key, weight in [('a', 5), ('b', 3), ('c', 1)]:
+            first.offer(key, weight)
+        for key, weight in [('a', 2), ('d', 4), ('e', 1)]:
+            second.offer(key, weight)
+
+        first.merge(second)
+        self.assertEqual(len(first), 3)
+        # الملخصان ممتلئان: المفتاح الغائب عن أحدهما يأخذ أقل عداد فيه (1)
+        self.assertEqual(first.top(3), [('a', 7, 0.0), ('d', 5, 1.0), ('b', 4, 1.0)])
+
+    def test_merge_of_disjoint_keys_keeps_the_upper_bound(self):
+        first, second = SpaceSaving(capacity=2), SpaceSaving(capacity=2)
+        stream = {}
+        # x يُعد في الملخص الأول ثم يُزاح منه
+        for key, weight in [('x', 2), ('p', 3), ('q', 3)]:
+            first.offer(key, weight)
+        for key, weight in [('x', 4), ('y', 1)]:
+            second.offer(key, weight)
+        for key, weight in [('x', 2), ('p', 3), ('q', 3), ('x', 4), ('y', 1)]:
+            stream[key] = stream.get(key, 0.0) + weight
+        self.assertFalse(set(first.counters) & set(second.counters))
+
+        first.merge(second)
+
+        self.assertEqual(first.top(2), [('x', 7, 3.0), ('q', 6, 3.0)])
+        for key, count, error in first.top(2):
+            self.assertLessEqual(count - error, stream[key])
+            self.assertGreaterEqual(count, stream[key])
+
+    def test_merge_into_a_sketch_with_room_adds_nothing(self):
+        first, second = SpaceSaving(capacity=5), SpaceSaving(capacity=5)
+        first.offer('a', 2)
+        second.offer('b', 1)
+        first.merge(second)
+        self.assertEqual(first.top(2), [('a', 2, 0.0), ('b', 1, 0.0)])
+
+    def test_round_trips_through_dict(self):
+        sketch = SpaceSaving(capacity=4)
+        sketch.offer('/a/', 2.5)
+        self.assertEqual(SpaceSaving.from_dict(sketch.to_dict()).top(1), [('/a/', 2.5, 0.0)])
+
+
+class HyperLogLogTests(SimpleTestCase):
+    # الخطأ المعياري عند p=12 ≈ 1.04 / sqrt(4096) ≈ 1.6%؛ الاختبار يسمح بـ 3 أضعافه
+    tolerance = 3 * 1.04 / 64
+
+    def assertEstimate(self, sketch, exact):
+        self.assertAlmostEqual(sketch.count() / exact, 1.0, delta=self.tolerance)
+
+    def test_estimates_match_exact_counts(self):
+        for exact in (100, 5000, 50000):
+            sketch = HyperLogLog().update(f'visitor-{i}' for i in range(exact))
+            self.assertEstimate(sketch, exact)
+
+    def test_small_counts_use_linear_counting(self):
+        sketch = HyperLogLog().update(f'v{i}' for i in range(50))
+        self.assertEqual(len(sketch), 50)
+
+    def test_duplicates_do_not_change_the_estimate(self):
+        sketch = HyperLogLog().update(f'v{i % 1000}' for i in range(20000))
+        self.assertEstimate(sketch, 1000)
+
+    def test_union_of_overlapping_days(self):
+        # 30 يوماً من 2000 زائر يتداخل كل يوم مع السابق في 1000
+        days = [HyperLogLog().update(f'v{i}' for i in range(day * 1000, day * 1000 + 2000)) for day in range(30)]
+
+        self.assertEstimate(HyperLogLog.union(days), 31000)
+        merged = HyperLogLog()
+        for day in days:
+            merged.merge(day)
+        self.assertEqual(merged.registers, HyperLogLog.union(days).registers)
+
+    def test_round_trips_through_bytes(self):
+        sketch = HyperLogLog().update(range(1000))
+        data = sketch.to_bytes()
+        self.assertEqual(len(data), 4097)
+        self.assertEqual(HyperLogLog.from_bytes(data).count(), sketch.count())
+        with self.assertRaises(ValueError):
+            HyperLogLog.union([sketch, HyperLogLog(p=10)])
+
+
+class UAFamilyTests(SimpleTestCase):
+    def test_browser_variants_collapse_to_one_family(self):
+        for name in ('Chrome', 'Chrome Mobile', 'Chrome Mobile iOS', 'Chromium'):
+            self.assertEqual(browser_family(name), 'Chrome')
+        self.assertEqual(browser_family('Chrome Mobile WebView'), 'WebView')
+        self.assertEqual(browser_family('Mobile Safari UI/WKWebView'), 'Safari')
+        self.assertEqual(browser_family('Firefox iOS'), 'Firefox')
+
+    def test_unknown_names_fall_back_to_other(self):
+        self.assertEqual(browser_family('SomeCrawlerBrowser'), 'Other')
+        self.assertEqual(browser_family(None), 'Other')
+        self.assertEqual(os_family('Symbian OS'), 'Other')
+
+    def test_os_families(self):
+        self.assertEqual(os_family('Mac OS X'), 'macOS')
+        self.assertEqual(os_family('Ubuntu'), 'Linux')
+        self.assertEqual(os_family('Windows'), 'Windows')
+
+
+class ExportStreamTests(SimpleTestCase):
+    def row(self):
+        values = {name: None for name, _ in EXPORT_COLUMNS['pageviews']}
+        values.update({
+            'id': 7, 'url': 'https://kunooz.com/كتب/', 'title': 'كتب, مختارة',
+            'timestamp': datetime(2026, 3, 1, 10, 30, 0, 123456, tzinfo=timezone.utc),
+            'time_spent': timedelta(seconds=90), 'is_bounce': False,
+        })
+        return tuple(values.values())
+
+    def test_csv_starts_with_bom_and_header(self):
+        chunks = list(stream_csv('pageviews', iter([self.row()])))
+
+        self.assertEqual(len(chunks), 2)
+        self.assertTrue(chunks[0].startswith('\ufeffid,view_id,session_id,timestamp,url'))
+        self.assertIn('2026-03-01T10:30:00.123456+00:00', chunks[1])
+        self.assertIn('"كتب, مختارة"', chunks[1])
+        self.assertIn(',90.0,', chunks[1])
+
+    def test_ndjson_writes_one_object_per_line(self):
+        [line] = stream_ndjson('pageviews', iter([self.row()]))
+
+        self.assertTrue(line.endswith('\n'))
+        data = json.loads(line)
+        self.assertEqual(data['url'], 'https://kunooz.com/كتب/')
+        self.assertEqual(data['time_spent'], 90.0)
+        self.assertEqual(data['timestamp'], '2026-03-01T10:30:00.123456+00:00')
+        self.assertEqual(list(data), [name for name, _ in EXPORT_COLUMNS['pageviews']])
+
+
+class MiddlewareModeTests(SimpleTestCase):
+    def test_runs_natively_under_asgi_and_wsgi(self):
+        async def async_view(request):
+            return None
+
+        self.assertTrue(iscoroutinefunction(AdvancedAnalyticsMiddleware(async_view)))
+        self.assertFalse(iscoroutinefunction(AdvancedAnalyticsMiddleware(lambda request: None)))
+
+
+def page_event(visitor_id, when, url='https://kunooz.com/', first=False, **kwargs):
+    values = dict(
+        visitor_id=visitor_id, timestamp=when, method='GET', url=url, title='Kunooz',
+        ip_address='10.0.0.1', user_agent='test-agent', referrer=None, user_id=None,
+        device_info=None, geo_info=None, view_id=str(uuid.uuid4()), sample_weight=1.0,
+    )
+    if first:
+        values['device_info'] = {'device_type': 'mobile', 'browser': 'Chrome', 'os': 'Android'}
+        values['geo_info'] = {
+            'country_code': 'EG', 'country_name_ar': 'مصر', 'flag_emoji': '🇪🇬',
+            'city': None, 'region': None, 'latitude': None, 'longitude': None, 'timezone': None,
+        }
+    values.update(kwargs)
+    return PageEvent(**values)
+
+
+class EventBufferFlushTests(TestCase):
+    def setUp(self):
+        self.country = Country.objects.create(code='EG', name='مصر')
+        self.buffer = EventBuffer()
+        self.buffer._ensure_thread = lambda: None
+        self.now = django_timezone.now()
+
+    def test_flush_writes_sessions_and_page_views(self):
+        first, second = str(uuid.uuid4()), str(uuid.uuid4())
+        self.buffer.append(page_event(first, self.now, first=True))
+        self.buffer.append(page_event(first, self.now + timedelta(seconds=20), url='https://kunooz.com/books/'))
+        self.buffer.append(page_event(second, self.now, first=True))
+
+        self.buffer.flush()
+
+        self.assertEqual(len(self.buffer), 0)
+        self.assertEqual(self.buffer.flushed, 3)
+        session = VisitorSession.objects.get(session_id=first)
+        self.assertEqual((session.page_count, session.device_type, session.country_id), (2, 'mobile', self.country.pk))
+        self.assertEqual(PageView.objects.filter(session=session).count(), 2)
+        self.assertEqual(VisitorSession.objects.count(), 2)
+        self.country.refresh_from_db()
+        self.assertEqual(self.country.visits, 2)
+
+    def test_later_flush_reuses_the_session(self):
+        visitor = str(uuid.uuid4())
+        self.buffer.append(page_event(visitor, self.now, first=True))
+        self.buffer.flush()
+        self.buffer.append(page_event(visitor, self.now + timedelta(minutes=1)))
+        self.buffer.flush()
+
+        self.assertEqual(VisitorSession.objects.get(session_id=visitor).page_count, 2)
+        self.country.refresh_from_db()
+        self.assertEqual(self.country.visits, 1)
+
+    def test_session_inserted_concurrently_is_not_counted_twice(self):
+        visitor = str(uuid.uuid4())
+        bulk_create = VisitorSession.objects.bulk_create
+
+        def race(sessions, **kwargs):
+            # عامل آخر يدرج نفس الزائر (بأول حدث مختلف) بين القراءة والإدراج
+            bulk_create([VisitorSession(
+                session_id=visitor, ip_address='10.0.0.2', user_agent='other', device_type='desktop',
+                browser='Other', os='Other', landing_page='https://kunooz.com/', country=self.country,
+                start_time=self.now - timedelta(seconds=1), page_count=0,
+            )])
+            return bulk_create(sessions, **kwargs)
+
+        self.buffer.append(page_event(visitor, self.now, first=True))
+        with mock.patch.object(VisitorSession.objects, 'bulk_create', side_effect=race):
+            self.buffer.flush()
+
+        session = VisitorSession.objects.get(session_id=visitor)
+        self.assertEqual(session.page_count, 1)
+        self.assertEqual(session.pageviews.count(), 1)
+        self.country.refresh_from_db()
+        # الزيارة عُدت عند إدراج العامل الآخر، وليس هنا
+        self.assertEqual(self.country.visits, 0)
+
+
+MOBILE_UA = (
+    'Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 '
+    '(KHTML, like Gecko) Chrome/120.0 Mobile Safari/537.36'
+)
+
+
+class TrackingMiddlewareTests(TestCase):
+    def setUp(self):
+        self.buffer = EventBuffer()
+        self.buffer._ensure_thread = lambda: None
+        patcher = mock.patch('analytics.middleware.get_event_buffer', return_value=self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.middleware = AdvancedAnalyticsMiddleware(lambda request: HttpResponse('ok'))
+
+    def request(self, path='/', cookies=None, ip='41.32.0.10'):
+        request = RequestFactory().get(path, HTTP_USER_AGENT=MOBILE_UA, REMOTE_ADDR=ip)
+        request.COOKIES.update(cookies or {})
+        SessionMiddleware(lambda request: None).process_request(request)
+        request.user = AnonymousUser()
+        return request
+
+    def serve(self, request):
+        response = self.middleware(request)
+        return SessionMiddleware(lambda request: None).process_response(request, response)
+
+    def test_clients_sharing_ip_and_user_agent_are_distinct_visitors(self):
+        first, second = self.request(), self.request()
+        self.serve(first)
+        self.serve(second)
+
+        self.assertNotEqual(first.visitor_session_id, second.visitor_session_id)
+        self.buffer.flush()
+        self.assertEqual(VisitorSession.objects.count(), 2)
+
+    def test_session_cookie_keeps_the_visitor(self):
+        first = self.request()
+        response = self.serve(first)
+        again = self.request('/books/', cookies={'sessionid': response.cookies['sessionid'].value})
+        self.serve(again)
+
+        self.assertEqual(first.visitor_session_id, again.visitor_session_id)
+        self.buffer.flush()
+        self.assertEqual(VisitorSession.objects.get().page_count, 2)
+
+
+class GeoResolverTests(TestCase):
+    def resolver(self):
+        resolver = GeoResolver(cache_size=10)
+        resolver.reader = mock.Mock()
+        resolver.reader.city.side_effect = lambda ip: mock.Mock(**{
+            'country.iso_code': 'EG', 'country.name': 'Egypt', 'subdivisions': None, 'city': None,
+            'location.latitude': 30.0, 'location.longitude': 31.0, 'location.time_zone': 'Africa/Cairo',
+        })
+        return resolver
+
+    def test_addresses_in_one_prefix_share_a_lookup(self):
+        resolver = self.resolver()
+
+        first = resolver.resolve('41.32.7.10')
+        second = resolver.resolve('41.32.7.200')
+        resolver.resolve('41.32.8.1')
+
+        self.assertEqual(first['country_name_ar'], 'مصر')
+        self.assertEqual(second, first)
+        self.assertEqual(resolver.reader.city.call_count, 2)
+        self.assertEqual((resolver.lookups.hits, resolver.lookups.misses), (1, 2))
+
+    def test_failed_lookups_are_cached_and_invalid_addresses_skipped(self):
+        resolver = self.resolver()
+        resolver.reader.city.side_effect = ValueError('not found')
+
+        self.assertIsNone(resolver.resolve('10.1.2.3'))
+        self.assertIsNone(resolver.resolve('10.1.2.4'))
+        self.assertIsNone(resolver.resolve('not-an-ip'))
+        self.assertEqual(resolver.reader.city.call_count, 1)
+
+    def test_preload_fills_the_country_map(self):
+        country = Country.objects.create(code='EG', name='مصر')
+        resolver = GeoResolver()
+
+        resolver.preload()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(resolver.country_ids(), {'EG': country.pk})
+
+    def test_preload_runs_only_in_serving_processes(self):
+        self.assertTrue(is_serving_process(['/usr/local/bin/gunicorn', 'kunooz.wsgi:application']))
+        self.assertTrue(is_serving_process(['manage.py', 'runserver']))
+        self.assertFalse(is_serving_process(['manage.py', 'migrate']))
+        self.assertFalse(is_serving_process(['/usr/lib/python3/site-packages/django/__main__.py', 'test']))
+
+
+BOT_UA = 'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)'
+
+CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'analytics-tests'}}
+
+
+class RouteClassifierTests(SimpleTestCase):
+    def setUp(self):
+        self.routes = RouteClassifier(DEFAULT_ROUTE_RULES)
+
+    def classify(self, path, user_agent=MOBILE_UA, **headers):
+        return self.routes.classify(RequestFactory().get(path, HTTP_USER_AGENT=user_agent, **headers))
+
+    def test_pages_are_tracked(self):
+        self.assertEqual(self.classify('/'), (TRACK, None))
+        self.assertEqual(self.classify('/courses/python/'), (TRACK, None))
+
+    def test_static_admin_and_beacons_are_ignored(self):
+        self.assertEqual(self.classify('/static/css/site.css'), (IGNORE, 'static'))
+        self.assertEqual(self.classify('/media/books/cover.jpg'), (IGNORE, 'static'))
+        self.assertEqual(self.classify('/admin/analytics/'), (IGNORE, 'admin'))
+        self.assertEqual(self.classify('/api/analytics/engagement/'), (IGNORE, 'analytics_api'))
+
+    def test_ads_ajax_and_bots_are_counted(self):
+        self.assertEqual(self.classify('/ads/render/header/'), (COUNT, 'ads'))
+        self.assertEqual(self.classify('/books/', HTTP_X_REQUESTED_WITH='XMLHttpRequest'), (COUNT, 'ajax'))
+        self.assertEqual(self.classify('/books/', user_agent=BOT_UA), (COUNT, 'bots'))
+
+    def test_path_rules_win_over_request_checks(self):
+        # طلب روبوت لملف ثابت يُتجاهل ولا يُعد
+        self.assertEqual(self.classify('/static/app.js', user_agent=BOT_UA), (IGNORE, 'static'))
+
+    def test_actions_are_configurable(self):
+        routes = RouteClassifier([('health', r'^/health/', IGNORE)], bot_action=IGNORE, ajax_action=TRACK)
+        request = RequestFactory().get('/books/', HTTP_USER_AGENT=BOT_UA)
+        self.assertEqual(routes.classify(request), (IGNORE, 'bots'))
+        ajax = RequestFactory().get('/books/', HTTP_USER_AGENT=MOBILE_UA, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(routes.classify(ajax), (TRACK, 'ajax'))
+        self.assertEqual(RouteClassifier([]).classify_path('/admin/'), (TRACK, None))
+
+
+@override_settings(CACHES=CACHES)
+class RouteCountsTests(SimpleTestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.day = datetime(2026, 5, 1).date()
+
+    def test_counts_accumulate_per_day_and_route(self):
+        record_route_counts({'ads': 3, 'bots': 1}, day=self.day)
+        record_route_counts({'ads': 2}, day=self.day)
+        record_route_counts({'ads': 7}, day=self.day + timedelta(days=1))
+
+        counts = get_route_counts(day=self.day, routes=['ads', 'bots', 'ajax'])
+        self.assertEqual(counts, {'ads': 5, 'bots': 1, 'ajax': 0})
+
+    def test_buffer_counts_are_flushed_to_the_cache(self):
+        buffer = EventBuffer()
+        buffer._ensure_thread = lambda: None
+        for _ in range(4):
+            buffer.count('ads')
+        buffer.count('unsampled')
+
+        with mock.patch('analytics.ingest.get_top_pages_tracker'):
+            buffer.flush()
+
+        counts = get_route_counts(routes=['ads', 'unsampled'])
+        self.assertEqual(counts, {'ads': 4, 'unsampled': 1})
+
+
+def visitor_session(start, **kwargs):
+    values = dict(
+        ip_address='10.0.0.1', user_agent='test-agent', device_type='mobile', browser='Chrome', os='Android',
+        landing_page='https://kunooz.com/', start_time=start, page_count=0,
+    )
+    values.update(kwargs)
+    return VisitorSession.objects.create(**values)
+
+
+class SessionizeTests(TestCase):
+    def test_return_visit_does_not_add_time_to_the_previous_exit(self):
+        start = django_timezone.now() - timedelta(days=4)
+        session = visitor_session(start, page_count=3)
+        back = start + timedelta(days=3)
+        PageView.objects.bulk_create([
+            PageView(session=session, url='https://kunooz.com/', title='a', timestamp=start, time_spent=timedelta(0)),
+            PageView(session=session, url='https://kunooz.com/b/', title='b', timestamp=start + timedelta(seconds=40),
+                     time_spent=timedelta(0)),
+            PageView(session=session, url='https://kunooz.com/c/', title='c', timestamp=back, time_spent=timedelta(0)),
+        ])
+
+        self.assertEqual(sessionize(now=back + timedelta(hours=1)), (1, 3))
+
+        session.refresh_from_db()
+        self.assertFalse(session.is_active)
+        self.assertEqual(session.total_time_spent, timedelta(seconds=40))
+        self.assertEqual(session.end_time, back)
+        views = list(session.pageviews.order_by('timestamp').values_list('time_spent', 'is_exit', 'is_bounce'))
+        self.assertEqual(views, [
+            (timedelta(seconds=40), False, False),
+            (timedelta(0), True, False),
+            (timedelta(0), True, True),
+        ])
+        # إعادة التشغيل لا تغير شيئاً
+        self.assertEqual(sessionize(now=back + timedelta(hours=2)), (0, 0))
+
+
+
+@override_settings(CACHES=CACHES)
+class RollupTests(TestCase):
+    def setUp(self):
+        self.country = Country.objects.create(code='EG', name='مصر')
+        # منتصف اليوم المحلي حتى لا تعبر المشاهدات حدود الأيام
+        today = django_timezone.localdate()
+        self.now = django_timezone.make_aware(datetime.combine(today, datetime.min.time()) + timedelta(hours=12))
+        self.days = [self.now - timedelta(days=offset) for offset in (3, 2, 1)]
+        for index, start in enumerate(self.days):
+            weight = 2.0 if index == 1 else 1.0
+            self.add_session(start, pages=index + 1, sample_weight=weight, country=self.country)
+            self.add_session(start + timedelta(hours=1), pages=1, sample_weight=weight)
+
+    def add_session(self, start, pages, **kwargs):
+        session = visitor_session(start, page_count=pages, **kwargs)
+        PageView.objects.bulk_create([
+            PageView(session=session, url=f'https://kunooz.com/books/{page}/', title='b',
+                     timestamp=start + timedelta(minutes=page), time_spent=timedelta(0))
+            for page in range(pages)
+        ])
+        return session
+
+    def site_rows(self):
+        return list(SiteAnalytics.objects.order_by('date').values_list(
+            'date', 'page_views', 'unique_visitors', 'sessions', 'bounce_rate', 'avg_session_duration', 'books_views',
+        ))
+
+    def test_rerunning_does_not_duplicate_or_change_rows(self):
+        run_rollups(now=self.now)
+        site = self.site_rows()
+        hourly = HourlyAnalytics.objects.count()
+        countries = CountryAnalytics.objects.count()
+
+        # بعد العلامة المائية لا يبقى إلا اليوم الحالي
+        self.assertEqual(pending_days('site_analytics', self.now + timedelta(minutes=5)), [self.now.date()])
+        run_rollups(now=self.now + timedelta(minutes=5))
+
+        self.assertEqual(self.site_rows(), site)
+        self.assertEqual(len(site), 4)
+        self.assertEqual(HourlyAnalytics.objects.count(), hourly)
+        self.assertEqual(CountryAnalytics.objects.count(), countries)
+
+    def test_hourly_rows_match_sessions(self):
+        run_rollups(now=self.now)
+        run_rollups(now=self.now + timedelta(minutes=5))
+
+        rows = HourlyAnalytics.objects.filter(date=self.days[1].date()).order_by('hour')
+        self.assertEqual(
+            list(rows.values_list('hour', 'sessions', 'page_views', 'bounces')),
+            [(12, 2.0, 4.0, 0.0), (13, 2.0, 2.0, 2.0)],
+        )
+        totals = HourlyAnalytics.objects.aggregate(sessions=Sum('sessions'), views=Sum('page_views'))
+        self.assertEqual(totals['sessions'], VisitorSession.objects.aggregate(n=Sum('sample_weight'))['n'])
+        self.assertEqual(totals['views'], PageView.objects.aggregate(n=Sum('session__sample_weight'))['n'])
+
+    def test_country_details_come_from_the_daily_rows(self):
+        run_rollups(now=self.now)
+
+        with CaptureQueriesContext(connection) as queries:
+            details = get_country_details(self.country, self.days[0].date())
+
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(details['device_distribution'], [{'device_type': 'mobile', 'count': 4}])
+        self.assertEqual(details['time_distribution'], [{'hour': 12, 'count': 4}])
+        self.assertEqual(
+            [(page['url'], page['views']) for page in details['popular_pages']],
+            [('https://kunooz.com/books/0/', 4), ('https://kunooz.com/books/1/', 3), ('https://kunooz.com/books/2/', 1)],
+        )
+        self.assertEqual([day['sessions'] for day in details['daily']], [1, 2, 1])
+
+    def test_export_totals_do_not_scan_raw_tables(self):
+        run_rollups(now=self.now)
+        self.client.force_login(User.objects.create_user('staff'))
+        buffer = EventBuffer()
+        buffer._ensure_thread = lambda: None
+
+        with mock.patch('analytics.middleware.get_event_buffer', return_value=buffer), \
+                CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('export_analytics', args=['csv']))
+
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        self.assertIn('إجمالي الجلسات,8', content)
+        self.assertIn('إجمالي مشاهدات الصفحات,12', content)
+        raw = [query['sql'] for query in queries if 'analytics_visitorsession' in query['sql']
+               or 'analytics_pageview' in query['sql']]
+        self.assertEqual(raw, [])
+
+    def test_page_metrics_and_landing_pages_come_from_rollups(self):
+        run_rollups(now=self.now)
+        pages = [{'url': 'https://kunooz.com/books/0/'}, {'url': 'https://kunooz.com/missing/'}]
+
+        with CaptureQueriesContext(connection) as queries:
+            add_page_metrics(pages, self.days[0].date())
+            landing = get_landing_pages(self.days[0].date())
+
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(pages[0]['avg_time'], timedelta(seconds=22.5))
+        self.assertEqual(pages[0]['bounce_rate'], 5 / 8)
+        self.assertEqual((pages[1]['avg_time'], pages[1]['bounce_rate']), (timedelta(0), 0))
+        self.assertEqual(landing, [{'landing_page': 'https://kunooz.com/', 'count': 8, 'avg_time': timedelta(seconds=30)}])
+
+    def test_full_run_totals_match_raw_data(self):
+        run_rollups(now=self.now)
+        # مشاهدة متأخرة ليوم قديم خارج نطاق العلامة المائية
+        late = VisitorSession.objects.filter(start_time__lt=self.days[1]).first()
+        PageView.objects.create(session=late, url='https://kunooz.com/', title='late',
+                                timestamp=self.days[0] + timedelta(minutes=30), time_spent=timedelta(0))
+        run_rollups(now=self.now + timedelta(minutes=5))
+        views = PageView.objects.aggregate(n=Sum('session__sample_weight'))['n']
+        self.assertEqual(SiteAnalytics.objects.aggregate(n=Sum('page_views'))['n'], views - 1)
+
+        run_rollups(now=self.now + timedelta(minutes=10), full=True)
+
+        sessions = VisitorSession.objects.aggregate(n=Sum('sample_weight'))['n']
+        self.assertEqual(SiteAnalytics.objects.aggregate(n=Sum('page_views'))['n'], views)
+        self.assertEqual(SiteAnalytics.objects.aggregate(n=Sum('sessions'))['n'], sessions)
+        self.assertEqual(SiteAnalytics.objects.aggregate(n=Sum('books_views'))['n'], views - 1)
+        self.assertEqual(DeviceAnalytics.objects.aggregate(n=Sum('sessions'))['n'], sessions)
+        self.country.refresh_from_db()
+        self.assertEqual(self.country.visits, VisitorSession.objects.filter(country=self.country).aggregate(
+            n=Sum('sample_weight'))['n'])
+
+
+@override_settings(CACHES=CACHES)
+@mock.patch('analytics.snapshot.dashboard_refresh_interval', return_value=30)
+class DashboardSnapshotTests(SimpleTestCase):
+    def setUp(self):
+        self.snapshot = DashboardSnapshot(key='test:snapshot', lock_key='test:snapshot:lock', wait_timeout=2)
+        self.addCleanup(cache.delete_many, ['test:snapshot', 'test:snapshot:lock'])
+        self.builds = 0
+
+    def slow_builder(self, release=None):
+        def builder():
+            self.builds += 1
+            if release is not None:
+                release.wait(2)
+            else:
+                time.sleep(0.2)
+            return {'builds': self.builds}
+        return builder
+
+    def stale(self):
+        cache.set('test:snapshot', {'built_at': time.time() - 60, 'interval': 30, 'data': 'stale'})
+
+    def test_concurrent_misses_build_once(self, _):
+        results = []
+        builder = self.slow_builder()
+        # مثيلان منفصلان كعاملين مختلفين يتشاركان الكاش
+        workers = [self.snapshot, DashboardSnapshot(key='test:snapshot', lock_key='test:snapshot:lock')]
+        threads = [
+            threading.Thread(target=lambda s=s: results.append(s.get(builder)['data']))
+            for s in workers * 4
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.builds, 1)
+        self.assertEqual(results, [{'builds': 1}] * 8)
+
+    def test_stale_snapshot_is_served_while_rebuilding(self, _):
+        self.stale()
+        release = threading.Event()
+        rebuilding = threading.Thread(target=self.snapshot.get, args=(self.slow_builder(release),))
+        rebuilding.start()
+        try:
+            while not self.builds:
+                time.sleep(0.01)
+            started = time.monotonic()
+            # نفس العملية، ثم عامل آخر يجد قفل الكاش
+            self.assertEqual(self.snapshot.get(self.slow_builder())['data'], 'stale')
+            other = DashboardSnapshot(key='test:snapshot', lock_key='test:snapshot:lock')
+            self.assertEqual(other.get(self.slow_builder())['data'], 'stale')
+            self.assertLess(time.monotonic() - started, 0.1)
+        finally:
+            release.set()
+            rebuilding.join()
+        self.assertEqual(self.builds, 1)
+        self.assertEqual(self.snapshot.get(self.slow_builder())['data'], {'builds': 1})
+
+    def test_wait_stops_when_the_other_build_fails(self, _):
+        cache.set('test:snapshot:lock', 'other', 60)
+        threading.Timer(0.1, cache.delete, args=('test:snapshot:lock',)).start()
+        started = time.monotonic()
+
+        self.assertEqual(self.snapshot.get(self.slow_builder())['data'], {'builds': 1})
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_wait_is_bounded_and_keeps_the_other_lock(self, _):
+        cache.set('test:snapshot:lock', 'other', 60)
+        self.snapshot.wait_timeout = 0.3
+        started = time.monotonic()
+
+        self.assertEqual(self.snapshot.get(self.slow_builder())['data'], {'builds': 1})
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(cache.get('test:snapshot:lock'), 'other')
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.country = Country.objects.create(code='EG', name='مصر')
+        self.now = django_timezone.now()
+        self.month = django_timezone.localdate(self.now).replace(day=1)
+        for _ in range(15):
+            self.month = (self.month - timedelta(days=1)).replace(day=1)
+        start = django_timezone.make_aware(datetime.combine(self.month, datetime.min.time())) + timedelta(days=3)
+        for index in range(2):
+            session = visitor_session(start + timedelta(hours=index), page_count=2, country=self.country,
+                                      total_time_spent=timedelta(seconds=40))
+            PageView.objects.bulk_create([
+                PageView(session=session, url=f'https://kunooz.com/{page}/', title='p', view_id=uuid.uuid4(),
+                         timestamp=session.start_time + timedelta(seconds=page * 40), time_spent=timedelta(seconds=40))
+                for page in range(2)
+            ])
+        self.recent = visitor_session(self.now - timedelta(days=40))
+        for name in ROLLUPS:
+            set_watermark(name, self.now)
+
+    def month_rows(self):
+        start, end = month_bounds(self.month)
+        sessions = VisitorSession.objects.filter(start_time__gte=start, start_time__lt=end)
+        return (
+            list(sessions.order_by('pk').values_list('pk', 'session_id', 'start_time', 'total_time_spent', 'country_id')),
+            list(PageView.objects.filter(session__in=sessions).order_by('pk').values_list(
+                'pk', 'session_id', 'url', 'timestamp', 'time_spent', 'view_id',
+            )),
+        )
+
+    def status(self):
+        return load_manifest(self.root)['months'][month_key(self.month)]['status']
+
+    def test_round_trip_restores_the_same_rows(self):
+        sessions, views = self.month_rows()
+
+        files = export_month(self.month, self.root)
+        self.assertEqual((files['sessions']['rows'], files['pageviews']['rows']), (2, 4))
+        self.assertEqual(self.status(), 'archived')
+
+        self.assertEqual(purge_month(self.month, self.root, batch_size=1), 2)
+        self.assertEqual(self.status(), 'purged')
+        self.assertEqual(self.month_rows(), ([], []))
+        self.assertTrue(VisitorSession.objects.filter(pk=self.recent.pk).exists())
+
+        self.assertEqual(rehydrate_month(self.month, self.root), {'sessions': 2, 'pageviews': 4})
+        self.assertEqual(self.status(), 'rehydrated')
+        self.assertEqual(self.month_rows(), (sessions, views))
+
+        # شهر مستعاد يمكن حذفه مرة أخرى، أما المحذوف فلا يُكتب فوق أرشيفه
+        purge_month(self.month, self.root)
+        with self.assertRaises(ValueError):
+            export_month(self.month, self.root)
+
+    def test_months_inside_the_retention_window_are_not_archivable(self):
+        visitor_session(self.now - timedelta(days=400))
+        months = archivable_months(now=self.now, retention_months=13)
+
+        self.assertEqual(months[0], self.month)
+        cutoff = django_timezone.localdate(self.now).replace(day=1)
+        for _ in range(13):
+            cutoff = (cutoff - timedelta(days=1)).replace(day=1)
+        self.assertTrue(all(month < cutoff for month in months))
+        self.assertEqual(archivable_months(now=self.now, retention_months=20), [])
+
+        # تجميع لم يعمل بعد يمنع الأرشفة
+        RealTimeStat.objects.filter(name__startswith='rollup_watermark:page').delete()
+        self.assertEqual(archivable_months(now=self.now, retention_months=13), [])
+
+    def test_purge_refuses_a_file_that_does_not_match_the_manifest(self):
+        files = export_month(self.month, self.root)
+        path = os.path.join(self.root, files['pageviews']['path'])
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            lines = f.readlines()
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            f.writelines(lines[:-1])
+
+        with self.assertRaises(ValueError):
+            purge_month(self.month, self.root)
+        self.assertEqual(self.status(), 'archived')
+        self.assertEqual(len(self.month_rows()[1]), 4)
+
+    def test_purge_refuses_rows_added_after_the_export(self):
+        export_month(self.month, self.root)
+        session = VisitorSession.objects.exclude(pk=self.recent.pk).first()
+        PageView.objects.create(session=session, url='https://kunooz.com/late/', title='late',
+                                timestamp=session.start_time, time_spent=timedelta(0))
+
+        with self.assertRaises(ValueError):
+            purge_month(self.month, self.root)
+        self.assertEqual(len(self.month_rows()[1]), 5)
+
+    def test_interrupted_purge_is_resumed_without_rewriting_the_archive(self):
+        files = export_month(self.month, self.root)
+        manifest = load_manifest(self.root)
+        manifest['months'][month_key(self.month)]['status'] = 'purging'
+        save_manifest(manifest, self.root)
+        VisitorSession.objects.filter(pk=self.month_rows()[0][0][0]).delete()
+
+        self.assertEqual(archive_months([self.month], self.root), {month_key(self.month): 2})
+        self.assertEqual(self.status(), 'purged')
+        self.assertEqual(load_manifest(self.root)['months'][month_key(self.month)]['files'], files)
+        self.assertEqual(self.month_rows(), ([], []))
+
+
+class PartitioningTests(TestCase):
+    def test_partitioning_is_a_no_op_outside_postgresql(self):
+        if connection.vendor == 'postgresql':
+            self.skipTest('SQLite behaviour')
+        month = django_timezone.localdate().replace(day=1)
+
+        self.assertFalse(partitioning_enabled())
+        self.assertEqual(ensure_partitions(months_ahead=3), 0)
+        ensure_month_partition(month)
+        self.assertEqual(drop_partitions_before(month), [])
+        with self.assertRaises(RuntimeError):
+            convert_to_partitioned('analytics_pageview')
+
+    def test_view_id_is_unique_per_timestamp(self):
+        session = visitor_session(django_timezone.now())
+        view_id, when = uuid.uuid4(), django_timezone.now()
+        PageView.objects.create(session=session, url='https://kunooz.com/', title='a', timestamp=when,
+                                time_spent=timedelta(0), view_id=view_id)
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            PageView.objects.create(session=session, url='https://kunooz.com/', title='a', timestamp=when,
+                                    time_spent=timedelta(0), view_id=view_id)
+        # مشاهدات بدون معرف (طلبات POST) لا تتعارض
+        for _ in range(2):
+            PageView.objects.create(session=session, url='https://kunooz.com/', title='a', timestamp=when,
+                                    time_spent=timedelta(0))
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'Partitioning needs PostgreSQL')
+class PostgresPartitioningTests(TestCase):
+    def rows_in(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {connection.ops.quote_name(name)}')
+            return cursor.fetchone()[0]
+
+    def test_new_partition_takes_its_rows_from_the_default(self):
+        session = visitor_session(django_timezone.now())
+        now = django_timezone.now()
+        PageView.objects.create(session=session, url='https://kunooz.com/', title='a', timestamp=now,
+                                time_spent=timedelta(0), view_id=uuid.uuid4())
+        # مفاتيح أجنبية مؤجلة معلقة داخل معاملة الاختبار تمنع ALTER TABLE
+        connection.check_constraints()
+        self.assertTrue(convert_to_partitioned('analytics_pageview', months_ahead=0))
+
+        # مشاهدة بعد آخر قسم شهري تذهب إلى القسم الافتراضي
+        later = django_timezone.localdate(now).replace(day=1) + timedelta(days=100)
+        view_id = uuid.uuid4()
+        PageView.objects.create(session=session, url='https://kunooz.com/', title='b', time_spent=timedelta(0),
+                                timestamp=django_timezone.make_aware(datetime.combine(later, datetime.min.time())),
+                                view_id=view_id)
+        self.assertEqual(self.rows_in('analytics_pageview_default'), 1)
+        connection.check_constraints()
+
+        month = later.replace(day=1)
+        self.assertTrue(create_partition('analytics_pageview', month))
+        self.assertFalse(create_partition('analytics_pageview', month))
+        self.assertEqual(self.rows_in('analytics_pageview_default'), 0)
+        self.assertEqual(self.rows_in(f'analytics_pageview_{month:%Y_%m}'), 1)
+        self.assertEqual(PageView.objects.count(), 2)
+
+        # القيد (view_id, timestamp) باقٍ بعد التقسيم
+        view = PageView.objects.get(view_id=view_id)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            PageView.objects.create(session=session, url=view.url, title='c', timestamp=view.timestamp,
+                                    time_spent=timedelta(0), view_id=view_id)
+
+class EngagementBeaconTests(SimpleTestCase):
+    view_id = '8d2c1a0e-59b4-4c7e-9a55-2f1b6f0b7c11'
+
+    def setUp(self):
+        self.buffer = EventBuffer()
+        self.buffer._ensure_thread = lambda: None
+        patcher = mock.patch('analytics.views.get_event_buffer', return_value=self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, body, **extra):
+        request = RequestFactory().post('/api/analytics/engagement/', body, content_type='text/plain', **extra)
+        return engagement_beacon(request)
+
+    def test_valid_beacon_is_buffered(self):
+        response = self.post(json.dumps([{'v': self.view_id, 's': 60, 't': 4000}]))
+
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.buffer._engagement[self.view_id][:2], [60, 4000])
+
+    def test_malformed_content_length_is_rejected(self):
+        self.assertEqual(self.post('[]', CONTENT_LENGTH='abc').status_code, 400)
+        self.assertEqual(self.post('[]', CONTENT_LENGTH='-1').status_code, 400)
+
+    def test_oversized_body_is_rejected_even_without_a_content_length(self):
+        body = json.dumps([{'v': self.view_id, 's': 1, 't': 1}] * 400)
+        self.assertEqual(self.post(body).status_code, 413)
+
+        # جسم بدون طول معلن (chunked أو ASGI): الحد يُطبق على ما يُقرأ فعلاً
+        request = RequestFactory().post('/api/analytics/engagement/', '', content_type='text/plain', CONTENT_LENGTH='')
+        request._stream = io.BytesIO(body.encode())
+        self.assertEqual(engagement_beacon(request).status_code, 413)
+        self.assertEqual(self.buffer._engagement, {})
+
+
+async def async_page(request):
+    return HttpResponse('ok')
+
+
+urlpatterns = [path('async-page/', async_page)]
+
+
+@override_settings(
+    ROOT_URLCONF='analytics.tests',
+    CACHES=CACHES,
+    SESSION_ENGINE='django.contrib.sessions.backends.cache',
+    MIDDLEWARE=[
+        'django.contrib.sessions.middleware.SessionMiddleware',
+        'django.contrib.auth.middleware.AuthenticationMiddleware',
+        'analytics.middleware.AdvancedAnalyticsMiddleware',
+    ],
+)
+class AsyncTrackingTests(TestCase):
+    async def test_event_is_buffered_without_delaying_the_response(self):
+        buffer = EventBuffer()
+        buffer._ensure_thread = lambda: None
+
+        def slow_device_info(middleware, user_agent):
+            # تحليل User-Agent وقراءة GeoIP عمليات حاجبة
+            time.sleep(0.5)
+            return {'device_type': 'mobile', 'browser': 'Chrome', 'os': 'Android'}
+
+        with mock.patch('analytics.middleware.get_event_buffer', return_value=buffer), \
+                mock.patch.object(AdvancedAnalyticsMiddleware, 'get_device_info', slow_device_info):
+            started = time.monotonic()
+            response = await AsyncClient().get('/async-page/', HTTP_USER_AGENT=MOBILE_UA)
+            elapsed = time.monotonic() - started
+
+            for _ in range(100):
+                if len(buffer):
+                    break
+                await asyncio.sleep(0.02)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(elapsed, 0.4)
+        [event] = buffer.drain()
+        self.assertEqual(event.url, 'http://testserver/async-page/')
+        self.assertEqual(event.device_info['device_type'], 'mobile')
+
+    async def test_each_request_is_classified_once(self):
+        buffer = EventBuffer()
+        buffer._ensure_thread = lambda: None
+
+        with mock.patch('analytics.middleware.get_event_buffer', return_value=buffer), \
+                mock.patch.object(RouteClassifier, 'classify_path', autospec=True,
+                                  side_effect=RouteClassifier.classify_path) as classify_path:
+            await AsyncClient().get('/async-page/', HTTP_USER_AGENT=MOBILE_UA)
+            await AsyncClient().get('/async-page/', HTTP_USER_AGENT=BOT_UA)
+
+        self.assertEqual(classify_path.call_count, 2)
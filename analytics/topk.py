@@ -0,0 +1,214 @@
+# analytics/topk.py
+"""
+أكثر الصفحات مشاهدة بدون المرور على جدول PageView.
+
+لكل يوم ملخص Space-Saving بسعة ثابتة (K عداد): الصفحة الجديدة عند امتلاء
+الملخص تأخذ مكان أقل عداد وترث قيمته كخطأ أقصى، فالصفحات الأكثر مشاهدة
+تبقى دائماً والعد لا يقل عن الحقيقي إلا بمقدار الخطأ المسجل.
+
+الإدخال يجمع المشاهدات في الذاكرة، وكل CHECKPOINT_SECONDS تُدمج في ملخص
+اليوم المحفوظ في RealTimeStat (داخل معاملة بقفل الصف حتى لا يكتب عاملان
+فوق بعضهما) وتُنسخ في الكاش للقراءة. نافذة اليوم/7/30 يوماً = دمج ملخصات
+أيامها.
+"""
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import RealTimeStat
+from .utils import analytics_setting
+
+logger = logging.getLogger(__name__)
+
+TOP_PAGES_PREFIX = 'top_pages'
+TOP_PAGES_CACHE_PREFIX = 'analytics:top_pages'
+
+WINDOWS = {'today': 1, '7d': 7, '30d': 30}
+
+
+class SpaceSaving:
+    """ملخص Space-Saving: {المفتاح: [العدد، الخطأ الأقصى]} بحد أقصى capacity مفتاح"""
+
+    def __init__(self, capacity=200, counters=None):
+        self.capacity = capacity
+        self.counters = counters if counters is not None else {}
+
+    def __len__(self):
+        return len(self.counters)
+
+    def offer(self, key, weight=1.0):
+        counter = self.counters.get(key)
+        if counter is not None:
+            counter[0] += weight
+            return
+        if len(self.counters) < self.capacity:
+            self.counters[key] = [weight, 0.0]
+            return
+        # استبدال أقل عداد: المفتاح الجديد يرث قيمته كخطأ
+        victim = min(self.counters, key=lambda k: self.counters[k][0])
+        floor = self.counters.pop(victim)[0]
+        self.counters[key] = [floor + weight, floor]
+
+    def floor(self):
+        """أقصى عدد ممكن لمفتاح غير موجود: أقل عداد إذا امتلأ الملخص، وإلا صفر"""
+        if not self.counters or len(self.counters) < self.capacity:
+            return 0.0
+        return min(count for count, _ in self.counters.values())
+
+    def merge(self, other):
+        """دمج ملخص آخر ثم الإبقاء على أكبر capacity عداد
+
+        المفتاح الغائب عن أحد الملخصين قد يكون عُد فيه ثم أُزيح، فيُضاف إليه
+        أقل عداد ذلك الملخص (إذا كان ممتلئاً) كعدد وكخطأ، حتى يبقى الحد الأعلى صحيحاً
+        """
+        own_floor, other_floor = self.floor(), other.floor()
+        if other_floor:
+            for key, counter in self.counters.items():
+                if key not in other.counters:
+                    counter[0] += other_floor
+                    counter[1] += other_floor
+        for key, (count, error) in other.counters.items():
+            counter = self.counters.get(key)
+            if counter is None:
+                self.counters[key] = [count + own_floor, error + own_floor]
+            else:
+                counter[0] += count
+                counter[1] += error
+        if len(self.counters) > self.capacity:
+            kept = sorted(self.counters.items(), key=lambda item: item[1][0], reverse=True)[:self.capacity]
+            self.counters = dict(kept)
+        return self
+
+    def top(self, k):
+        """[(المفتاح، العدد، الخطأ)] مرتبة تنازلياً"""
+        items = sorted(self.counters.items(), key=lambda item: item[1][0], reverse=True)[:k]
+        return [(key, count, error) for key, (count, error) in items]
+
+    def to_dict(self):
+        return {'capacity': self.capacity, 'counters': self.counters}
+
+    @classmethod
+    def from_dict(cls, data, capacity=200):
+        data = data or {}
+        return cls(data.get('capacity', capacity), {key: list(value) for key, value in data.get('counters', {}).items()})
+
+
+class TopPagesTracker:
+    """تجميع مشاهدات الصفحات من الإدخال وحفظها في ملخصات يومية"""
+
+    def __init__(self, capacity=200, checkpoint_seconds=10, retention_days=31):
+        self.capacity = capacity
+        self.checkpoint_seconds = checkpoint_seconds
+        self.retention_days = retention_days
+        # {date: {url: weight}} منذ آخر حفظ
+        self._pending = {}
+        self._titles = {}
+        self._last_checkpoint = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, url, title, weight, timestamp):
+        day = timezone.localdate(timestamp)
+        with self._lock:
+            counts = self._pending.setdefault(day, {})
+            counts[url] = counts.get(url, 0.0) + weight
+            self._titles[url] = title
+
+    def checkpoint(self, force=False):
+        """دمج المشاهدات المعلقة في ملخصات الأيام (مرة كل checkpoint_seconds)"""
+        if not force and time.monotonic() - self._last_checkpoint < self.checkpoint_seconds:
+            return 0
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            titles, self._titles = self._titles, {}
+            self._last_checkpoint = time.monotonic()
+
+        for day, counts in pending.items():
+            try:
+                self.save_day(day, counts, titles)
+            except Exception:
+                logger.exception('Failed to checkpoint top pages for %s', day)
+        if pending:
+            self.prune()
+        return len(pending)
+
+    def save_day(self, day, counts, titles):
+        with transaction.atomic():
+            stat, _ = RealTimeStat.objects.select_for_update().get_or_create(name=day_key(day))
+            sketch = SpaceSaving.from_dict(stat.value.get('sketch'), self.capacity)
+            for url, weight in counts.items():
+                sketch.offer(url, weight)
+            day_titles = stat.value.get('titles', {})
+            day_titles.update((url, titles[url]) for url in counts if url in titles)
+            stat.value = {
+                'sketch': sketch.to_dict(),
+                # العناوين للصفحات الموجودة في الملخص فقط
+                'titles': {url: day_titles[url] for url in sketch.counters if url in day_titles},
+            }
+            stat.save(update_fields=['value', 'updated_at'])
+        cache.set(day_cache_key(day), stat.value, self.checkpoint_seconds * 6)
+
+    def prune(self):
+        """حذف ملخصات الأيام الأقدم من أطول نافذة"""
+        oldest = day_key(timezone.localdate() - timedelta(days=self.retention_days))
+        RealTimeStat.objects.filter(name__startswith=f'{TOP_PAGES_PREFIX}:', name__lt=oldest).delete()
+
+    def load_days(self, days):
+        """{day: value} من الكاش أولاً ثم RealTimeStat لما لم يوجد"""
+        keys = {day_cache_key(day): day for day in days}
+        found = {keys[key]: value for key, value in cache.get_many(list(keys)).items()}
+        missing = [day for day in days if day not in found]
+        if missing:
+            names = {day_key(day): day for day in missing}
+            for name, value in RealTimeStat.objects.filter(name__in=list(names)).values_list('name', 'value'):
+                found[names[name]] = value
+                cache.set(day_cache_key(names[name]), value, self.checkpoint_seconds * 6)
+        return found
+
+    def top(self, window='30d', k=10):
+        """[{'url', 'title', 'views', 'error'}] لأكثر k صفحات في النافذة"""
+        today = timezone.localdate()
+        days = [today - timedelta(days=offset) for offset in range(WINDOWS[window])]
+
+        merged = SpaceSaving(self.capacity)
+        titles = {}
+        for value in self.load_days(days).values():
+            merged.merge(SpaceSaving.from_dict(value.get('sketch'), self.capacity))
+            titles.update(value.get('titles', {}))
+
+        return [
+            {'url': url, 'title': titles.get(url, ''), 'views': round(count), 'error': round(error)}
+            for url, count, error in merged.top(k)
+        ]
+
+    def invalidate(self, days):
+        cache.delete_many([day_cache_key(day) for day in days])
+
+
+def day_key(day):
+    return f'{TOP_PAGES_PREFIX}:{day.isoformat()}'
+
+
+def day_cache_key(day):
+    return f'{TOP_PAGES_CACHE_PREFIX}:{day.isoformat()}'
+
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+
+def get_top_pages_tracker():
+    """متتبع أكثر الصفحات المشترك لهذه العملية"""
+    global _tracker
+    if _tracker is None:
+        with _tracker_lock:
+            if _tracker is None:
+                _tracker = TopPagesTracker(
+                    capacity=analytics_setting('TOP_PAGES_CAPACITY', 200),
+                    checkpoint_seconds=analytics_setting('TOP_PAGES_CHECKPOINT_SECONDS', 10),
+                )
+    return _tracker
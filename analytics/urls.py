@@ -28,6 +28,7 @@ urlpatterns = [
     
     # تصدير البيانات
     path('export/<str:format>/', views.export_analytics, name='export_analytics'),
+    path('export/raw/<str:kind>/<str:format>/', views.export_raw_analytics, name='export_raw_analytics'),
     
     # الإعدادات
     path('settings/', views.analytics_settings, name='analytics_settings'),
@@ -1,4 +1,69 @@
 from ipaddress import ip_address
+from collections import OrderedDict
+import threading
+import time
+from django.conf import settings
+
+
+def analytics_setting(name, default=None):
+    """قراءة قيمة من ANALYTICS_SETTINGS مع قيمة افتراضية"""
+    return getattr(settings, 'ANALYTICS_SETTINGS', {}).get(name, default)
+
+
+class LRUCache:
+    """كاش LRU محدود الحجم وآمن للخيوط مع صلاحية اختيارية وإحصائيات الإصابة"""
+    
+    def __init__(self, maxsize=10000, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def __len__(self):
+        return len(self._data)
+    
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and (entry[0] is None or entry[0] > time.monotonic()):
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+    
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+    
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return entry[1] if entry is not None else default
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+    
+    def stats(self):
+        """إحصائيات الكاش (الحجم ونسبة الإصابة)"""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': (self.hits / lookups) if lookups else 0.0,
+        }
 
 def get_country_from_ip(ip):
     """تحديد الدولة من عنوان IP (نسخة مبسطة)"""
@@ -1,21 +1,28 @@
 # analytics/views.py
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.db.models import (
     Count, Sum, Avg, Min, Max, Q, F, 
     DurationField, ExpressionWrapper, 
-    Case, When, FloatField, Value
+    Case, When, FloatField, IntegerField, Value
 )
 from django.contrib.auth.decorators import login_required, user_passes_test
 from .models import *
+from .ingest import get_event_buffer, parse_engagement
+from .presence import get_presence_store, fill_missing_profiles, from_score
+from .hyperloglog import HyperLogLog
+from .snapshot import get_dashboard_snapshot
+from .topk import get_top_pages_tracker
+from .sampling import weighted_avg_duration, weighted_count
+from .utils import analytics_setting
 from django.utils import timezone
 from django.contrib.auth.models import User
 from core.models import *  # استبدل بما يتناسب مع مشروعك
 from django.db.models.functions import (
     TruncDate, TruncHour, TruncDay, TruncWeek,
-    TruncMonth, TruncYear, Concat, Extract
+    TruncMonth, TruncYear, Concat, Extract, Cast, Round
 )
 from datetime import datetime, timedelta, date
 import json
@@ -23,14 +30,6 @@ import pytz
 from collections import defaultdict
 
 # ===== دوال مساعدة =====
-def calculate_bounce_rate():
-    """حساب معدل الارتداد"""
-    total_sessions = VisitorSession.objects.count()
-    bounce_sessions = VisitorSession.objects.filter(page_count=1).count()
-    
-    return (bounce_sessions / total_sessions * 100) if total_sessions > 0 else 0
-
-
 def calculate_start_date(period):
     """حساب تاريخ البدء بناءً على الفترة"""
     today = timezone.now().date()
@@ -50,39 +49,173 @@ def calculate_start_date(period):
     else:
         return today - timedelta(days=30)
 
+def get_rollup_totals(start_date=None, day=None):
+    """الإجماليات من التجميعات اليومية (SiteAnalytics) بدلاً من الجداول الأصلية
+
+    مع day تُضاف قيم ذلك اليوم (day_sessions و day_page_views) في نفس الاستعلام
+    """
+    rows = SiteAnalytics.objects.all()
+    if start_date is not None:
+        rows = rows.filter(date__gte=start_date)
+    
+    totals = rows.aggregate(
+        total_sessions=Sum('sessions', default=0),
+        total_page_views=Sum('page_views', default=0),
+        day_sessions=Sum('sessions', filter=Q(date=day), default=0),
+        day_page_views=Sum('page_views', filter=Q(date=day), default=0),
+        session_time=Sum(ExpressionWrapper(
+            F('avg_session_duration') * Cast('sessions', FloatField()), output_field=DurationField()
+        )),
+        bounces=Sum(F('bounce_rate') * Cast('sessions', FloatField()), output_field=FloatField()),
+    )
+    sessions = totals['total_sessions']
+    
+    return {
+        'sessions': sessions,
+        'page_views': totals['total_page_views'],
+        'avg_session_duration': (totals['session_time'] / sessions) if sessions else timedelta(0),
+        'bounce_rate': (totals['bounces'] / sessions) if sessions else 0,
+        'day_sessions': totals['day_sessions'],
+        'day_page_views': totals['day_page_views'],
+    }
+
+
+def get_unique_visitors(start_date, end_date=None):
+    """الزوار الفريدون في نطاق أيام من اتحاد ملخصات HyperLogLog اليومية (خطأ ≈ 1.6%)"""
+    rows = DailyVisitorSketch.objects.filter(date__gte=start_date)
+    if end_date is not None:
+        rows = rows.filter(date__lte=end_date)
+    rows = list(rows.values_list('registers', 'sessions', 'weight'))
+    
+    sessions = sum(row[1] for row in rows)
+    if not sessions:
+        return 0
+    weight = sum(row[2] for row in rows)
+    union = HyperLogLog.union(HyperLogLog.from_bytes(row[0]) for row in rows)
+    
+    # التقدير للزوار المسجلين في العينة، مضروباً في متوسط الوزن
+    return round(union.count() * weight / sessions)
+
+
+def sum_hourly_rollups(group_by, start_date=None):
+    """مجاميع HourlyAnalytics مجمعة حسب 'hour' أو 'date' (24 صفاً لكل يوم كحد أقصى)"""
+    rows = HourlyAnalytics.objects.all()
+    if start_date is not None:
+        rows = rows.filter(date__gte=start_date)
+    
+    return rows.values(group_by).annotate(
+        weight=Sum('sessions'),
+        weighted_pages=Sum('page_views'),
+        duration=Sum('total_duration'),
+        bounce_weight=Sum('bounces'),
+    ).order_by(group_by)
+
+
+def rollup_bucket(rows):
+    """دمج صفوف sum_hourly_rollups في قيم للعرض"""
+    sessions = sum(row['weight'] for row in rows)
+    duration = sum((row['duration'] or timedelta(0) for row in rows), timedelta(0))
+    return {
+        'sessions': round(sessions),
+        'pageviews': round(sum(row['weighted_pages'] for row in rows)),
+        'avg_duration': duration / sessions if sessions else timedelta(0),
+        'bounce_rate': sum(row['bounce_weight'] for row in rows) / sessions if sessions else 0,
+    }
+
+
+def sum_device_rollups(group_by, start_date=None, end_date=None):
+    """مجاميع DeviceAnalytics مجمعة حسب 'device_type' أو 'browser' أو 'os' لنطاق أيام"""
+    rows = DeviceAnalytics.objects.all()
+    if start_date is not None:
+        rows = rows.filter(date__gte=start_date)
+    if end_date is not None:
+        rows = rows.filter(date__lte=end_date)
+    
+    return rows.values(group_by).annotate(
+        weight=Sum('sessions'),
+        weighted_pages=Sum('page_views'),
+        duration=Sum('total_duration'),
+        bounce_weight=Sum('bounces'),
+    ).order_by('-weight')
+
+
+def get_device_breakdown(start_date=None, end_date=None, limit=10):
+    """توزيع الأجهزة والمتصفحات وأنظمة التشغيل من التجميعات اليومية"""
+    devices = [
+        {
+            'device_type': row['device_type'],
+            'count': round(row['weight']),
+            'avg_time': row['duration'] / row['weight'] if row['weight'] else timedelta(0),
+            'bounce_rate': row['bounce_weight'] / row['weight'] if row['weight'] else 0,
+        }
+        for row in sum_device_rollups('device_type', start_date, end_date)
+    ]
+    browsers = [
+        {'browser': row['browser'], 'count': round(row['weight'])}
+        for row in sum_device_rollups('browser', start_date, end_date)[:limit]
+    ]
+    operating_systems = [
+        {'os': row['os'], 'count': round(row['weight'])}
+        for row in sum_device_rollups('os', start_date, end_date)[:limit]
+    ]
+    return devices, browsers, operating_systems
+
+
+def parse_day(value):
+    """تاريخ YYYY-MM-DD من معاملات الطلب (None إذا كان فارغاً أو غير صالح)"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+    except ValueError:
+        return None
+
+
 def get_monthly_analytics():
+    """اتجاه آخر 12 شهراً من التجميعات اليومية"""
     monthly = (
-        VisitorSession.objects
+        SiteAnalytics.objects
         .annotate(
-            year=Extract('start_time', 'year'),
-            month=Extract('start_time', 'month'),
-            is_bounce=Case(
-                When(pageviews=1, then=1),
-                default=0,
-                output_field=FloatField()
-            )
+            year=Extract('date', 'year'),
+            month=Extract('date', 'month'),
         )
         .values('year', 'month')
         .annotate(
-            sessions=Count('id'),
-            pageviews=Sum('pageviews'),
-            avg_duration=Avg('total_time_spent'),
-            bounce_rate=Avg('is_bounce')  # ✅ هنا الصح
+            month_sessions=Sum('sessions'),
+            pageviews=Sum('page_views'),
+            session_time=Sum(ExpressionWrapper(
+                F('avg_session_duration') * Cast('sessions', FloatField()), output_field=DurationField()
+            )),
+            bounces=Sum(F('bounce_rate') * Cast('sessions', FloatField()), output_field=FloatField()),
         )
         .order_by('-year', '-month')[:12]
     )
+    
+    return [
+        {
+            'year': m['year'],
+            'month': m['month'],
+            'sessions': m['month_sessions'],
+            'pageviews': m['pageviews'],
+            'avg_duration': (m['session_time'] / m['month_sessions']) if m['month_sessions'] else timedelta(0),
+            'bounce_rate': (m['bounces'] / m['month_sessions'] / 100) if m['month_sessions'] else 0,
+        }
+        for m in monthly
+    ]
+
+def get_top_countries(limit=20):
+    """أكثر الدول زيارة: الإجمالي من عدادات Country وآخر 30 يوماً من CountryAnalytics"""
+    return list(Country.objects.annotate(
+        total_visits=F('visits'),
+        total_time=F('total_time_spent'),
+        recent_visits=Cast(Round(Sum('daily_stats__sessions', filter=Q(
+            daily_stats__date__gte=timezone.now().date() - timedelta(days=30)
+        ), default=0.0)), output_field=IntegerField()),
+    ).order_by('-visits')[:limit])
 
-    return list(monthly)
 
-def get_countries_data():
+def get_countries_data(countries=None):
     """الحصول على بيانات الدول"""
-    countries = Country.objects.annotate(
-        total_visits=Count('visitorsession'),
-        total_time=Sum('visitorsession__total_time_spent'),
-        recent_visits=Count('visitorsession', filter=Q(
-            visitorsession__start_time__gte=timezone.now() - timedelta(days=30)
-        )),
-    ).order_by('-total_visits')[:20]
+    if countries is None:
+        countries = get_top_countries()
     
     result = []
     total_all_visits = Country.objects.aggregate(total=Sum('visits'))['total'] or 1
@@ -103,39 +236,64 @@ def get_countries_data():
 def get_time_analytics():
     """تحليل البيانات الزمنية"""
     # توزيع الزيارات على ساعات اليوم
-    hourly = VisitorSession.objects.annotate(
-        hour=Extract('start_time', 'hour')
-    ).values('hour').annotate(
-        count=Count('id'),
-        avg_duration=Avg('total_time_spent')
-    ).order_by('hour')
-    
-    # توزيع على أيام الأسبوع
-    weekday = VisitorSession.objects.annotate(
-        weekday=Extract('start_time', 'week_day')  # 1=Sunday, 7=Saturday
-    ).values('weekday').annotate(
-        count=Count('id')
-    ).order_by('weekday')
+    hourly = []
+    for row in sum_hourly_rollups('hour'):
+        bucket = rollup_bucket([row])
+        hourly.append({'hour': row['hour'], 'count': bucket['sessions'], 'avg_duration': bucket['avg_duration']})
+    
+    # توزيع على أيام الأسبوع (1=Sunday, 7=Saturday)
+    weekday = [
+        {'weekday': day + 1, 'count': bucket['sessions']}
+        for day, bucket in enumerate(weekday_buckets(None))
+        if bucket['sessions']
+    ]
     
     return {
-        'hourly': list(hourly),
-        'weekday': list(weekday),
+        'hourly': hourly,
+        'weekday': weekday,
     }
 
 
-def get_top_pages():
-    """أفضل الصفحات مشاهدة"""
-    top_pages = PageView.objects.values('url', 'title').annotate(
-        views=Count('id'),
-        avg_time=Avg('time_spent'),
-        bounce_rate=Avg(Case(
-            When(is_bounce=True, then=1),
-            default=0,
-            output_field=FloatField()
-        ))
-    ).order_by('-views')[:10]
-    
-    return list(top_pages)
+def get_top_pages(window='30d', k=10):
+    """أفضل الصفحات مشاهدة من ملخص أكثر الصفحات (بدون المرور على PageView)"""
+    return get_top_pages_tracker().top(window, k)
+
+
+def add_page_metrics(top_pages, start_date):
+    """متوسط الوقت ومعدل الارتداد لصفحات محددة فقط من التجميع اليومي PageAnalytics"""
+    metrics = {
+        row['url']: row
+        for row in PageAnalytics.objects.filter(
+            url__in=[page['url'] for page in top_pages],
+            date__gte=start_date,
+        ).values('url').annotate(
+            weight=Sum('views'),
+            duration=Sum('total_time'),
+            bounce_weight=Sum('bounces'),
+        ).order_by()
+    }
+    for page in top_pages:
+        row = metrics.get(page['url'])
+        weight = row['weight'] if row else 0
+        page['avg_time'] = row['duration'] / weight if weight else timedelta(0)
+        page['bounce_rate'] = row['bounce_weight'] / weight if weight else 0
+    return top_pages
+
+
+def get_landing_pages(start_date, limit=10):
+    """صفحات الهبوط الأكثر شيوعاً من التجميع اليومي PageAnalytics"""
+    rows = PageAnalytics.objects.filter(date__gte=start_date, entrances__gt=0).values('url').annotate(
+        weight=Sum('entrances'),
+        duration=Sum('entrance_duration'),
+    ).order_by('-weight')[:limit]
+    return [
+        {
+            'landing_page': row['url'],
+            'count': round(row['weight']),
+            'avg_time': row['duration'] / row['weight'] if row['weight'] else timedelta(0),
+        }
+        for row in rows
+    ]
 
 
 def get_recent_sessions():
@@ -170,18 +328,16 @@ def calculate_country_trend(country_code, period):
     else:
         return 0
     
-    # الزيارات في الفترة الحالية
-    current_visits = VisitorSession.objects.filter(
-        country__code=country_code,
-        start_time__gte=current_start
-    ).count()
-    
-    # الزيارات في الفترة السابقة
-    previous_visits = VisitorSession.objects.filter(
+    # الزيارات في الفترتين من التجميع اليومي للدولة في استعلام واحد
+    visits = CountryAnalytics.objects.filter(
         country__code=country_code,
-        start_time__gte=previous_start,
-        start_time__lt=current_start
-    ).count()
+        date__gte=previous_start,
+    ).aggregate(
+        current=Sum('sessions', filter=Q(date__gte=current_start), default=0.0),
+        previous=Sum('sessions', filter=Q(date__lt=current_start), default=0.0),
+    )
+    current_visits = visits['current']
+    previous_visits = visits['previous']
     
     if previous_visits > 0:
         return ((current_visits - previous_visits) / previous_visits * 100)
@@ -191,6 +347,40 @@ def calculate_country_trend(country_code, period):
         return 0
 
 
+def get_country_details(country, start_date, limit=10):
+    """أكثر الصفحات وتوزيع الأجهزة والساعات لدولة من CountryAnalytics (صف لكل يوم)"""
+    pages = defaultdict(float)
+    titles = {}
+    devices = defaultdict(float)
+    hours = [0.0] * 24
+    daily = []
+    
+    for row in CountryAnalytics.objects.filter(country=country, date__gte=start_date).order_by('date'):
+        daily.append({'date': row.date, 'sessions': round(row.sessions), 'pageviews': round(row.page_views)})
+        for url, title, views in row.top_pages:
+            pages[url] += views
+            titles.setdefault(url, title)
+        for device_type, weight in row.devices.items():
+            devices[device_type] += weight
+        for hour, weight in enumerate(row.hours):
+            hours[hour] += weight
+    
+    return {
+        'popular_pages': [
+            {'url': url, 'title': titles[url], 'views': round(views)}
+            for url, views in sorted(pages.items(), key=lambda item: -item[1])[:limit]
+        ],
+        'device_distribution': [
+            {'device_type': device_type, 'count': round(weight)}
+            for device_type, weight in sorted(devices.items(), key=lambda item: -item[1])
+        ],
+        'time_distribution': [
+            {'hour': hour, 'count': round(weight)} for hour, weight in enumerate(hours) if weight
+        ],
+        'daily': daily,
+    }
+
+
 def get_country_coordinates(country_code, coord_type='lat'):
     """الحصول على إحداثيات الدولة"""
     coordinates = {
@@ -215,26 +405,13 @@ def get_country_coordinates(country_code, coord_type='lat'):
 
 
 def get_hourly_analytics(start_date):
-    """تحليل بيانات الساعات"""
-    hourly = VisitorSession.objects.filter(
-        start_time__gte=start_date
-    ).annotate(
-        hour=Extract('start_time', 'hour')
-    ).values('hour').annotate(
-        sessions=Count('id'),
-        pageviews=Sum('pageviews'),
-        avg_duration=Avg('total_time_spent')
-    ).order_by('hour')
-    
-    # ملء الساعات الفارصة
+    """تحليل بيانات الساعات (من HourlyAnalytics)"""
+    hourly = {row['hour']: [row] for row in sum_hourly_rollups('hour', start_date)}
+    
+    # ملء الساعات الفارغة
     result = []
     for hour in range(24):
-        data = next((h for h in hourly if h['hour'] == hour), {
-            'hour': hour,
-            'sessions': 0,
-            'pageviews': 0,
-            'avg_duration': timedelta(0),
-        })
+        data = rollup_bucket(hourly.get(hour, []))
         
         result.append({
             'hour': hour,
@@ -248,44 +425,33 @@ def get_hourly_analytics(start_date):
 
 
 def get_daily_analytics(start_date):
-    """تحليل بيانات الأيام"""
-    daily = VisitorSession.objects.filter(
-        start_time__gte=start_date
-    ).annotate(
-        date=TruncDate('start_time')
-    ).values('date').annotate(
-        sessions=Count('id'),
-        pageviews=Count('pageview'),
-        avg_duration=Avg('total_time_spent'),
-        unique_visitors=Count('ip_address', distinct=True)
+    """تحليل بيانات الأيام (من SiteAnalytics)"""
+    daily = SiteAnalytics.objects.filter(
+        date__gte=start_date
+    ).values(
+        'date', 'sessions', 'unique_visitors',
+        pageviews=F('page_views'),
+        avg_duration=F('avg_session_duration'),
     ).order_by('date')
     
     return list(daily)
 
 
+def weekday_buckets(start_date):
+    """قيم كل يوم من أيام الأسبوع (0=الأحد) من مجاميع الأيام في HourlyAnalytics"""
+    days = [[] for _ in range(7)]
+    for row in sum_hourly_rollups('date', start_date):
+        # Python: الإثنين=0، والمطلوب الأحد=0
+        days[(row['date'].weekday() + 1) % 7].append(row)
+    return [rollup_bucket(rows) for rows in days]
+
+
 def get_weekday_analytics(start_date):
     """تحليل بيانات أيام الأسبوع"""
     weekdays_arabic = ['الأحد', 'الإثنين', 'الثلاثاء', 'الأربعاء', 'الخميس', 'الجمعة', 'السبت']
     
-    weekday = VisitorSession.objects.filter(
-        start_time__gte=start_date
-    ).annotate(
-        weekday=Extract('start_time', 'week_day') - 1  # تعديل ليتوافق مع Python (0=Sunday)
-    ).values('weekday').annotate(
-        sessions=Count('id'),
-        pageviews=Count('pageview'),
-        avg_duration=Avg('total_time_spent')
-    ).order_by('weekday')
-    
     result = []
-    for day in range(7):
-        data = next((w for w in weekday if w['weekday'] == day), {
-            'weekday': day,
-            'sessions': 0,
-            'pageviews': 0,
-            'avg_duration': timedelta(0),
-        })
-        
+    for day, data in enumerate(weekday_buckets(start_date)):
         result.append({
             'day': day,
             'day_name': weekdays_arabic[day],
@@ -327,50 +493,46 @@ def calculate_avg_duration(start_date):
     avg = VisitorSession.objects.filter(
         start_time__gte=start_date
     ).aggregate(
-        avg=Avg('total_time_spent')
+        avg=weighted_avg_duration('total_time_spent')
     )['avg']
     
     return avg or timedelta(0)
 
 
 def get_realtime_visitors():
-    """الحصول على الزوار المتصلين حالياً"""
-    # الزوار النشطين خلال آخر 5 دقائق
-    active_threshold = timezone.now() - timedelta(minutes=5)
-    
-    realtime_visitors = RealTimeVisitor.objects.filter(
-        last_activity__gte=active_threshold
-    ).select_related('session', 'session__country')
+    """الحصول على الزوار المتصلين حالياً (من مخزن الحضور بدلاً من جدول RealTimeVisitor)"""
+    now = timezone.now()
+    visitors = fill_missing_profiles(get_presence_store().active())
     
     visitors_data = []
     
-    for rv in realtime_visitors:
-        time_on_page = rv.time_on_page.total_seconds()
-        session = rv.session
+    for visitor in visitors:
+        last_activity = from_score(visitor['last_activity'])
+        started = visitor.get('started')
         
         visitors_data.append({
-            'session_id': str(session.session_id),
-            'current_page': rv.current_page,
-            'time_on_page': time_on_page,
-            'country': session.country.name if session.country else 'غير معروف',
-            'flag': session.country.flag_emoji if session.country else '🌐',
-            'city': session.city,
-            'device': session.device_type,
-            'browser': session.browser,
-            'is_new': (timezone.now() - session.start_time).seconds < 60,  # أقل من دقيقة
-            'last_activity': rv.last_activity,
+            'session_id': visitor['visitor_id'],
+            'current_page': visitor.get('current_page'),
+            'time_on_page': (now - last_activity).total_seconds(),
+            'country': visitor.get('country') or 'غير معروف',
+            'flag': visitor.get('flag') or '🌐',
+            'city': visitor.get('city'),
+            'device': visitor.get('device'),
+            'browser': visitor.get('browser'),
+            'is_new': started is not None and now.timestamp() - started < 60,  # أقل من دقيقة
+            'last_activity': last_activity,
         })
     
     return visitors_data
 
 
-def calculate_geographic_data():
-    """حساب البيانات الجغرافية"""
-    countries = Country.objects.annotate(
-        visits_count=Count('visitorsession')
-    ).order_by('-visits_count')[:10]
+def calculate_geographic_data(countries=None):
+    """حساب البيانات الجغرافية (أول 10 من get_top_countries)"""
+    if countries is None:
+        countries = get_top_countries(10)
+    countries = countries[:10]
     
-    total_visits = sum(c.visits_count for c in countries)
+    total_visits = sum(c.total_visits for c in countries)
     
     geographic_data = {
         'countries': [
@@ -378,17 +540,17 @@ def calculate_geographic_data():
                 'name': c.name,
                 'code': c.code,
                 'flag': c.flag_emoji,
-                'visits': c.visits_count,
-                'percentage': (c.visits_count / total_visits * 100) if total_visits > 0 else 0,
+                'visits': c.total_visits,
+                'percentage': (c.total_visits / total_visits * 100) if total_visits > 0 else 0,
                 'avg_time': str(c.avg_time_spent()),
             }
             for c in countries
         ],
-        'total_countries': countries.count(),
+        'total_countries': len(countries),
         'total_visits': total_visits,
         'top_country': {
             'name': countries[0].name if countries else 'لا توجد بيانات',
-            'visits': countries[0].visits_count if countries else 0,
+            'visits': countries[0].total_visits if countries else 0,
         }
     }
     
@@ -396,77 +558,61 @@ def calculate_geographic_data():
 
 
 # ===== Views الرئيسية =====
-@login_required
-def advanced_analytics_dashboard(request):
-    """لوحة تحليلات متقدمة مع خرائط وتقارير مفصلة"""
-    # حساب الإحصائيات الأساسية
+def build_dashboard_snapshot():
+    """بيانات اللوحة المتقدمة (ما عدا الزوار الحاليين) بأقل عدد من الاستعلامات"""
     today = timezone.now().date()
-    yesterday = today - timedelta(days=1)
-    
-    # إحصائيات إجمالية
-    total_sessions = VisitorSession.objects.count()
-    active_sessions = VisitorSession.objects.filter(is_active=True).count()
-    total_pageviews = PageView.objects.count()
-    today_pageviews = PageView.objects.filter(timestamp__date=today).count()
-    
-    # حساب متوسط مدة الجلسة
-    avg_duration_agg = VisitorSession.objects.aggregate(
-        avg=Avg('total_time_spent')
-    )
-    avg_session_duration = avg_duration_agg['avg'] or timedelta(0)
     
-    # حساب معدل الارتداد
-    bounce_rate = calculate_bounce_rate()
-    
-    stats = {
-        'total_sessions': total_sessions,
-        'active_sessions': active_sessions,
-        'total_pageviews': total_pageviews,
-        'today_pageviews': today_pageviews,
-        'avg_session_duration': avg_session_duration,
-        'bounce_rate': bounce_rate,
-    }
+    # إحصائيات إجمالية وإحصائيات اليوم من التجميعات اليومية في استعلام واحد
+    totals = get_rollup_totals(day=today)
     
-    # بيانات الرسم البياني للشهر
-    monthly_data = get_monthly_analytics()
+    # الجلسات النشطة فقط من الجدول الأصلي (فهرس is_active)
+    active_sessions = VisitorSession.objects.filter(is_active=True).aggregate(
+        n=weighted_count()
+    )['n']
     
-    # بيانات الدول
-    countries_data = get_countries_data()
-    
-    # بيانات الوقت
-    time_analytics = get_time_analytics()
-    
-    # أفضل الصفحات
-    top_pages = get_top_pages()
-    
-    # أحدث الجلسات
-    recent_sessions = get_recent_sessions()
-    
-    # الزوار المتصلين حالياً
-    realtime_visitors = get_realtime_visitors()
-    
-    # البيانات الجغرافية
-    geographic_data = calculate_geographic_data()
+    # استعلام واحد للدول يخدم قائمة الدول والبيانات الجغرافية
+    countries = get_top_countries()
     
     # بيانات الإحصائيات حسب الوقت
-    hourly_data = get_hourly_analytics(timezone.now().date() - timedelta(days=7))
+    hourly_data = get_hourly_analytics(today - timedelta(days=7))
     
-    # أوقات الذروة
-    peak_time_data = calculate_peak_time(hourly_data, 'hour')
+    return {
+        'stats': {
+            'total_sessions': totals['sessions'],
+            'active_sessions': active_sessions,
+            'total_pageviews': totals['page_views'],
+            'today_pageviews': totals['day_page_views'],
+            'avg_session_duration': totals['avg_session_duration'],
+            'bounce_rate': totals['bounce_rate'],
+            'unique_visitors_7d': get_unique_visitors(today - timedelta(days=6)),
+            'unique_visitors_30d': get_unique_visitors(today - timedelta(days=29)),
+        },
+        'monthly_data': get_monthly_analytics(),
+        'countries_data': get_countries_data(countries),
+        'time_analytics': get_time_analytics(),
+        'top_pages': add_page_metrics(get_top_pages(), today - timedelta(days=30)),
+        'recent_sessions': get_recent_sessions(),
+        'geographic_data': calculate_geographic_data(countries),
+        'hourly_data': hourly_data,
+        'peak_time': calculate_peak_time(hourly_data, 'hour'),
+    }
+
+
+@login_required
+def advanced_analytics_dashboard(request):
+    """لوحة تحليلات متقدمة مع خرائط وتقارير مفصلة"""
+    today = timezone.now().date()
+    
+    # البيانات الثقيلة من اللقطة المخزنة (تُحدث كل dashboard_refresh_interval ثانية)
+    snapshot = get_dashboard_snapshot().get(build_dashboard_snapshot)
     
     context = {
-        'stats': stats,
-        'monthly_data': monthly_data,
-        'countries_data': countries_data,
-        'time_analytics': time_analytics,
-        'top_pages': top_pages,
-        'recent_sessions': recent_sessions,
-        'realtime_visitors': realtime_visitors,
-        'geographic_data': geographic_data,
-        'hourly_data': hourly_data,
-        'peak_time': peak_time_data,
+        **snapshot['data'],
+        # الزوار المتصلين حالياً من مخزن الحضور مباشرة
+        'realtime_visitors': get_realtime_visitors(),
+        'snapshot_time': datetime.fromtimestamp(snapshot['built_at'], tz=timezone.get_current_timezone()),
         'today': today,
-        'yesterday': yesterday,
+        'yesterday': today - timedelta(days=1),
         'current_time': timezone.now(),
     }
     
@@ -478,32 +624,27 @@ def simple_analytics_dashboard(request):
     """لوحة تحليلات مبسطة"""
     today = timezone.now().date()
     
-    # الإحصائيات الأساسية
+    # الإحصائيات الأساسية من التجميعات اليومية
+    totals = get_rollup_totals(day=today)
     stats = {
-        'total_visitors': VisitorSession.objects.count(),
-        'today_visitors': VisitorSession.objects.filter(start_time__date=today).count(),
-        'total_pageviews': PageView.objects.count(),
-        'today_pageviews': PageView.objects.filter(timestamp__date=today).count(),
-        'avg_session_time': VisitorSession.objects.aggregate(
-            avg=Avg('total_time_spent')
-        )['avg'] or timedelta(0),
-        'bounce_rate': calculate_bounce_rate(),
+        'total_visitors': totals['sessions'],
+        'today_visitors': totals['day_sessions'],
+        'total_pageviews': totals['page_views'],
+        'today_pageviews': totals['day_page_views'],
+        'avg_session_time': totals['avg_session_duration'],
+        'bounce_rate': totals['bounce_rate'],
     }
     
     # أفضل 5 دول
     top_countries = Country.objects.annotate(
-        visits=Count('visitorsession')
+        total_visits=F('visits')
     ).order_by('-visits')[:5]
     
     # أفضل 5 صفحات
-    top_pages = PageView.objects.values('title', 'url').annotate(
-        views=Count('id')
-    ).order_by('-views')[:5]
+    top_pages = get_top_pages(k=5)
     
     # توزيع الأجهزة
-    devices = VisitorSession.objects.values('device_type').annotate(
-        count=Count('id')
-    ).order_by('-count')
+    devices, _, _ = get_device_breakdown()
     
     context = {
         'stats': stats,
@@ -522,27 +663,11 @@ def country_analytics(request, country_code=None):
     if country_code:
         country = get_object_or_404(Country, code=country_code)
         
-        # إحصائيات الدولة
+        # إحصائيات الدولة: الإجمالي من العدادات والتفاصيل من التجميع اليومي لآخر 30 يوماً
         country_stats = {
-            'total_visits': VisitorSession.objects.filter(country=country).count(),
-            'avg_session_time': VisitorSession.objects.filter(country=country).aggregate(
-                avg=Avg('total_time_spent')
-            )['avg'] or timedelta(0),
-            'popular_pages': PageView.objects.filter(session__country=country).values(
-                'title', 'url'
-            ).annotate(
-                views=Count('id')
-            ).order_by('-views')[:10],
-            'device_distribution': VisitorSession.objects.filter(country=country).values(
-                'device_type'
-            ).annotate(
-                count=Count('id')
-            ).order_by('-count'),
-            'time_distribution': VisitorSession.objects.filter(country=country).annotate(
-                hour=Extract('start_time', 'hour')
-            ).values('hour').annotate(
-                count=Count('id')
-            ).order_by('hour'),
+            'total_visits': country.visits,
+            'avg_session_time': country.avg_time_spent(),
+            **get_country_details(country, timezone.now().date() - timedelta(days=30)),
         }
         
         context = {
@@ -555,10 +680,16 @@ def country_analytics(request, country_code=None):
     else:
         # قائمة جميع الدول
         countries = Country.objects.annotate(
-            total_visits=Count('visitorsession'),
-            avg_time=Avg('visitorsession__total_time_spent'),
-            last_visit=Max('visitorsession__start_time'),
-        ).order_by('-total_visits')
+            total_visits=F('visits'),
+            avg_time=Case(
+                When(visits=0, then=Value(timedelta(0))),
+                default=ExpressionWrapper(
+                    F('total_time_spent') / Cast('visits', FloatField()), output_field=DurationField()
+                ),
+                output_field=DurationField(),
+            ),
+            latest_visit=F('last_visit'),
+        ).order_by('-visits')
         
         context = {
             'countries': countries,
@@ -587,6 +718,8 @@ def time_analytics(request):
         'hourly_data': hourly_data,
         'daily_data': daily_data,
         'weekday_data': weekday_data,
+        # زوار فريدون في الفترة كلها (وليس مجموع الأيام)
+        'unique_visitors': get_unique_visitors(timezone.now().date() - timedelta(days=30)),
         'peak_hourly': peak_hourly,
         'peak_weekday': peak_weekday,
     }
@@ -598,21 +731,11 @@ def time_analytics(request):
 def page_analytics(request):
     """تحليلات الصفحات"""
     # أفضل الصفحات
-    top_pages = PageView.objects.values('title', 'url').annotate(
-        views=Count('id'),
-        avg_time=Avg('time_spent'),
-        bounce_rate=Avg(Case(
-            When(is_bounce=True, then=1),
-            default=0,
-            output_field=FloatField()
-        ))
-    ).order_by('-views')[:20]
+    start_date = timezone.now().date() - timedelta(days=30)
+    top_pages = add_page_metrics(get_top_pages(k=20), start_date)
     
     # صفحات الهبوط الأكثر شيوعاً
-    landing_pages = VisitorSession.objects.values('landing_page').annotate(
-        count=Count('id'),
-        avg_time=Avg('total_time_spent')
-    ).order_by('-count')[:10]
+    landing_pages = get_landing_pages(start_date)
     
     context = {
         'top_pages': top_pages,
@@ -624,32 +747,19 @@ def page_analytics(request):
 
 @login_required
 def device_analytics(request):
-    """تحليلات الأجهزة"""
-    # توزيع الأجهزة
-    devices = VisitorSession.objects.values('device_type').annotate(
-        count=Count('id'),
-        avg_time=Avg('total_time_spent'),
-        bounce_rate=Avg(Case(
-            When(page_count=1, then=1),
-            default=0,
-            output_field=FloatField()
-        ))
-    ).order_by('-count')
-    
-    # توزيع المتصفحات
-    browsers = VisitorSession.objects.values('browser').annotate(
-        count=Count('id')
-    ).order_by('-count')[:10]
-    
-    # توزيع أنظمة التشغيل
-    operating_systems = VisitorSession.objects.values('os').annotate(
-        count=Count('id')
-    ).order_by('-count')[:10]
+    """تحليلات الأجهزة لنطاق أيام اختياري (start و end بصيغة YYYY-MM-DD)"""
+    start_date = parse_day(request.GET.get('start'))
+    end_date = parse_day(request.GET.get('end'))
+    
+    # توزيع الأجهزة والمتصفحات وأنظمة التشغيل من التجميعات اليومية
+    devices, browsers, operating_systems = get_device_breakdown(start_date, end_date)
     
     context = {
         'devices': devices,
         'browsers': browsers,
         'operating_systems': operating_systems,
+        'start_date': start_date,
+        'end_date': end_date,
     }
     
     return render(request, 'analytics/device_analytics.html', context)
@@ -698,9 +808,11 @@ def export_analytics(request, format='csv'):
         
         # إحصائيات عامة
         writer.writerow(['الإحصائيات العامة'])
-        writer.writerow(['إجمالي الجلسات', VisitorSession.objects.count()])
-        writer.writerow(['إجمالي مشاهدات الصفحات', PageView.objects.count()])
-        writer.writerow(['معدل الارتداد', f'{calculate_bounce_rate():.2f}%'])
+        # من التجميعات اليومية (حتى آخر تشغيل لـ rollup_analytics)
+        totals = get_rollup_totals()
+        writer.writerow(['إجمالي الجلسات', totals['sessions']])
+        writer.writerow(['إجمالي مشاهدات الصفحات', totals['page_views']])
+        writer.writerow(['معدل الارتداد', f"{totals['bounce_rate']:.2f}%"])
         writer.writerow([])
         
         # الدول
@@ -708,13 +820,13 @@ def export_analytics(request, format='csv'):
         writer.writerow(['الدولة', 'عدد الزيارات', 'متوسط الوقت'])
         
         countries = Country.objects.annotate(
-            visits=Count('visitorsession')
+            total_visits=F('visits')
         ).order_by('-visits')[:20]
         
         for country in countries:
             writer.writerow([
                 country.name,
-                country.visits,
+                country.total_visits,
                 str(country.avg_time_spent())
             ])
         
@@ -728,6 +840,31 @@ def export_analytics(request, format='csv'):
         return HttpResponse('صيغة غير مدعومة')
 
 
+@login_required
+def export_raw_analytics(request, kind, format='csv'):
+    """تصدير الجلسات أو المشاهدات الأصلية لفترة (start و end بصيغة YYYY-MM-DD)
+    مع مرشحات اختيارية: country و device و url_prefix"""
+    from django.http import StreamingHttpResponse
+    from .export import FORMATS, export_filename, export_queryset, parse_date_range, stream_export
+
+    if kind not in ('sessions', 'pageviews') or format not in FORMATS:
+        return HttpResponse('صيغة غير مدعومة', status=400)
+    try:
+        start, end = parse_date_range(request.GET.get('start'), request.GET.get('end'))
+    except ValueError:
+        return HttpResponse('تاريخ غير صالح', status=400)
+
+    queryset = export_queryset(
+        kind, start, end,
+        country=request.GET.get('country'),
+        device=request.GET.get('device'),
+        url_prefix=request.GET.get('url_prefix'),
+    )
+    response = StreamingHttpResponse(stream_export(kind, format, queryset), content_type=FORMATS[format])
+    response['Content-Disposition'] = f'attachment; filename="{export_filename(kind, format, start, end)}"'
+    return response
+
+
 @login_required
 def realtime_analytics(request):
     """الزوار المتصلين حالياً"""
@@ -773,4 +910,28 @@ def analytics_settings(request):
         'form': form,
     }
     
-    return render(request, 'analytics/settings.html', context)
\ No newline at end of file
+    return render(request, 'analytics/settings.html', context)
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def engagement_beacon(request):
+    """استقبال إشارات التفاعل (navigator.sendBeacon) ودمجها في مخزن الإدخال"""
+    max_bytes = analytics_setting('BEACON_MAX_BYTES', 8192)
+    try:
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return HttpResponse(status=400)
+    if content_length < 0:
+        return HttpResponse(status=400)
+    if content_length > max_bytes:
+        return HttpResponse(status=413)
+    
+    # قراءة محدودة: الطول المعلن قد لا يطابق الجسم الفعلي
+    body = request.read(max_bytes + 1)
+    if len(body) > max_bytes:
+        return HttpResponse(status=413)
+    
+    events = parse_engagement(body, analytics_setting('BEACON_MAX_EVENTS', 20))
+    if events:
+        get_event_buffer().engage(events)
+    return HttpResponse(status=204)
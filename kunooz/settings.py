@@ -76,12 +76,85 @@ SITE_ID = 1
 # إعدادات User Agents
 USER_AGENTS_CACHE = 'default'
 
+# Redis مشترك بين عمال gunicorn (تشغله docker-compose.yml)
+REDIS_URL = config('REDIS_URL', default='')
+
+# 'analytics': كاش خريطة هوية الزوار، مشترك بين العمال عبر Redis.
+# بدون REDIS_URL يكون locmem خاصاً بكل عملية فيبني كل عامل خريطته بنفسه
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'analytics': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+    } if REDIS_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'analytics',
+    },
+}
+
 # إعدادات التحليلات
 ANALYTICS_SETTINGS = {
     'ENABLE_TRACKING': True,
     'STORE_USER_DATA': True,
     'ANONYMIZE_IP': True,
     'COOKIE_DURATION': 365,  # أيام
+
+    # الإدخال المؤجل: تفريغ المخزن كل N حدث أو كل T ميلي ثانية
+    'BUFFER_MAX_EVENTS': 500,
+    'BUFFER_FLUSH_INTERVAL_MS': 1000,
+    'BUFFER_MAX_BACKLOG': 50000,
+
+    # كاش هوية الزوار (مفتاح الجلسة -> VisitorSession): LRU لكل عملية ثم كاش CACHES المشترك
+    'IDENTITY_CACHE_SIZE': 50000,
+    'IDENTITY_CACHE': 'analytics',
+
+    # كاش GeoIP حسب بادئة الشبكة وخريطة أكواد الدول
+    'GEO_CACHE_SIZE': 20000,
+    'COUNTRY_MAP_TTL': 300,  # ثانية
+
+    # كاش تحليل User-Agent
+    'UA_CACHE_SIZE': 5000,
+
+    # تصنيف الطلبات: track / count / ignore
+    # القواعد الافتراضية في analytics.routing.DEFAULT_ROUTE_RULES ويمكن استبدالها بـ 'ROUTE_RULES'
+    'BOT_ACTION': 'count',
+    'AJAX_ACTION': 'count',
+
+    # مخزن الزوار المتصلين: redis (مشترك بين العمال) / memory (لكل عامل) / database (RealTimeVisitor)
+    # docker-compose.yml يشغل Redis ويختاره؛ database افتراضي فقط للتشغيل المحلي بدون Redis
+    'PRESENCE_BACKEND': config('ANALYTICS_PRESENCE_BACKEND', default='database'),
+    'PRESENCE_REDIS_URL': REDIS_URL or 'redis://localhost:6379/0',
+    'PRESENCE_WINDOW': 300,  # ثانية
+
+    # الجلسة تعتبر منتهية بعد هذه المدة بدون مشاهدات (أمر sessionize_pageviews)
+    'SESSION_IDLE_MINUTES': 30,
+
+    # إشارات التفاعل من المتصفح (/api/analytics/engagement/)
+    'BEACON_MAX_BYTES': 8192,
+    'BEACON_MAX_EVENTS': 20,
+
+    # وضع العينة (٪ من الزوار)، مع خفض تلقائي عند تراكم المخزن المؤجل
+    'SAMPLING_RATE': 100,
+    'AUTO_SAMPLING_BACKLOG': 10000,  # حدث معلق
+    'MIN_SAMPLING_RATE': 5,
+
+    # التجميعات اليومية (أمر rollup_analytics)؛ قيمة أكبر من صفر تشغلها دورياً داخل العمال (ثانية)
+    'ROLLUP_INTERVAL': 0,
+    'COUNTRY_TOP_PAGES': 20,  # صفحة لكل (دولة، يوم) في تفاصيل الدولة
+
+    # أكثر الصفحات مشاهدة: عدد العدادات في ملخص كل يوم وفترة حفظه (ثانية)
+    'TOP_PAGES_CAPACITY': 200,
+    'TOP_PAGES_CHECKPOINT_SECONDS': 10,
+
+    # الاحتفاظ بالبيانات الأصلية (أمر archive_analytics)؛ الأقدم يُؤرشف إلى ARCHIVE_ROOT
+    # (الافتراضي MEDIA_ROOT/analytics_archive)
+    'RETENTION_MONTHS': 13,
+    'ARCHIVE_ROOT': config('ANALYTICS_ARCHIVE_ROOT', default=''),
+
+    # PostgreSQL فقط بعد partition_analytics --convert: عدد الأشهر القادمة التي تُنشأ أقسامها مسبقاً
+    'PARTITION_MONTHS_AHEAD': 3,
 }
 
 
@@ -93,7 +166,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'django_user_agents.middleware.UserAgentMiddleware',  # تحليل user agents
+    'analytics.middleware.UserAgentMiddleware',  # تحليل user agents (كاش مشترك مع التحليلات)
     'analytics.middleware.AdvancedAnalyticsMiddleware',  # التحليلات المبسطة
 ]
 
@@ -112,6 +185,7 @@ TEMPLATES = [
                 'django.contrib.messages.context_processors.messages',
                 'core.context_processors.site_settings',
                 'core.context_processors.heroSections',
+                'analytics.context_processors.analytics_beacon',
             ],
         },
     },
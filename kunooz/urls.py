@@ -9,6 +9,7 @@ from django.views.generic import TemplateView
 
 from django.contrib.sitemaps.views import sitemap
 from core.sitemaps import PostSitemap
+from analytics.views import engagement_beacon
 
 sitemaps = {
     "posts": PostSitemap,
@@ -26,6 +27,7 @@ urlpatterns = [
     # تطبيق core
     path('', include('core.urls')),
     path('analytics/', include('analytics.urls')),
+    path('api/analytics/engagement/', engagement_beacon, name='analytics_engagement'),
     path('ads/', include('advertisements.urls')),
 
 ]
@@ -0,0 +1,77 @@
+/**
+ * إشارات التفاعل للتحليلات: عمق التمرير ووقت التفاعل الفعلي للصفحة
+ * تُرسل عند إخفاء الصفحة أو مغادرتها بـ navigator.sendBeacon.
+ * القيم تراكمية، والخادم يدمجها حسب معرف المشاهدة بالقيمة القصوى.
+ */
+(function() {
+    const script = document.currentScript;
+    if (!script || !script.dataset.viewId || !script.dataset.endpoint) {
+        return;
+    }
+
+    const viewId = script.dataset.viewId;
+    const endpoint = script.dataset.endpoint;
+
+    let engagedMs = 0;
+    let visibleSince = document.visibilityState === 'visible' ? performance.now() : null;
+    let maxScroll = 0;
+    let lastSent = '';
+    let scrollScheduled = false;
+
+    const measureScroll = function() {
+        scrollScheduled = false;
+        const doc = document.documentElement;
+        const scrollable = doc.scrollHeight - window.innerHeight;
+        const depth = scrollable > 0
+            ? Math.round((window.scrollY / scrollable) * 100)
+            : 100;
+        maxScroll = Math.max(maxScroll, Math.min(depth, 100));
+    };
+
+    const currentEngagement = function() {
+        let total = engagedMs;
+        if (visibleSince !== null) {
+            total += performance.now() - visibleSince;
+        }
+        return Math.round(total);
+    };
+
+    const send = function() {
+        const payload = JSON.stringify([{ v: viewId, s: maxScroll, t: currentEngagement() }]);
+        // عدم إرسال نفس القيم مرتين
+        if (payload === lastSent) {
+            return;
+        }
+        lastSent = payload;
+
+        const body = new Blob([payload], { type: 'application/json' });
+        if (navigator.sendBeacon && navigator.sendBeacon(endpoint, body)) {
+            return;
+        }
+        fetch(endpoint, { method: 'POST', body: body, keepalive: true, credentials: 'same-origin' })
+            .catch(function() {});
+    };
+
+    window.addEventListener('scroll', function() {
+        if (!scrollScheduled) {
+            scrollScheduled = true;
+            window.requestAnimationFrame(measureScroll);
+        }
+    }, { passive: true });
+
+    document.addEventListener('visibilitychange', function() {
+        if (document.visibilityState === 'hidden') {
+            if (visibleSince !== null) {
+                engagedMs += performance.now() - visibleSince;
+                visibleSince = null;
+            }
+            send();
+        } else {
+            visibleSince = performance.now();
+        }
+    });
+
+    window.addEventListener('pagehide', send);
+
+    measureScroll();
+})();